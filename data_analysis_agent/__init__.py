@@ -5,8 +5,11 @@ Data Analysis Agent Package
 一个基于LLM的智能数据分析代理，专门为Jupyter Notebook环境设计。
 """
 
+import os
+
 from .config.llm_config import LLMConfig
 from .utils.code_executor import CodeExecutor
+from .utils.kernel_pool import KernelPool, get_kernel_pool
 from .data_analysis_agent import DataAnalysisAgent
 
 __version__ = "1.0.0"
@@ -17,10 +20,13 @@ __all__ = [
     "DataAnalysisAgent",
     "LLMConfig", 
     "CodeExecutor",
+    "KernelPool",
+    "get_kernel_pool",
 ]
 
 # 便捷函数
-def create_agent(llm_config=None, output_dir="outputs", max_rounds=30,absolute_path=False):
+def create_agent(llm_config=None, output_dir="outputs", max_rounds=30,absolute_path=False, kernel_pool=None, pipelined=None,
+                 stall_patience=None):
     """
     创建一个数据分析智能体实例
     
@@ -29,15 +35,20 @@ def create_agent(llm_config=None, output_dir="outputs", max_rounds=30,absolute_p
         output_dir: 输出目录
         max_rounds: 最大分析轮数
         session_dir: 指定会话目录（可选，此参数暂不支持）
+        kernel_pool: 预热的隔离内核池（可选）
+        pipelined: 是否启用流水线模式（LLM生成与代码执行重叠），None 时读取环境变量 AGENT_PIPELINED
+        stall_patience: 连续无进展多少轮后提前结束，None 时读取环境变量 AGENT_STALL_PATIENCE
         
     Returns:
         DataAnalysisAgent: 智能体实例
     """
     if llm_config is None:
         llm_config = LLMConfig()
-    return DataAnalysisAgent(llm_config=llm_config, output_dir=output_dir, max_rounds=max_rounds,absolute_path=absolute_path)
+    return DataAnalysisAgent(llm_config=llm_config, output_dir=output_dir, max_rounds=max_rounds,absolute_path=absolute_path,
+                             kernel_pool=kernel_pool, pipelined=pipelined, stall_patience=stall_patience)
 
-def quick_analysis(query,files=None, llm_config=None, output_dir="outputs", max_rounds=10,absolute_path=False):
+def quick_analysis(query,files=None, llm_config=None, output_dir="outputs", max_rounds=10,absolute_path=False, kernel_pool=None,
+                   pipelined=None, stall_patience=None):
     """
     快速数据分析函数
     
@@ -46,9 +57,31 @@ def quick_analysis(query,files=None, llm_config=None, output_dir="outputs", max_
         files: 数据文件路径列表
         output_dir: 输出目录
         max_rounds: 最大分析轮数
+        kernel_pool: 预热的隔离内核池（可选）
+        pipelined: 是否启用流水线模式（可选）
+        stall_patience: 连续无进展多少轮后提前结束（可选）
         
     Returns:
         dict: 分析结果
     """
-    agent = create_agent(llm_config=llm_config, output_dir=output_dir, max_rounds=max_rounds, absolute_path=absolute_path)
+    agent = create_agent(llm_config=llm_config, output_dir=output_dir, max_rounds=max_rounds, absolute_path=absolute_path,
+                         kernel_pool=kernel_pool, pipelined=pipelined, stall_patience=stall_patience)
     return agent.analyze(query, files)
+
+def resume_analysis(session_output_dir, llm_config=None, max_rounds=None, absolute_path=False, kernel_pool=None,
+                    pipelined=None, stall_patience=None):
+    """
+    从中断会话的检查点恢复并继续分析
+    
+    Args:
+        session_output_dir: 之前中断的会话目录（包含 checkpoint/ 子目录）
+        max_rounds: 最大分析轮数，None 时沿用中断会话的设置
+        kernel_pool: 预热的隔离内核池（可选）
+        
+    Returns:
+        dict: 分析结果
+    """
+    output_dir = os.path.dirname(os.path.abspath(session_output_dir))
+    agent = create_agent(llm_config=llm_config, output_dir=output_dir, absolute_path=absolute_path,
+                         kernel_pool=kernel_pool, pipelined=pipelined, stall_patience=stall_patience)
+    return agent.resume(session_output_dir, max_rounds=max_rounds)
@@ -23,6 +23,10 @@ class LLMConfig:
     model: str = os.environ.get("OPENAI_MODEL", "gpt-4-turbo-preview")
     temperature: float = 0.1
     max_tokens: int = 8192
+    # 提示词缓存（可选）：默认只复用原文相同的请求，声明 cache="semantic" 的调用允许近似匹配
+    prompt_cache: bool = os.environ.get("LLM_PROMPT_CACHE", "0") == "1"
+    prompt_cache_dir: str = os.environ.get("LLM_PROMPT_CACHE_DIR", ".llm_cache")
+    prompt_cache_threshold: float = float(os.environ.get("LLM_PROMPT_CACHE_THRESHOLD", "0.9"))
 
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
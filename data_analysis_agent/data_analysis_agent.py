@@ -10,12 +10,18 @@
 import os
 import json
 import yaml
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from .utils.create_session_dir import create_session_output_dir
+from .utils.artifact_store import get_artifact_store, collect_old_sessions
 from .utils.format_execution_result import format_execution_result
 from .utils.extract_code import extract_code_from_response
 from .utils.llm_helper import LLMHelper
 from .utils.code_executor import CodeExecutor
+from .utils.kernel_pool import KernelPool
+from .utils.statement_views import parse_statement_filename
+from .utils.streaming_code import StreamingCodeParser
+from .utils.progress_policy import ProgressTracker, ProgressPolicy
+from .utils.session_checkpoint import save_session_state, load_session_state
 from .config.llm_config import LLMConfig
 from .prompts import data_analysis_system_prompt, final_report_system_prompt,final_report_system_prompt_absolute
 
@@ -33,7 +39,10 @@ class DataAnalysisAgent:
     def __init__(self, llm_config: LLMConfig = None,
                  output_dir: str = "outputs",
                  max_rounds: int = 20,
-                 absolute_path: bool = False):
+                 absolute_path: bool = False,
+                 kernel_pool: Optional[KernelPool] = None,
+                 pipelined: Optional[bool] = None,
+                 stall_patience: Optional[int] = None):
         """
         初始化智能体
         
@@ -41,6 +50,11 @@ class DataAnalysisAgent:
             config: LLM配置
             output_dir: 输出目录
             max_rounds: 最大对话轮数
+            kernel_pool: 预热的隔离内核池，提供时从池中借出内核执行代码，否则在当前进程内执行
+            pipelined: 流水线模式，流式接收LLM响应，代码块完整后立即执行，与后续内容的生成重叠；
+                None 时读取环境变量 AGENT_PIPELINED
+            stall_patience: 连续多少轮没有新产出（图片、变量、新的输出内容）后提前结束并生成报告，
+                代码执行失败的轮次不计入；None 时读取环境变量 AGENT_STALL_PATIENCE（默认3），0表示不启用
         """
         self.config = llm_config or LLMConfig()
         self.llm = LLMHelper(self.config)
@@ -53,13 +67,23 @@ class DataAnalysisAgent:
         self.session_output_dir = None
         self.executor = None
         self.absolute_path = absolute_path
+        self.kernel_pool = kernel_pool
+        self.pipelined = pipelined if pipelined is not None else os.environ.get("AGENT_PIPELINED", "0") == "1"
+        self.stall_patience = stall_patience
+        # 每隔多少轮保存一次会话检查点，0表示不保存
+        self.checkpoint_every = int(os.environ.get("AGENT_CHECKPOINT_EVERY", "1"))
+        self._user_input = None
+        self._files = []
+        self.progress = ProgressTracker()
+        self.rounds_saved = 0
 
-    def _process_response(self, response: str) -> Dict[str, Any]:
+    def _process_response(self, response: str, speculative: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         统一处理LLM响应，判断行动类型并执行相应操作
         
         Args:
             response: LLM的响应内容
+            speculative: 流水线模式下已提前执行的代码及其结果
             
         Returns:
             处理结果字典
@@ -75,14 +99,14 @@ class DataAnalysisAgent:
             elif action == 'collect_figures':
                 return self._handle_collect_figures(response, yaml_data)
             elif action == 'generate_code':
-                return self._handle_generate_code(response, yaml_data)
+                return self._handle_generate_code(response, yaml_data, speculative)
             else:
                 print(f"⚠️ 未知动作类型: {action}，按generate_code处理")
-                return self._handle_generate_code(response, yaml_data)
+                return self._handle_generate_code(response, yaml_data, speculative)
                 
         except Exception as e:
             print(f"⚠️ 解析响应失败: {str(e)}，按generate_code处理")
-            return self._handle_generate_code(response, {})
+            return self._handle_generate_code(response, {}, speculative)
     
     def _handle_analysis_complete(self, response: str, yaml_data: Dict[str, Any]) -> Dict[str, Any]:
         """处理分析完成动作"""
@@ -102,6 +126,10 @@ class DataAnalysisAgent:
         
         collected_figures = []
         
+        # 未保存的图形可能仍在执行器后台写入，收集前先等待写完
+        for path, error in self.executor.flush_figures().items():
+            print(f"   ⚠️ 图片保存失败: {path}，{error}")
+        
         for figure_info in figures_to_collect:
             figure_number = figure_info.get('figure_number')
             filename = figure_info.get('filename', f'figure_{figure_number}.png')
@@ -136,16 +164,22 @@ class DataAnalysisAgent:
             'response': response,  # response 仍然原样保留，若需彻底净化可进一步处理
             'continue': True
         }
-    def _handle_generate_code(self, response: str, yaml_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _handle_generate_code(self, response: str, yaml_data: Dict[str, Any],
+                              speculative: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """处理代码生成和执行动作"""
         # 这里yaml_data是通过yaml.safe_load解析得到的dict对象，确实有get方法
         code = yaml_data.get('code', '')  # yaml_data 是 dict，get方法合法
         if not code:
             code = extract_code_from_response(response)
+        if speculative is not None:
+            # 流水线模式下代码已在响应生成期间执行，记录实际执行的代码
+            if (code or '').strip() != speculative['code'].strip():
+                print("⚠️ 完整响应中的代码与提前执行的代码不一致，以已执行的代码为准")
+            code = speculative['code']
         if code:
             print(f"🔧 执行代码:\n{code}")
             print("-" * 40)
-            result = self.executor.execute_code(code)
+            result = speculative['result'] if speculative is not None else self.executor.execute_code(code)
             feedback = format_execution_result(result)
             print(f"📋 执行反馈:\n{feedback}")
             # 检查代码执行结果中是否有图片生成但文件不存在的情况
@@ -156,12 +190,14 @@ class DataAnalysisAgent:
             # 简单正则或字符串查找图片路径并判断是否存在
             import re
             img_paths = re.findall(r'(?:[\w./\\-]+\.(?:png|jpg|jpeg|svg))', str(output))
+            # 仍在后台写入的自动保存图片视为已生成
+            pending_figures = set(result.get('figures') or [])
             for img_path in img_paths:
                 if not os.path.isabs(img_path):
                     abs_path = os.path.join(self.session_output_dir, img_path)
                 else:
                     abs_path = img_path
-                if not os.path.exists(abs_path):
+                if not os.path.exists(abs_path) and os.path.abspath(abs_path) not in pending_figures:
                     missing_figures.append(img_path)
             if missing_figures:
                 feedback += f"\n⚠️ 检测到以下图片未生成成功: {missing_figures}\n建议重新分析本轮或修正代码后再试。"
@@ -208,25 +244,35 @@ class DataAnalysisAgent:
         self.conversation_history = []
         self.analysis_results = []
         self.current_round = 0
+        self.progress = ProgressTracker()
+        self.rounds_saved = 0
         
-        # 创建本次分析的专用输出目录
-        self.session_output_dir = create_session_output_dir(self.base_output_dir,user_input)
+        self._user_input = user_input
+        self._files = list(files or [])
         
-        # 初始化代码执行器，使用会话目录
-        self.executor = CodeExecutor(self.session_output_dir)
+        # 启用自动清理时按保留策略清理旧的会话目录（每个进程只执行一次），再创建本次分析的专用输出目录
+        collect_old_sessions(self.base_output_dir)
+        self.session_output_dir = create_session_output_dir(self.base_output_dir,user_input)
         
-        # 设置会话目录变量到执行环境中
-        self.executor.set_variable('session_output_dir', self.session_output_dir)
+        loaded_datasets, statement_views_info = self._setup_executor(files)
         
         # 构建初始prompt
         initial_prompt = f"""用户需求: {user_input}"""
         if files:
             initial_prompt += f"\n数据文件: {', '.join(files)}"
+        if loaded_datasets:
+            initial_prompt += "\n以下数据文件已预加载为DataFrame变量，可以直接使用，无需再用pd.read_csv读取:"
+            for var_name, path in loaded_datasets.items():
+                initial_prompt += f"\n- {var_name}: {path}"
+        if statement_views_info:
+            initial_prompt += f"\n{statement_views_info}"
         
         print(f"🚀 开始数据分析任务")
         print(f"📝 用户需求: {user_input}")
         if files:
             print(f"📁 数据文件: {', '.join(files)}")
+        if loaded_datasets:
+            print(f"📦 已预加载 {len(loaded_datasets)} 个数据文件")
         print(f"📂 输出目录: {self.session_output_dir}")
         print(f"🔢 最大轮数: {self.max_rounds}")
         print("=" * 60)
@@ -240,6 +286,113 @@ class DataAnalysisAgent:
             'content': initial_prompt
         })
         
+        try:
+            self._run_rounds()
+        finally:
+            self._release_executor()
+        
+        # 生成最终总结
+        if self.current_round >= self.max_rounds:
+            print(f"\n⚠️ 已达到最大轮数 ({self.max_rounds})，分析结束")
+        
+        return self._generate_final_report()
+    
+    def _setup_executor(self, files: Optional[List[str]]) -> Tuple[Dict[str, str], str]:
+        """
+        为会话目录准备执行环境：借出或创建执行器，预加载数据文件并注册报表视图
+
+        Returns:
+            (预加载的 {变量名: 文件路径}, 报表视图说明)
+        """
+        # 初始化代码执行器，使用会话目录；有内核池时直接借出预热好的内核
+        if self.kernel_pool is not None:
+            self.executor = self.kernel_pool.acquire(self.session_output_dir)
+        else:
+            self.executor = CodeExecutor(self.session_output_dir)
+        
+        # 设置会话目录变量到执行环境中
+        self.executor.set_variable('session_output_dir', self.session_output_dir)
+        
+        # 预加载数据文件为DataFrame，避免每个会话重复解析同一批CSV
+        loaded_datasets = self.executor.load_datasets(files) if files else {}
+        # 输入文件中有财务报表时，为其所在目录的全部报表注册DuckDB视图，便于跨公司SQL查询
+        statement_dirs = sorted({os.path.dirname(os.path.abspath(f)) for f in (files or []) if parse_statement_filename(f)})
+        statement_views_info = self.executor.attach_statement_views(statement_dirs) if statement_dirs else ""
+        return loaded_datasets, statement_views_info
+    
+    def _save_checkpoint(self):
+        """保存会话检查点：对话历史、分析结果和执行环境变量"""
+        try:
+            self.executor.save_checkpoint(self.session_output_dir)
+            save_session_state(self.session_output_dir, {
+                'user_input': self._user_input,
+                'files': self._files,
+                'max_rounds': self.max_rounds,
+                'current_round': self.current_round,
+                'conversation_history': self.conversation_history,
+                'analysis_results': self.analysis_results,
+            })
+        except Exception as e:
+            print(f"⚠️ 保存检查点失败: {str(e)}")
+    
+    def resume(self, session_output_dir: str, max_rounds: Optional[int] = None) -> Dict[str, Any]:
+        """
+        从会话检查点恢复并继续分析
+        
+        重建执行环境（重新预加载数据文件、注册报表视图、恢复检查点中的变量），
+        恢复对话历史和分析结果，从最后一个完成的轮次之后继续，结束后生成最终报告。
+        
+        Args:
+            session_output_dir: 之前中断的会话目录
+            max_rounds: 最大分析轮数，None 时沿用中断会话保存的设置
+            
+        Returns:
+            分析结果字典
+        """
+        state = load_session_state(session_output_dir)
+        self.session_output_dir = os.path.abspath(session_output_dir)
+        self._user_input = state.get('user_input')
+        self._files = state.get('files', [])
+        self.conversation_history = state.get('conversation_history', [])
+        self.analysis_results = state.get('analysis_results', [])
+        self.current_round = state.get('current_round', 0)
+        self.max_rounds = max_rounds if max_rounds is not None else state.get('max_rounds', self.max_rounds)
+        self.progress = ProgressTracker()
+        self.rounds_saved = 0
+        
+        self._setup_executor(self._files)
+        restored = self.executor.restore_checkpoint(self.session_output_dir)
+        
+        print(f"♻️ 从检查点恢复会话: {self.session_output_dir}")
+        print(f"🔢 已完成 {self.current_round} 轮，最大轮数: {self.max_rounds}")
+        print(f"📦 已恢复 {len(restored)} 个变量")
+        print("=" * 60)
+        
+        try:
+            self._run_rounds()
+        finally:
+            self._release_executor()
+        
+        if self.current_round >= self.max_rounds:
+            print(f"\n⚠️ 已达到最大轮数 ({self.max_rounds})，分析结束")
+        
+        return self._generate_final_report()
+    
+    def _release_executor(self):
+        """等待后台图片写入完成，并将借出的内核归还内核池"""
+        if self.executor is None:
+            return
+        try:
+            self.executor.flush_figures()
+        except Exception as e:
+            print(f"⚠️ 等待图片保存失败: {str(e)}")
+        if self.kernel_pool is not None:
+            self.kernel_pool.release(self.executor)
+            self.executor = None
+
+    def _run_rounds(self):
+        """多轮执行：调用LLM、执行代码、回填反馈，直到分析完成、达到最大轮数或进展停滞"""
+        policy = ProgressPolicy(self.stall_patience)
         while self.current_round < self.max_rounds:
             self.current_round += 1
             print(f"\n🔄 第 {self.current_round} 轮分析")
@@ -253,15 +406,22 @@ class DataAnalysisAgent:
                     notebook_variables=notebook_variables
                 )
                 
-                response = self.llm.call(
-                    prompt=self._build_conversation_prompt(),
-                    system_prompt=formatted_system_prompt
-                )
+                speculative = None
+                if self.pipelined:
+                    response, speculative = self._call_llm_pipelined(
+                        prompt=self._build_conversation_prompt(),
+                        system_prompt=formatted_system_prompt
+                    )
+                else:
+                    response = self.llm.call(
+                        prompt=self._build_conversation_prompt(),
+                        system_prompt=formatted_system_prompt
+                    )
                 
                 print(f"🤖 助手响应:\n{response}")
                 
                 # 使用统一的响应处理方法
-                process_result = self._process_response(response)
+                process_result = self._process_response(response, speculative)
                 
                 # 根据处理结果决定是否继续
                 if not process_result.get('continue', True):
@@ -306,6 +466,29 @@ class DataAnalysisAgent:
                         'filtered_figures_to_collect': filtered_figures_to_collect,
                         'response': response
                     })
+                
+                if self.checkpoint_every > 0 and self.current_round % self.checkpoint_every == 0:
+                    self._save_checkpoint()
+                
+                # 根据本轮的新增产出决定是否干预
+                progress = self.progress.record(self.current_round, process_result)
+                decision = policy.decide(self.progress)
+                if decision == ProgressPolicy.FINISH:
+                    self.rounds_saved = self.max_rounds - self.current_round
+                    print(f"\n⏹️ 连续 {self.progress.stalled_rounds()} 轮没有新的图片、变量或结论，提前结束分析，"
+                          f"节省 {self.rounds_saved} 轮")
+                    break
+                if decision == ProgressPolicy.COLLECT_FIGURES:
+                    pending = self.progress.uncollected_figures()
+                    print(f"📌 进展停滞，要求收集已生成的 {len(pending)} 张图片")
+                    self.conversation_history.append({
+                        'role': 'user',
+                        'content': "最近的分析没有产生新的图片、数据或结论。请不要重复之前的分析，"
+                                   "下一步直接使用 collect_figures 收集以下已生成的图片，然后完成分析:\n"
+                                   + "\n".join(f"- {path}" for path in pending)
+                    })
+                elif progress.score == 0:
+                    print(f"📉 本轮没有新的产出（已连续 {self.progress.stalled_rounds()} 轮）")
            
             except Exception as e:
                 error_msg = f"LLM调用错误: {str(e)}"
@@ -314,12 +497,31 @@ class DataAnalysisAgent:
                     'role': 'user',
                     'content': f"发生错误: {error_msg}，请重新生成代码。"
                 })
-        # 生成最终总结
-        if self.current_round >= self.max_rounds:
-            print(f"\n⚠️ 已达到最大轮数 ({self.max_rounds})，分析结束")
-        
-        return self._generate_final_report()
-    
+
+    def _call_llm_pipelined(self, prompt: str, system_prompt: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        流式调用LLM，代码块一旦完整并通过预检查就立即执行
+
+        执行期间后台线程继续接收 next_steps 等后续内容，每轮耗时接近 max(LLM生成, 代码执行)。
+        代码中出现不允许的导入时立即停止生成，交由常规流程返回安全检查错误。
+
+        Returns:
+            (完整响应, 提前执行的 {'code', 'result'}，未提前执行时为None)
+        """
+        parser = StreamingCodeParser(CodeExecutor.ALLOWED_IMPORTS)
+        stream = self.llm.stream_call(prompt=prompt, system_prompt=system_prompt)
+        speculative = None
+        for delta in stream:
+            parser.feed(delta)
+            if parser.unsafe_reason is not None:
+                print(f"⛔ 流式预检查发现问题: {parser.unsafe_reason}，停止生成")
+                stream.cancel()
+                break
+            if speculative is None and parser.code_ready:
+                print("⚡ 代码块已完整，在LLM继续生成的同时执行")
+                speculative = {'code': parser.code, 'result': self.executor.execute_code(parser.code)}
+        return stream.text, speculative
+
     def _build_conversation_prompt(self) -> str:
         """构建对话提示词"""
         prompt_parts = []
@@ -403,6 +605,10 @@ class DataAnalysisAgent:
         except Exception as e:
             print(f"❌ 保存报告文件失败: {str(e)}")
         
+        # 图片已经写完，加入产物存储：内容相同的图片在多次运行之间只保留一份（存储对象只读）。
+        # 报告正文会被用户编辑，保留为独立文件，不加入存储
+        get_artifact_store(self.base_output_dir).ingest([figure.get('file_path') for figure in all_figures])
+        
         # 返回完整的分析结果
         return {
             'session_output_dir': self.session_output_dir,
@@ -411,7 +617,9 @@ class DataAnalysisAgent:
             'collected_figures': all_figures,
             'conversation_history': self.conversation_history,
             'final_report': final_report_content,
-            'report_file_path': report_file_path       
+            'report_file_path': report_file_path,
+            'rounds_saved': self.rounds_saved,
+            'round_progress': [progress.to_dict() for progress in self.progress.rounds]
             }
 
     def _build_final_report_prompt(self, all_figures: List[Dict[str, Any]]) -> str:
@@ -461,4 +669,7 @@ class DataAnalysisAgent:
         self.conversation_history = []
         self.analysis_results = []
         self.current_round = 0
-        self.executor.reset_environment()
+        self.progress = ProgressTracker()
+        self.rounds_saved = 0
+        if self.executor is not None:
+            self.executor.reset_environment()
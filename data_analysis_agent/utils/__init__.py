@@ -6,5 +6,6 @@
 from .code_executor import CodeExecutor
 from .llm_helper import LLMHelper
 from .fallback_openai_client import AsyncFallbackOpenAIClient
+from .kernel_pool import KernelPool, IsolatedKernel
 
-__all__ = ["CodeExecutor", "LLMHelper", "AsyncFallbackOpenAIClient"]
\ No newline at end of file
+__all__ = ["CodeExecutor", "LLMHelper", "AsyncFallbackOpenAIClient", "KernelPool", "IsolatedKernel"]
\ No newline at end of file
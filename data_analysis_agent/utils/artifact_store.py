@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+内容寻址的产物存储
+
+每次分析都会在 outputs/ 下新建一个 session_<uuid> 目录，研报阶段又会把图片复制到 images/ 目录，
+相同的图表在多次运行之间被反复保存，磁盘占用只增不减。
+
+ArtifactStore 以文件内容的 SHA-256 为键保存图片等产物：内容相同的文件只存一份，
+会话目录和 images/ 目录中的文件都改为指向存储对象的硬链接（跨文件系统时退回复制）。
+硬链接数即引用计数，按保留策略删除旧会话目录后，不再被引用的对象随之回收。
+删除旧会话会连同其中的分析报告一起删除，因此默认不执行：设置环境变量 OUTPUT_SESSION_GC=1 后
+分析开始时自动清理，或显式调用 ArtifactStore.collect_garbage。
+
+共享同一对象的文件是同一个inode，对象一律设为只读：对其中任一路径的原地写入会直接报错，
+而不是悄悄改掉其他会话和报告中的同一文件。需要重新生成时应写入新文件后替换（os.replace）。
+会被用户编辑的报告正文不加入存储。
+"""
+
+import os
+import stat
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 会话目录保留策略，可通过环境变量调整；自动清理默认关闭
+SESSION_GC = os.environ.get("OUTPUT_SESSION_GC", "0") == "1"
+RETENTION_DAYS = float(os.environ.get("OUTPUT_RETENTION_DAYS", "7"))
+KEEP_SESSIONS = int(os.environ.get("OUTPUT_KEEP_SESSIONS", "20"))
+
+_CHUNK_SIZE = 1 << 20
+# 存储对象的权限：所有人只读
+_OBJECT_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def file_digest(path: str) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src: str, dst: str) -> bool:
+    """
+    把 src 原子地放到 dst：优先硬链接，跨文件系统时复制
+
+    先链接到临时文件再 os.replace，替换的是目录项而不是写入已有文件，不会改动共享同一inode的其他链接。
+
+    Returns:
+        是否为硬链接
+    """
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp)
+        linked = True
+    except OSError:
+        shutil.copy2(src, tmp)
+        linked = False
+    try:
+        os.replace(tmp, dst)
+    except OSError:
+        os.unlink(tmp)
+        raise
+    return linked
+
+
+def _remove_readonly(func, path, exc_info):
+    """shutil.rmtree 的错误处理：只读文件（Windows 上无法直接删除）先恢复写权限再删除"""
+    try:
+        os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+        func(path)
+    except OSError:
+        pass
+
+
+class ArtifactStore:
+    """按内容哈希保存产物文件的存储"""
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: 存储根目录，应与会话目录位于同一文件系统，才能使用硬链接
+        """
+        self.root = os.path.abspath(root)
+        self.objects_dir = os.path.join(self.root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def object_path(self, digest: str, ext: str = "") -> str:
+        """内容哈希对应的对象路径"""
+        return os.path.join(self.objects_dir, digest[:2], digest + ext.lower())
+
+    def put(self, path: str) -> str:
+        """
+        把文件加入存储，并把原文件替换为指向存储对象的硬链接
+
+        调用时文件应已写完（例如会话结束后的图片）。对象及链接到它的路径随后都是只读的。
+
+        Args:
+            path: 文件路径
+
+        Returns:
+            存储对象路径
+        """
+        digest = file_digest(path)
+        obj = self.object_path(digest, os.path.splitext(path)[1])
+        with self._lock:
+            if not os.path.exists(obj):
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                link_or_copy(path, obj)
+                os.chmod(obj, _OBJECT_MODE)
+                return obj
+            if stat.S_IMODE(os.stat(obj).st_mode) != _OBJECT_MODE:
+                # 早期版本创建的可写对象
+                os.chmod(obj, _OBJECT_MODE)
+            try:
+                if not os.path.samefile(path, obj):
+                    link_or_copy(obj, path)
+            except OSError as e:
+                logger.warning(f"替换为存储对象的链接失败 {path}: {e}")
+        return obj
+
+    def ingest(self, paths: Iterable[str]) -> Dict[str, str]:
+        """
+        批量加入存储，不存在或读取失败的文件会被跳过
+
+        Returns:
+            {文件路径: 存储对象路径}
+        """
+        objects = {}
+        for path in paths:
+            if not path or not os.path.isfile(path):
+                continue
+            try:
+                objects[path] = self.put(path)
+            except OSError as e:
+                logger.warning(f"加入产物存储失败 {path}: {e}")
+        return objects
+
+    def link(self, src: str, dst: str) -> str:
+        """
+        把 src 的内容放到 dst：先加入存储，再从存储对象硬链接到 dst，代替复制
+
+        Returns:
+            存储对象路径
+        """
+        obj = self.put(src)
+        link_or_copy(obj, dst)
+        return obj
+
+    def collect_garbage(self, sessions_dir: str, retention_days: float = None,
+                        keep_sessions: int = None) -> Dict[str, int]:
+        """
+        按保留策略删除旧会话目录，并回收不再被引用的存储对象
+
+        最近修改时间超过保留天数、且不在最新 keep_sessions 个之内的 session_* 目录会被整个删除
+        （包括其中的分析报告）；之后硬链接数为1（只剩存储自身引用）的对象被删除。
+
+        Args:
+            sessions_dir: 会话目录所在的输出目录
+            retention_days: 保留天数，默认读取环境变量 OUTPUT_RETENTION_DAYS
+            keep_sessions: 无论新旧都保留的最新会话数，默认读取环境变量 OUTPUT_KEEP_SESSIONS
+
+        Returns:
+            {'sessions_removed': 删除的会话数, 'objects_removed': 回收的对象数, 'bytes_freed': 释放的字节数}
+        """
+        retention_days = RETENTION_DAYS if retention_days is None else retention_days
+        keep_sessions = KEEP_SESSIONS if keep_sessions is None else keep_sessions
+        stats = {'sessions_removed': 0, 'objects_removed': 0, 'bytes_freed': 0}
+
+        sessions = []
+        if os.path.isdir(sessions_dir):
+            for entry in os.scandir(sessions_dir):
+                if entry.is_dir(follow_symlinks=False) and entry.name.startswith("session_"):
+                    sessions.append((entry.stat().st_mtime, entry.path))
+        sessions.sort(reverse=True)
+        cutoff = time.time() - retention_days * 86400
+        for mtime, path in sessions[keep_sessions:]:
+            if mtime >= cutoff:
+                continue
+            shutil.rmtree(path, onerror=_remove_readonly)
+            stats['sessions_removed'] += 1
+
+        with self._lock:
+            for prefix in os.scandir(self.objects_dir):
+                if not prefix.is_dir():
+                    continue
+                for obj in os.scandir(prefix.path):
+                    st = obj.stat(follow_symlinks=False)
+                    if st.st_nlink <= 1:
+                        os.unlink(obj.path)
+                        stats['objects_removed'] += 1
+                        stats['bytes_freed'] += st.st_size
+                if not os.listdir(prefix.path):
+                    os.rmdir(prefix.path)
+
+        if stats['sessions_removed'] or stats['objects_removed']:
+            logger.info(f"产物清理: 删除 {stats['sessions_removed']} 个旧会话，"
+                        f"回收 {stats['objects_removed']} 个对象，释放 {stats['bytes_freed'] / 1e6:.1f}MB")
+        return stats
+
+
+_stores: Dict[str, ArtifactStore] = {}
+_collected = set()
+_stores_lock = threading.Lock()
+
+
+def get_artifact_store(base_output_dir: str = "outputs") -> ArtifactStore:
+    """
+    获取输出目录对应的进程级产物存储
+
+    存储目录读取环境变量 ARTIFACT_STORE_DIR，默认为 <输出目录>/.artifacts。
+    """
+    root = os.path.abspath(os.environ.get("ARTIFACT_STORE_DIR") or os.path.join(base_output_dir, ".artifacts"))
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = ArtifactStore(root)
+            _stores[root] = store
+        return store
+
+
+def collect_old_sessions(base_output_dir: str = "outputs") -> Optional[Dict[str, int]]:
+    """
+    启用自动清理（OUTPUT_SESSION_GC=1）时，每个进程对每个输出目录只执行一次旧会话清理
+
+    Returns:
+        清理统计；未启用或已执行过时返回None
+    """
+    if not SESSION_GC:
+        return None
+    key = os.path.abspath(base_output_dir)
+    with _stores_lock:
+        if key in _collected:
+            return None
+        _collected.add(key)
+    return get_artifact_store(base_output_dir).collect_garbage(base_output_dir)
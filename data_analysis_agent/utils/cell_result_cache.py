@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+跨会话的代码单元结果缓存（可选启用）
+
+不同公司、不同批次的分析里，智能体经常生成完全相同的代码单元，例如读取并清洗三大报表。
+启用后（环境变量 CELL_RESULT_CACHE=1），成功执行的代码单元的输出、产生或修改的变量、导入的模块
+以及在会话目录中写入的文件（图片、导出的表格）被写入磁盘缓存；之后同样的代码在同样的输入上再次执行时，
+直接恢复结果而不重新执行。matplotlib 的 Figure/Axes 等绘图对象不恢复。
+
+缓存键由三部分组成：
+    1. 规范化后的代码内容
+    2. 输入文件的内容哈希：预加载的数据文件、报表视图对应的文件、代码中以字符串常量写出的已存在文件，
+       以及会话目录中之前的代码单元写入的全部文件（按相对路径计入，不同会话目录中的相同文件哈希相同）
+    3. 代码中引用到的变量的内容指纹（DataFrame 按内容哈希，不是按对象身份）
+输入文件内容变化、被引用的变量取值变化都会得到不同的键。引用了无法计算指纹的变量的代码不缓存。
+缓存中的文件是独立的副本，会话中之后对同名文件的原地修改不会影响缓存。
+"""
+
+import os
+import ast
+import json
+import uuid
+import types
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .code_cache import normalize_cell
+from .artifact_store import file_digest
+from .session_checkpoint import write_variables, read_variables
+
+logger = logging.getLogger(__name__)
+
+_RESULT_FILE = "result.json"
+_VARIABLES_DIRNAME = "variables"
+_FILES_DIRNAME = "files"
+
+# 这些变量不进入缓存键：输入文件的哈希已经覆盖了它们（db 是报表视图连接），或者与具体会话无关
+_KEY_EXCLUDED_NAMES = {'db', 'session_output_dir'}
+
+
+def referenced_names(tree: ast.AST) -> List[str]:
+    """代码中出现过的全部名称（按名称排序）"""
+    return sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)})
+
+
+def referenced_files(tree: ast.AST) -> List[str]:
+    """代码中以字符串常量写出的、当前已存在的文件路径（绝对路径）"""
+    paths = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and 0 < len(node.value) < 1024 \
+                and '\n' not in node.value:
+            try:
+                if os.path.isfile(node.value):
+                    paths.add(os.path.abspath(node.value))
+            except (OSError, ValueError):
+                pass
+    return sorted(paths)
+
+
+# 容器最多展开的层数和每层的元素数，超过时不计算指纹（不缓存）
+_MAX_CONTAINER_DEPTH = 8
+_MAX_CONTAINER_ITEMS = 1000
+
+
+def fingerprint_value(value: Any, _depth: int = 0) -> Optional[str]:
+    """
+    计算变量取值的内容指纹，无法可靠计算时返回None
+
+    DataFrame/Series 按索引、列和全部取值哈希；numpy 数组按 dtype、形状和字节；
+    简单值按 repr；列表、元组、字典和集合逐个元素递归计算指纹，任一元素无法计算时返回None；
+    模块按模块名；函数按字节码和常量。
+    """
+    import numpy as np
+    import pandas as pd
+
+    digest = hashlib.sha256()
+    try:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            digest.update(type(value).__name__.encode())
+            digest.update(repr(value.shape).encode())
+            if isinstance(value, pd.DataFrame):
+                digest.update(repr(list(value.columns)).encode())
+                digest.update(repr(list(value.dtypes.astype(str))).encode())
+            else:
+                digest.update(repr((value.name, str(value.dtype))).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        elif isinstance(value, np.ndarray):
+            if value.dtype == object:
+                return None
+            digest.update(f"{value.dtype}{value.shape}".encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif value is None or isinstance(value, (bool, int, float, str, bytes)):
+            digest.update(repr(value).encode())
+        elif isinstance(value, (list, tuple, dict, set, frozenset)):
+            # 不能使用 repr：DataFrame 等对象的 repr 会截断，内容不同的容器会得到相同的指纹
+            if _depth >= _MAX_CONTAINER_DEPTH or len(value) > _MAX_CONTAINER_ITEMS:
+                return None
+            if isinstance(value, dict):
+                items = [(fingerprint_value(k, _depth + 1), fingerprint_value(v, _depth + 1))
+                         for k, v in value.items()]
+                parts = [f"{k}={v}" for k, v in items]
+                if any(k is None or v is None for k, v in items):
+                    return None
+            else:
+                parts = [fingerprint_value(item, _depth + 1) for item in value]
+                if any(part is None for part in parts):
+                    return None
+                if isinstance(value, (set, frozenset)):
+                    parts.sort()
+            digest.update(f"{type(value).__name__}:{','.join(parts)}".encode())
+        elif isinstance(value, types.ModuleType):
+            digest.update(f"module:{value.__name__}".encode())
+        elif isinstance(value, types.FunctionType):
+            code = value.__code__
+            digest.update(code.co_code)
+            digest.update(repr(code.co_consts).encode())
+            digest.update(repr(code.co_names).encode())
+        else:
+            return None
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+class CellResultCache:
+    """以代码、输入文件和变量指纹为键的磁盘缓存"""
+
+    def __init__(self, cache_dir: str):
+        """
+        Args:
+            cache_dir: 缓存目录，多个进程可以共享
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # {(路径, 大小, 修改时间): 内容哈希}，同一文件不重复计算哈希
+        self._file_digests: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def inputs_digest(self, paths: Iterable[str], output_dir: str = None) -> str:
+        """
+        输入文件集合的内容哈希
+
+        Args:
+            paths: 输入文件路径
+            output_dir: 会话目录，其中的文件按相对路径计入，其余文件按文件名计入
+        """
+        output_dir = os.path.abspath(output_dir) if output_dir else None
+        digest = hashlib.sha256()
+        for path in sorted(set(os.path.abspath(p) for p in paths)):
+            if output_dir and path.startswith(output_dir + os.sep):
+                name = os.path.relpath(path, output_dir)
+            else:
+                name = os.path.basename(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                digest.update(f"{name}:missing".encode())
+                continue
+            stat_key = (path, st.st_size, st.st_mtime_ns)
+            with self._lock:
+                content = self._file_digests.get(stat_key)
+            if content is None:
+                content = file_digest(path)
+                with self._lock:
+                    self._file_digests[stat_key] = content
+            digest.update(f"{name}:{content}".encode())
+        return digest.hexdigest()
+
+    def namespace_fingerprints(self, names: Iterable[str], namespace: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """
+        计算代码引用到的变量指纹，有变量无法计算指纹时返回None
+
+        不在命名空间中的名称（内置函数、代码自己定义的变量）不参与。
+        """
+        fingerprints = {}
+        for name in names:
+            if name in _KEY_EXCLUDED_NAMES or name not in namespace:
+                continue
+            fingerprint = fingerprint_value(namespace[name])
+            if fingerprint is None:
+                return None
+            fingerprints[name] = fingerprint
+        return fingerprints
+
+    @staticmethod
+    def make_key(code: str, inputs_digest: str, fingerprints: Dict[str, str]) -> str:
+        """组合缓存键"""
+        digest = hashlib.sha256(normalize_cell(code).encode('utf-8'))
+        digest.update(inputs_digest.encode())
+        digest.update(json.dumps(fingerprints, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存结果
+
+        Returns:
+            result.json 的内容，另加 'values'（变量取值）和 'entry_dir'，未命中返回None
+        """
+        entry_dir = self._entry_dir(key)
+        result_path = os.path.join(entry_dir, _RESULT_FILE)
+        if not os.path.isfile(result_path):
+            self.misses += 1
+            return None
+        try:
+            with open(result_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            result['values'] = read_variables(os.path.join(entry_dir, _VARIABLES_DIRNAME))
+            if set(result['values']) != set(result['value_names']):
+                raise ValueError("缓存的变量不完整")
+            result['entry_dir'] = entry_dir
+        except Exception as e:
+            logger.warning(f"读取代码单元缓存失败 {key}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def store(self, key: str, output: str, descriptions: Dict[str, str], values: Dict[str, Any],
+              modules: Dict[str, str], files: List[str], figures: List[str], output_dir: str) -> bool:
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            output: 代码输出
+            descriptions: 执行结果中的变量描述
+            values: 代码产生或修改的变量取值
+            modules: 代码导入的模块 {变量名: 模块名}，恢复时重新导入
+            files: 代码在会话目录中写入的文件（包括图片）
+            figures: 其中的图片
+            output_dir: 执行时的会话目录，恢复时输出中的该路径会被替换为新的会话目录
+
+        Returns:
+            是否写入（存在无法保存的变量时不写入）
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return True
+        output_dir = os.path.abspath(output_dir)
+        file_names = [os.path.relpath(os.path.abspath(path), output_dir) for path in files]
+        if any(name.startswith('..') for name in file_names):
+            return False
+
+        staging = f"{entry_dir}.{uuid.uuid4().hex}.tmp"
+        try:
+            manifest = write_variables(os.path.join(staging, _VARIABLES_DIRNAME), values)
+            if manifest['skipped']:
+                shutil.rmtree(staging, ignore_errors=True)
+                return False
+            for path, name in zip(files, file_names):
+                target = os.path.join(staging, _FILES_DIRNAME, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(path, target)
+            with open(os.path.join(staging, _RESULT_FILE), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'output': output,
+                    'variables': descriptions,
+                    'value_names': list(values),
+                    'modules': modules,
+                    'file_names': file_names,
+                    'figure_names': [os.path.relpath(os.path.abspath(path), output_dir) for path in figures],
+                    'output_dir': output_dir,
+                }, f, ensure_ascii=False)
+            os.rename(staging, entry_dir)
+        except OSError as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            # 其他进程已写入同一个键
+            if os.path.exists(entry_dir):
+                return True
+            logger.warning(f"写入代码单元缓存失败 {key}: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def restore_files(result: Dict[str, Any], output_dir: str) -> Tuple[str, List[str]]:
+        """
+        把缓存的文件复制回当前会话目录，并把输出中原会话目录的路径替换为当前会话目录
+
+        复制而不是链接：会话中之后对这些文件的原地修改不能影响缓存。
+
+        Returns:
+            (替换路径后的输出, 恢复的图片路径列表)
+        """
+        output_dir = os.path.abspath(output_dir)
+        for name in result['file_names']:
+            target = os.path.join(output_dir, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(os.path.join(result['entry_dir'], _FILES_DIRNAME, name), target)
+        output = result['output'].replace(result['output_dir'], output_dir)
+        figures = [os.path.join(output_dir, name) for name in result['figure_names']]
+        return output, figures
+
+
+_cache: Optional[CellResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cell_result_cache() -> Optional[CellResultCache]:
+    """
+    获取进程级代码单元结果缓存，未启用时返回None
+
+    环境变量 CELL_RESULT_CACHE=1 启用，缓存目录读取 CELL_RESULT_CACHE_DIR，默认 .cell_cache。
+    """
+    global _cache
+    if os.environ.get("CELL_RESULT_CACHE", "0") != "1":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CellResultCache(os.environ.get("CELL_RESULT_CACHE_DIR", ".cell_cache"))
+        return _cache
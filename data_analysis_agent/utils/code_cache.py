@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+代码单元缓存模块
+
+执行一段代码时，_check_code_safety 先解析并遍历一次AST，IPython 随后又会为判断是否需要异步执行编译一次、
+再解析一次、最后逐条语句编译。智能体在报错后经常重新提交相同或几乎相同的代码，这些工作每轮都在重复。
+
+CellCache 以代码内容的哈希为键，缓存安全检查结论、AST和各语句编译出的代码对象；
+CachedCompiler 替换 IPython 的编译器，把已经通过检查的AST直接交给执行，只解析一次。
+"""
+
+import ast
+import hashlib
+import __future__
+import threading
+import types
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from IPython.core.compilerop import CachingCompiler
+
+_FUTURE_FLAGS = [getattr(__future__, name).compiler_flag for name in __future__.all_feature_names]
+
+
+def normalize_cell(code: str) -> str:
+    """
+    与 IPython 的输入转换保持一致：去掉开头的空行和末尾的空白
+
+    这样安全检查解析出的AST与 IPython 实际执行的代码行号一致，可以直接复用。
+    """
+    lines = code.splitlines()
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def _retarget(code: types.CodeType, filename: str) -> types.CodeType:
+    """把缓存的代码对象（含嵌套函数）的文件名改为本次执行的单元格名，保证回溯信息正确"""
+    consts = tuple(_retarget(c, filename) if isinstance(c, types.CodeType) else c for c in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
+
+
+class CellEntry:
+    """单个代码单元的缓存条目"""
+
+    __slots__ = ('tree', 'verdict', 'may_await', 'codes')
+
+    def __init__(self, tree: Optional[ast.Module], verdict: Tuple[bool, str], may_await: bool):
+        self.tree = tree
+        self.verdict = verdict
+        self.may_await = may_await
+        # {(语句序号, 编译模式, 编译标志): 代码对象}
+        self.codes: Dict[tuple, types.CodeType] = {}
+
+    def index_of(self, node: ast.AST) -> Optional[int]:
+        """按对象身份查找语句在AST中的序号"""
+        if self.tree is None:
+            return None
+        for index, candidate in enumerate(self.tree.body):
+            if candidate is node:
+                return index
+        return None
+
+
+class CellCache:
+    """以代码内容哈希为键的LRU缓存"""
+
+    def __init__(self, max_entries: int = 256):
+        """
+        Args:
+            max_entries: 最多缓存的代码单元数
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CellEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(code: str) -> str:
+        return hashlib.sha256(normalize_cell(code).encode('utf-8')).hexdigest()
+
+    def get(self, code: str) -> Optional[CellEntry]:
+        """查找代码单元的缓存条目"""
+        key = self._key(code)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def analyze(self, code: str, check: Callable[[ast.Module], Tuple[bool, str]]) -> CellEntry:
+        """
+        获取代码单元的安全检查结论，未缓存时解析并检查一次
+
+        Args:
+            code: 代码
+            check: 对AST做安全检查的函数，返回 (is_safe, error_message)
+
+        Returns:
+            缓存条目，语法错误时 tree 为None
+        """
+        entry = self.get(code)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        try:
+            tree = ast.parse(normalize_cell(code))
+        except SyntaxError as e:
+            entry = CellEntry(None, (False, f"语法错误: {e}"), False)
+        else:
+            may_await = any(isinstance(node, (ast.Await, ast.AsyncFor, ast.AsyncWith)) for node in ast.walk(tree))
+            entry = CellEntry(tree, check(tree), may_await)
+
+        with self._lock:
+            self._entries[self._key(code)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+class CachedCompiler(CachingCompiler):
+    """
+    复用缓存AST和代码对象的 IPython 编译器
+
+    命中缓存时 ast_parse 直接返回安全检查时得到的AST，逐语句编译时复用之前的代码对象。
+    缓存的AST会被共享，因此要求 shell 没有注册会修改AST的 ast_transformers（CodeExecutor 不注册）。
+    """
+
+    def __init__(self, cell_cache: CellCache):
+        super().__init__()
+        self.cell_cache = cell_cache
+        self._active: Optional[CellEntry] = None
+
+    def ast_parse(self, source, filename='<unknown>', symbol='exec'):
+        entry = self.cell_cache.get(source) if symbol == 'exec' else None
+        self._active = entry if entry is not None and entry.tree is not None else None
+        if self._active is not None:
+            return self._active.tree
+        return super().ast_parse(source, filename, symbol)
+
+    def __call__(self, source, filename, symbol, **kwargs):
+        entry = self._active
+        index = None
+        if (entry is not None and not kwargs and isinstance(source, (ast.Module, ast.Interactive))
+                and len(source.body) == 1):
+            index = entry.index_of(source.body[0])
+        if index is None:
+            return super().__call__(source, filename, symbol, **kwargs)
+
+        key = (index, symbol, self.flags)
+        code = entry.codes.get(key)
+        if code is None:
+            code = super().__call__(source, filename, symbol)
+            entry.codes[key] = code
+            return code
+
+        code = _retarget(code, filename)
+        # 与 codeop.Compile 一致：代码中的 __future__ 导入对后续单元格生效
+        for flag in _FUTURE_FLAGS:
+            if code.co_flags & flag:
+                self.flags |= flag
+        return code
+
+
+_cell_cache: Optional[CellCache] = None
+_cell_cache_lock = threading.Lock()
+
+
+def get_cell_cache() -> CellCache:
+    """获取进程级代码单元缓存（IPython shell 在进程内是单例，缓存随之共享）"""
+    global _cell_cache
+    with _cell_cache_lock:
+        if _cell_cache is None:
+            _cell_cache = CellCache()
+        return _cell_cache
+
+
+def install_cached_compiler(shell) -> CellCache:
+    """
+    为 IPython shell 安装缓存编译器，并让异步执行判断复用缓存结论
+
+    Args:
+        shell: InteractiveShell 实例
+
+    Returns:
+        进程级代码单元缓存
+    """
+    cache = get_cell_cache()
+    if isinstance(shell.compile, CachedCompiler):
+        return cache
+
+    compiler = CachedCompiler(cache)
+    compiler.flags = shell.compile.flags
+    shell.compile = compiler
+
+    original_should_run_async = shell.should_run_async
+
+    def should_run_async(raw_cell, *, transformed_cell=None, preprocessing_exc_tuple=None):
+        # 已知不含 await 的代码不必再完整编译一次来判断
+        if transformed_cell is not None and preprocessing_exc_tuple is None:
+            entry = cache.get(transformed_cell)
+            if entry is not None and entry.tree is not None and not entry.may_await:
+                return False
+        return original_should_run_async(raw_cell, transformed_cell=transformed_cell,
+                                         preprocessing_exc_tuple=preprocessing_exc_tuple)
+
+    shell.should_run_async = should_run_async
+    return cache
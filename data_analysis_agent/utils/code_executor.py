@@ -8,14 +8,23 @@ import sys
 import ast
 import traceback
 import io
+import types
 from typing import Dict, Any, List, Optional, Tuple
 from contextlib import redirect_stdout, redirect_stderr
 from IPython.core.interactiveshell import InteractiveShell
-from IPython.utils.capture import capture_output
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
+import duckdb
 import logging
+from .namespace_tracker import NamespaceTracker
+from .data_loader import get_data_loader, dataset_variable_name
+from .statement_views import register_statement_views, describe_statement_views, find_statement_files
+from .figure_sink import FigureSink
+from .code_cache import install_cached_compiler
+from .output_budget import bounded_capture, summarize_dataframe
+from .session_checkpoint import save_variables, load_variables, restorable_variables, touched_variables
+from .cell_result_cache import get_cell_result_cache, referenced_names, referenced_files, fingerprint_value
 
 class CodeExecutor:
     """
@@ -50,6 +59,13 @@ class CodeExecutor:
         # 类似于在后台开了一个Jupyter环境，后续所有代码都在这个环境中执行
         self.shell = InteractiveShell.instance()
 
+        # 以代码内容哈希缓存安全检查结论、AST和代码对象，重复提交的代码不再重复解析和编译
+        self.cell_cache = install_cached_compiler(self.shell)
+
+        # 最后一个表达式的值由 _format_table_output 统一格式化后追加到输出，关闭 displayhook 的重复打印
+        self.shell.displayhook.write_output_prompt = lambda: None
+        self.shell.displayhook.write_format_data = lambda format_dict, md_dict=None: None
+
         # _setup_chinese_font函数会在这个新环境（shell）中执行相关代码，
         # 例如设置matplotlib的中文字体等，确保后续用户代码执行时生效
         self._setup_chinese_font()
@@ -59,6 +75,27 @@ class CodeExecutor:
 
         # 图片计数器
         self.image_counter = 0
+
+        # 跟踪每个代码单元写入的文件和图片，单元格结束时关闭本单元格创建的图形
+        self.figure_sink = FigureSink()
+
+        # 增量跟踪命名空间变化，避免每轮全量描述所有变量
+        self.namespace = NamespaceTracker()
+        self.namespace.update(self.shell.user_ns)
+
+        # 预加载的数据文件变量名，保存检查点时可以从原文件重建，无需保存
+        self._dataset_vars = set()
+        # 执行环境的输入文件（预加载的数据文件和报表视图对应的文件），其内容哈希是结果缓存键的一部分
+        self._input_files = set()
+
+        # 跨会话的代码单元结果缓存（可选启用）
+        self.result_cache = get_cell_result_cache()
+
+        # 上一次保存检查点的会话目录和当时的变量版本，以及此后代码单元中出现过的名称（None 表示无法跟踪）；
+        # 版本不变且没有被代码引用的变量复用上一份快照中的文件
+        self._checkpoint_dir: Optional[str] = None
+        self._checkpoint_versions: Dict[str, Any] = {}
+        self._touched_names: Optional[set] = set()
         
     def _setup_chinese_font(self):
         """设置matplotlib中文字体显示"""
@@ -91,6 +128,11 @@ class CodeExecutor:
                     import os
                     import json
                     from IPython.display import display
+                    # 限制 print(df) 的输出规模，大表只显示首尾若干行
+                    pd.set_option('display.max_rows', 20)
+                    pd.set_option('display.min_rows', 10)
+                    pd.set_option('display.max_columns', 20)
+                    pd.set_option('display.width', 200)
                     """
         try:
             self.shell.run_cell(common_imports)
@@ -105,15 +147,15 @@ class CodeExecutor:
         """
         检查代码安全性，限制导入的库
         
+        同一段代码只解析和检查一次，结论和AST按内容哈希缓存，执行时直接复用这份AST。
+        
         Returns:
             (is_safe, error_message)
         """
-        try:
-            # 解析传入的代码字符串，生成抽象语法树（AST），用于后续的安全性检查
-            tree = ast.parse(code)
-        except SyntaxError as e:
-            return False, f"语法错误: {e}"
-        
+        return self.cell_cache.analyze(code, self._check_ast_safety).verdict
+    
+    def _check_ast_safety(self, tree: ast.Module) -> Tuple[bool, str]:
+        """遍历AST检查导入和危险函数调用"""
         for node in ast.walk(tree):
             if isinstance(node, ast.Import):
                 for alias in node.names:
@@ -152,19 +194,12 @@ class CodeExecutor:
         return figures_info
     
     def _format_table_output(self, obj: Any) -> str:
-        """格式化表格输出，限制行数"""
-        if hasattr(obj, 'shape') and hasattr(obj, 'head'):  # pandas DataFrame
-            rows, cols = obj.shape
-            print(f"\n数据表形状: {rows}行 x {cols}列")
-            print(f"列名: {list(obj.columns)}")
-            
-            if rows <= 15:
-                return str(obj)
-            else:
-                head_part = obj.head(5)
-                tail_part = obj.tail(5)
-                return f"{head_part}\n...\n(省略 {rows-10} 行)\n...\n{tail_part}"
-        
+        """格式化表格输出：DataFrame/Series 生成包含形状、列类型、首尾行和描述统计的紧凑摘要"""
+        if hasattr(obj, 'shape') and hasattr(obj, 'head') and hasattr(obj, 'dtypes'):  # pandas DataFrame/Series
+            try:
+                return summarize_dataframe(obj)
+            except Exception:
+                pass
         return str(obj)
     
     def execute_code(self, code: str) -> Dict[str, Any]:
@@ -195,13 +230,30 @@ class CodeExecutor:
                 'variables': {}
             }
         
-        # 记录执行前的变量
-        vars_before = set(self.shell.user_ns.keys())
+        # 上一个单元格的未保存图形可能仍在后台写入，先等待写完，本单元格读取的会话目录是完整的
+        self.figure_sink.flush()
+
+        # 相同代码在相同输入和变量上执行过时，直接恢复缓存的结果
+        cache_key, fingerprints = self._result_cache_key(code)
+        if cache_key is not None:
+            cached = self.result_cache.lookup(cache_key)
+            if cached is not None:
+                return self._restore_cached_result(cached)
+            # 先同步命名空间跟踪，执行后的变化只包含本单元产生的变量（不含预加载、注入的变量）
+            self.namespace.update(self.shell.user_ns)
         
         try:
-            # 使用IPython的capture_output来捕获所有输出
-            with capture_output() as captured: #capture_output会捕获下面下面代码的输出，并重定向到captured
-                result = self.shell.run_cell(code)
+            # 捕获所有输出，按字符数和行数预算截断，避免大量打印内容进入后续提示词
+            self.figure_sink.begin_cell(self.output_dir)
+            result = None
+            try:
+                with bounded_capture() as captured: #bounded_capture会捕获下面代码的输出，并重定向到captured
+                    result = self.shell.run_cell(code)
+            finally:
+                # 找出本单元格写入的文件和图片，并关闭本单元格创建的图形；执行失败的单元格不自动保存图形
+                written_files, saved_figures = self.figure_sink.end_cell(
+                    save_unsaved=result is not None and result.success)
+                self._note_touched(code)
             
             # 检查执行结果
             if result.error_before_exec:
@@ -209,7 +261,7 @@ class CodeExecutor:
                 self.logger.error(f"执行前错误: {error_msg}")
                 return {
                     'success': False,
-                    'output': captured.stdout,
+                    'output': captured.getvalue(),
                     'error': f"执行前错误: {error_msg}",
                     'variables': {}
                 }
@@ -219,58 +271,141 @@ class CodeExecutor:
                 self.logger.error(f"执行错误: {error_msg}")
                 return {
                     'success': False,
-                    'output': captured.stdout,
+                    'output': captured.getvalue(),
                     'error': f"执行错误: {error_msg}",
                     'variables': {}
                 }
             
             # 获取输出
-            output = captured.stdout
+            output = captured.getvalue()
+            # 单元格没有保存、由后台自动保存的图形，告知路径以便收集
+            auto_saved = [path for path in saved_figures if path not in written_files]
+            for path in auto_saved:
+                output += f"\n未保存的图形已自动保存至: {path}"
             
             # 如果有返回值，添加到输出
             if result.result is not None:
                 formatted_result = self._format_table_output(result.result)
                 output += f"\n{formatted_result}"
-              # 记录新产生的重要变量（简化版本）
-            vars_after = set(self.shell.user_ns.keys())
-            new_vars = vars_after - vars_before
+            # 记录新产生或发生变化的重要变量，只检查身份或形状变化过的变量
+            changed_vars = self.namespace.update(self.shell.user_ns)
             
-            # 只记录新创建的DataFrame等重要数据结构
+            # 只记录DataFrame等重要数据结构
             important_new_vars = {}
-            for var_name in new_vars:
-                if not var_name.startswith('_'):
-                    try:
-                        var_value = self.shell.user_ns[var_name]
-                        if hasattr(var_value, 'shape'):  # pandas DataFrame, numpy array
-                            important_new_vars[var_name] = f"{type(var_value).__name__} with shape {var_value.shape}"
-                        elif var_name in ['session_output_dir']:  # 重要的配置变量
-                            important_new_vars[var_name] = str(var_value)
-                    except Exception as e:
-                        self.logger.warning(f"变量 {var_name} 记录失败: {e}")
+            for var_name in changed_vars:
+                if self.namespace.is_data(var_name) or var_name in ['session_output_dir']:
+                    important_new_vars[var_name] = self.namespace.description(var_name)
             
             self.logger.info(f"代码执行成功，输出长度: {len(output)}，新变量: {list(important_new_vars.keys())}")
+            if cache_key is not None and not auto_saved:
+                self._store_cached_result(cache_key, fingerprints, output, important_new_vars, changed_vars,
+                                          written_files, saved_figures)
             return {
                 'success': True,
                 'output': output,                'error': '',
-                'variables': important_new_vars
+                'variables': important_new_vars,
+                'figures': saved_figures
             }
         except Exception as e:
             self.logger.error(f"执行异常: {str(e)}\n{traceback.format_exc()}")
             return {
                 'success': False,
-                'output': captured.stdout if 'captured' in locals() else '',
+                'output': captured.getvalue() if 'captured' in locals() else '',
                 'error': f"执行异常: {str(e)}\n{traceback.format_exc()}",
                 'variables': {}
             }    
     
+    def _note_touched(self, code: str):
+        """记录代码单元中出现过的名称，这些变量可能被原地修改，下一次保存检查点时重新写入"""
+        if self._touched_names is None:
+            return
+        entry = self.cell_cache.get(code)
+        if entry is None or entry.tree is None:
+            self._touched_names = None
+        else:
+            self._touched_names.update(referenced_names(entry.tree))
+
+    def _result_cache_key(self, code: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """
+        计算代码单元的结果缓存键：代码 + 输入文件内容哈希 + 代码引用变量的内容指纹
+
+        输入文件包括预加载的数据文件、报表视图对应的文件、代码中写出的文件路径，以及会话目录中
+        之前的代码单元写入的文件，代码读取的这些文件变化后不会命中旧结果。
+
+        Returns:
+            (缓存键, 变量指纹)，未启用缓存或有变量无法计算指纹时缓存键为None
+        """
+        if self.result_cache is None:
+            return None, {}
+        entry = self.cell_cache.get(code)
+        if entry is None or entry.tree is None:
+            return None, {}
+        fingerprints = self.result_cache.namespace_fingerprints(referenced_names(entry.tree), self.shell.user_ns)
+        if fingerprints is None:
+            return None, {}
+        session_files = self.figure_sink.snapshot(self.output_dir)
+        input_files = self._input_files.union(referenced_files(entry.tree), session_files)
+        inputs = self.result_cache.inputs_digest(input_files, self.output_dir)
+        return self.result_cache.make_key(code, inputs, fingerprints), fingerprints
+
+    def _store_cached_result(self, cache_key: str, fingerprints: Dict[str, str], output: str,
+                             descriptions: Dict[str, str], changed_vars: set, files: List[str],
+                             saved_figures: List[str]):
+        """把成功执行的代码单元结果写入缓存，包括原地修改过的被引用变量"""
+        user_ns = self.shell.user_ns
+        names = set(changed_vars)
+        names.update(name for name, fingerprint in fingerprints.items()
+                     if name in user_ns and fingerprint_value(user_ns[name]) != fingerprint)
+        values, modules = {}, {}
+        for name in names:
+            if name not in user_ns:
+                continue
+            value = user_ns[name]
+            if isinstance(value, types.ModuleType):
+                modules[name] = value.__name__
+            elif not (getattr(type(value), '__module__', '') or '').startswith('matplotlib'):
+                values[name] = value
+
+        try:
+            self.result_cache.store(cache_key, output, descriptions, values, modules, files, saved_figures,
+                                    self.output_dir)
+        except Exception as e:
+            self.logger.warning(f"写入代码单元结果缓存失败: {e}")
+
+    def _restore_cached_result(self, cached: Dict[str, Any]) -> Dict[str, Any]:
+        """恢复缓存的代码单元结果：变量、模块、文件和输出"""
+        import importlib
+
+        self.shell.user_ns.update(cached['values'])
+        for name, module in cached.get('modules', {}).items():
+            self.shell.user_ns[name] = importlib.import_module(module)
+        output, figures = self.result_cache.restore_files(cached, self.output_dir)
+        self.figure_sink.invalidate()
+        self.namespace.update(self.shell.user_ns)
+        self.logger.info(f"代码单元命中结果缓存，恢复变量: {list(cached['values'].keys())}")
+        return {
+            'success': True,
+            'output': output,
+            'error': '',
+            'variables': cached.get('variables', {}),
+            'figures': figures,
+            'cached': True
+        }
+
     def reset_environment(self):
         """重置执行环境"""
         self.logger.info("重置执行环境")
+        self.figure_sink.flush()
         self.shell.reset()
         self._setup_common_imports()
         self._setup_chinese_font()
         plt.close('all')
         self.image_counter = 0
+        self.namespace.reset()
+        self.namespace.update(self.shell.user_ns)
+        self._dataset_vars = set()
+        self._input_files = set()
+        self._checkpoint_dir = None
     
     def set_variable(self, name: str, value: Any):
         """设置执行环境中的变量"""
@@ -279,43 +414,136 @@ class CodeExecutor:
         # 用于存储当前会话下所有用户定义的变量。通过向 user_ns 字典赋值，
         # 可以在代码执行环境中动态添加或修改变量，实现变量的持久化和跨代码块访问。
         self.shell.user_ns[name] = value
-    
+        if self._touched_names is not None:
+            self._touched_names.add(name)
+
+    def load_datasets(self, files: List[str]) -> Dict[str, str]:
+        """
+        将数据文件预加载为执行环境中的DataFrame变量
+
+        文件经数据加载服务解析一次后缓存为Arrow文件，之后的会话直接内存映射读取。
+        每个文件对应一个变量，同时提供以文件名为键的 datasets 字典。
+
+        Args:
+            files: 数据文件路径列表
+
+        Returns:
+            {变量名: 文件路径}，只包含加载成功的文件
+        """
+        frames = get_data_loader().load_files(files)
+        datasets = self.shell.user_ns.setdefault('datasets', {})
+        loaded = {}
+        for path, df in frames.items():
+            var_name = dataset_variable_name(path)
+            self.shell.user_ns[var_name] = df
+            datasets[os.path.basename(path)] = df
+            loaded[var_name] = path
+            self._dataset_vars.add(var_name)
+            self._input_files.add(os.path.abspath(path))
+        self.logger.info(f"预加载数据文件 {len(loaded)}/{len(files)} 个: {list(loaded.keys())}")
+        return loaded
+
+    def attach_statement_views(self, data_dirs: List[str]) -> str:
+        """
+        创建DuckDB连接 db 并注册数据目录中所有财务报表的视图
+
+        视图直接扫描磁盘上的报表文件，跨公司的对比和聚合可以直接用SQL完成。
+
+        Args:
+            data_dirs: 报表文件所在目录列表
+
+        Returns:
+            供提示词使用的视图说明，没有可注册的报表文件时为空字符串
+        """
+        con = duckdb.connect()
+        entries = register_statement_views(con, data_dirs)
+        if not entries:
+            con.close()
+            return ""
+        self.shell.user_ns['db'] = con
+        self._input_files.update(entry['path'] for entry in find_statement_files(data_dirs))
+        self.logger.info(f"已在执行环境中注册 {len(entries)} 个报表视图")
+        return describe_statement_views(entries, 'db')
+
+    def save_checkpoint(self, session_output_dir: str) -> Dict[str, Any]:
+        """
+        把执行环境中的用户变量保存到会话检查点（DataFrame/Series 为Parquet，数组为npz）
+
+        预加载的数据文件变量、datasets、db 和 session_output_dir 在恢复时重建，不保存。
+
+        Returns:
+            检查点变量清单
+        """
+        exclude = self._dataset_vars | {'datasets', 'db', 'session_output_dir'}
+        variables = restorable_variables(self.shell.user_ns, exclude)
+        manifest = save_variables(session_output_dir, variables, self._unchanged_since_checkpoint(session_output_dir))
+        self._mark_checkpointed(session_output_dir, manifest['variables'])
+        self.logger.info(f"已保存检查点变量 {len(manifest['variables'])} 个，跳过 {len(manifest['skipped'])} 个")
+        return manifest
+
+    def _unchanged_since_checkpoint(self, session_output_dir: str) -> set:
+        """自上一次保存到同一会话目录后，版本没有变化且没有被代码单元引用（可能被原地修改）的变量"""
+        if self._checkpoint_dir != os.path.abspath(session_output_dir) or self._touched_names is None:
+            return set()
+        touched = touched_variables(self.shell.user_ns, self._touched_names)
+        if touched is None:
+            return set()
+        self.namespace.update(self.shell.user_ns)
+        return {name for name, version in self._checkpoint_versions.items()
+                if name not in touched and version is not None and self.namespace.version(name) == version}
+
+    def _mark_checkpointed(self, session_output_dir: str, names):
+        """记录检查点中的变量版本，之后只有变化或被引用的变量需要重新写入"""
+        self.namespace.update(self.shell.user_ns)
+        self._checkpoint_dir = os.path.abspath(session_output_dir)
+        self._checkpoint_versions = {name: self.namespace.version(name) for name in names}
+        self._touched_names = set()
+
+    def restore_checkpoint(self, session_output_dir: str) -> List[str]:
+        """
+        从会话检查点恢复用户变量
+
+        Returns:
+            恢复的变量名列表
+        """
+        variables = load_variables(session_output_dir)
+        self.shell.user_ns.update(variables)
+        self.namespace.update(self.shell.user_ns)
+        # 刚恢复的变量与检查点中的文件一致，下一次保存时可以直接复用
+        self._mark_checkpointed(session_output_dir, variables)
+        self.logger.info(f"已从检查点恢复变量: {list(variables.keys())}")
+        return list(variables.keys())
+
+    def flush_figures(self, timeout: Optional[float] = 60) -> Dict[str, str]:
+        """
+        等待后台自动保存的图片写入完成，收集图片之前调用
+
+        Returns:
+            {图片路径: 错误信息}，只包含写入失败或超时未完成的图片
+        """
+        return self.figure_sink.flush(timeout)
+
+    def set_output_dir(self, output_dir: str):
+        """切换输出目录，供内核池在不同会话间复用执行器"""
+        self.figure_sink.flush()
+        self.output_dir = os.path.abspath(output_dir)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.logger.info(f"切换输出目录: {self.output_dir}")
+
     def get_environment_info(self) -> str:
         """获取当前执行环境的变量信息，用于系统提示词"""
         self.logger.debug("获取当前执行环境变量信息")
         info_parts = []
         
         # 获取重要的数据变量
-        # 下面这段代码用于收集当前执行环境（IPython shell）中用户定义的重要变量信息，并以字符串形式整理出来，便于后续在系统提示词中展示。
-        # 这样做的目的是让大模型（LLM）能够了解当前环境中有哪些关键变量、它们的类型和基本属性，从而更好地生成分析建议或代码。
-
-        important_vars = {}  # 用于存储筛选出的重要变量及其简要描述
-
-        # 遍历当前执行环境中的所有变量
-        for var_name, var_value in self.shell.user_ns.items():
-            # 过滤掉以'_'开头的内部变量，以及一些IPython的特殊变量（如'In', 'Out', 'get_ipython', 'exit', 'quit'）
-            if not var_name.startswith('_') and var_name not in ['In', 'Out', 'get_ipython', 'exit', 'quit']:
-                try:
-                    # 如果变量有'shape'属性，通常是pandas的DataFrame或numpy的ndarray，记录其类型和shape信息
-                    if hasattr(var_value, 'shape'):
-                        important_vars[var_name] = f"{type(var_value).__name__} with shape {var_value.shape}"
-                    # 如果变量名是'session_output_dir'，说明是重要的路径变量，直接记录其字符串值
-                    elif var_name in ['session_output_dir']:
-                        important_vars[var_name] = str(var_value)
-                    # 如果变量是int、float、str、bool等基础类型，且字符串长度小于100，记录其类型和值
-                    elif isinstance(var_value, (int, float, str, bool)) and len(str(var_value)) < 100:
-                        important_vars[var_name] = f"{type(var_value).__name__}: {var_value}"
-                    # 如果变量是pandas、numpy、matplotlib.pyplot等模块的对象，记录其模块信息
-                    elif hasattr(var_value, '__module__') and var_value.__module__ in ['pandas', 'numpy', 'matplotlib.pyplot']:
-                        important_vars[var_name] = f"导入的模块: {var_value.__module__}"
-                except:
-                    # 某些变量在获取属性时可能会报错，直接跳过
-                    continue
+        # 收集当前执行环境（IPython shell）中用户定义的重要变量信息，便于后续在系统提示词中展示，
+        # 让大模型（LLM）了解当前环境中有哪些关键变量、它们的类型和基本属性。
+        # 只有身份或形状变化过的变量才会重新生成描述，摘要在命名空间不变时直接复用。
+        variables_summary = self.namespace.summary(self.shell.user_ns)
         
-        if important_vars:
+        if variables_summary:
             info_parts.append("当前环境变量:")
-            for var_name, var_info in important_vars.items():
-                info_parts.append(f"- {var_name}: {var_info}")
+            info_parts.append(variables_summary)
         else:
             info_parts.append("当前环境已预装pandas, numpy, matplotlib等库")
         
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+数据加载服务
+
+每个分析会话都会让LLM重新写 pd.read_csv 解析同一批财报CSV，横向对比时目标公司的文件还会被反复读取。
+DataLoader 把每个输入文件只解析一次，缓存为 Arrow IPC 文件，之后通过内存映射直接读取，
+不再做文本解析；多个内核进程映射同一个缓存文件时共享操作系统的页缓存。
+执行器借助它把输入文件预先加载为现成的 DataFrame 变量。
+"""
+
+import os
+import re
+import glob
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# 支持预加载的文件类型
+SUPPORTED_EXTENSIONS = {'.csv', '.parquet', '.xlsx', '.xls'}
+
+
+def dataset_variable_name(path: str) -> str:
+    """
+    根据文件名生成合法的变量名，例如 商汤科技_HK_00020_balance_sheet_annual.csv -> df_商汤科技_HK_00020_balance_sheet_annual
+
+    Args:
+        path: 数据文件路径
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = re.sub(r'\W', '_', stem).strip('_') or 'data'
+    return f"df_{name}"
+
+
+class DataLoader:
+    """把输入文件解析一次并缓存为可内存映射的 Arrow 文件"""
+
+    def __init__(self, cache_dir: str = ".data_cache"):
+        """
+        Args:
+            cache_dir: Arrow缓存目录
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 本进程内已映射的表，内核被重置后再次加载同一文件时无需重新打开
+        self._tables: Dict[str, pa.Table] = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, path: str) -> str:
+        """缓存文件名包含源文件的路径、大小和修改时间，源文件变化后自动失效"""
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cache_dir, f"{stem}_{digest}.arrow")
+
+    def _parse(self, path: str) -> pa.Table:
+        """解析源文件为 Arrow 表"""
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.parquet':
+            return pq.read_table(path, memory_map=True)
+        if ext == '.csv':
+            try:
+                df = pd.read_csv(path, encoding='utf-8-sig')
+            except UnicodeDecodeError:
+                df = pd.read_csv(path, encoding='gbk')
+        else:
+            df = pd.read_excel(path)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def _write_cache(self, table: pa.Table, cache_path: str):
+        """原子写入缓存文件，并清理同一源文件的旧版本缓存"""
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        # 多个内核可能同时转换同一个文件，os.replace 保证读到的总是完整文件
+        os.replace(tmp_path, cache_path)
+
+        prefix = cache_path[:-len("_000000000000.arrow")]
+        for stale in glob.glob(f"{glob.escape(prefix)}_*.arrow"):
+            if stale != cache_path and re.fullmatch(r'_[0-9a-f]{12}\.arrow', stale[len(prefix):]):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def load_table(self, path: str) -> pa.Table:
+        """
+        获取文件对应的 Arrow 表，首次访问时解析并写入缓存
+
+        Args:
+            path: 数据文件路径
+
+        Returns:
+            内存映射的 Arrow 表
+        """
+        cache_path = self._cache_path(path)
+        with self._lock:
+            table = self._tables.get(cache_path)
+        if table is not None:
+            return table
+
+        if not os.path.exists(cache_path):
+            table = self._parse(path)
+            try:
+                self._write_cache(table, cache_path)
+            except (OSError, pa.ArrowException) as e:
+                logger.warning(f"写入数据缓存失败 {path}: {e}")
+                return table
+            logger.info(f"已缓存数据文件: {path} -> {cache_path}")
+
+        table = pa.ipc.open_file(pa.memory_map(cache_path, 'r')).read_all()
+        with self._lock:
+            self._tables[cache_path] = table
+        return table
+
+    def load_dataframe(self, path: str) -> pd.DataFrame:
+        """
+        加载文件为 DataFrame
+
+        每次返回独立的 DataFrame，会话中的原地修改不会影响缓存或其他会话。
+
+        Args:
+            path: 数据文件路径
+        """
+        return self.load_table(path).to_pandas()
+
+    def load_files(self, files: List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        批量加载文件，不支持或加载失败的文件会被跳过
+
+        Args:
+            files: 数据文件路径列表
+
+        Returns:
+            {文件路径: DataFrame}
+        """
+        frames = {}
+        for path in files:
+            if os.path.splitext(path)[1].lower() not in SUPPORTED_EXTENSIONS or not os.path.isfile(path):
+                continue
+            try:
+                frames[path] = self.load_dataframe(path)
+            except Exception as e:
+                logger.warning(f"预加载数据文件失败 {path}: {e}")
+        return frames
+
+
+_default_loader: Optional[DataLoader] = None
+_default_loader_lock = threading.Lock()
+
+
+def get_data_loader() -> DataLoader:
+    """获取进程级数据加载服务，缓存目录读取环境变量 DATA_CACHE_DIR，默认 .data_cache"""
+    global _default_loader
+    with _default_loader_lock:
+        if _default_loader is None:
+            _default_loader = DataLoader(os.environ.get("DATA_CACHE_DIR", ".data_cache"))
+        return _default_loader
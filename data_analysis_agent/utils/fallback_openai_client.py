@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 import asyncio
-from typing import Optional, Any, Mapping, Dict
+from typing import Optional, Any, Mapping, Dict, AsyncIterator
 from openai import AsyncOpenAI, APIStatusError, APIConnectionError, APITimeoutError, APIError
-from openai.types.chat import ChatCompletion
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from .llm_metrics import note_attempt, mark_first_byte
+
+
+def _with_metrics_hooks(client_args: Dict[str, Any]) -> Dict[str, Any]:
+    """为客户端注入httpx响应钩子，用于统计首字节时间；调用方自带 http_client 时不做处理"""
+    if 'http_client' in client_args:
+        return client_args
+    try:
+        from openai import DefaultAsyncHttpxClient
+        return {**client_args, 'http_client': DefaultAsyncHttpxClient(event_hooks={'response': [mark_first_byte]})}
+    except Exception:
+        return client_args
 
 class AsyncFallbackOpenAIClient:
     """
@@ -46,14 +58,14 @@ class AsyncFallbackOpenAIClient:
         if not primary_api_key or not primary_base_url:
             raise ValueError("主 API 密钥和基础 URL 不能为空。")
 
-        _primary_args = primary_client_args or {}
+        _primary_args = _with_metrics_hooks(primary_client_args or {})
         self.primary_client = AsyncOpenAI(api_key=primary_api_key, base_url=primary_base_url, **_primary_args)
         self.primary_model_name = primary_model_name
 
         self.fallback_client: Optional[AsyncOpenAI] = None
         self.fallback_model_name: Optional[str] = None
         if fallback_api_key and fallback_base_url and fallback_model_name:
-            _fallback_args = fallback_client_args or {}
+            _fallback_args = _with_metrics_hooks(fallback_client_args or {})
             self.fallback_client = AsyncOpenAI(api_key=fallback_api_key, base_url=fallback_base_url, **_fallback_args)
             self.fallback_model_name = fallback_model_name
         else:
@@ -80,6 +92,7 @@ class AsyncFallbackOpenAIClient:
         """
         last_exception = None
         for attempt in range(max_retries + 1):
+            note_attempt(api_name, kwargs.get('model', model_name), attempt)
             try:
                 # print(f"尝试使用 {api_name} API ({client.base_url}) 模型: {kwargs.get('model', model_name)}, 第 {attempt + 1} 次尝试")
                 completion = await client.chat.completions.create(
@@ -212,6 +225,55 @@ class AsyncFallbackOpenAIClient:
             else: 
                 raise e_primary_other
 
+    async def chat_completions_stream(
+        self,
+        messages: list[Mapping[str, Any]],
+        **kwargs: Any
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        """
+        以流式方式创建聊天补全，逐个产出数据块。
+        主 API 在建立流之前失败时（含重试后仍失败）回退到备用 API；流开始后的错误直接抛出。
+
+        Args:
+            messages: OpenAI API 的消息列表。
+            **kwargs: 传递给 OpenAI API 调用的其他参数。
+
+        Yields:
+            ChatCompletionChunk 对象。
+        """
+        if self._closed:
+            raise RuntimeError("客户端已关闭。")
+
+        try:
+            stream = await self._attempt_api_call(
+                client=self.primary_client,
+                model_name=self.primary_model_name,
+                messages=messages,
+                max_retries=self.max_retries_primary,
+                api_name="主",
+                stream=True,
+                **kwargs.copy()
+            )
+        except APIError as e_primary:
+            if not (self.fallback_client and self.fallback_model_name):
+                raise
+            print(f"ℹ️ 主 API 流式调用失败 ({type(e_primary).__name__})，尝试切换到备用 API ({self.fallback_client.base_url})...")
+            stream = await self._attempt_api_call(
+                client=self.fallback_client,
+                model_name=self.fallback_model_name,
+                messages=messages,
+                max_retries=self.max_retries_fallback,
+                api_name="备用",
+                stream=True,
+                **kwargs.copy()
+            )
+
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.close()
+
     async def close(self):
         """异步关闭主客户端和备用客户端 (如果存在)。"""
         if not self._closed:
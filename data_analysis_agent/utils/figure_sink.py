@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+代码单元图片跟踪模块
+
+生成的代码在单元格中照常同步调用 plt.savefig，保存返回时文件已经写好，同一单元格中的代码
+可以立即读取、嵌入或检查刚保存的图片。FigureSink 不接管 savefig，也不修改 matplotlib 的类，
+只做可以推迟到单元格结束后的工作：
+- 对比单元格前后的会话目录，找出本单元格写入的文件和图片，随执行结果返回。
+  单元格结束时的目录清单留作下一个单元格的起点，每个单元格只遍历一次会话目录
+- 关闭本单元格创建的图形（与 Jupyter inline 后端一致），避免 matplotlib 的内存在多轮之间持续增长
+- 可选（环境变量 FIGURE_SAVE_WORKERS > 0）：单元格结束时仍打开、且从未保存过的图形，
+  快照后交给后台线程渲染为PNG，执行结果立即返回并带上图片路径。这些路径在单元格结束后才产生，
+  单元格中的代码不会读到未写完的文件；执行下一个单元格、收集图片或归还执行环境之前先调用 flush 等待写入完成
+"""
+
+import os
+import uuid
+import pickle
+import logging
+import threading
+import concurrent.futures
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import matplotlib.pyplot as plt
+
+logger = logging.getLogger(__name__)
+
+# 视为图片的文件扩展名
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.svg', '.pdf')
+
+
+def list_output_files(output_dir: str, exclude_dirs: Iterable[str] = ()) -> Dict[str, int]:
+    """
+    目录中的文件及其修改时间
+
+    Args:
+        output_dir: 会话目录
+        exclude_dirs: 跳过的子目录名
+
+    Returns:
+        {文件绝对路径: 修改时间（纳秒）}
+    """
+    exclude_dirs = set(exclude_dirs)
+    files = {}
+    for root, dirs, names in os.walk(output_dir):
+        dirs[:] = [d for d in dirs if d not in exclude_dirs]
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                files[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+    return files
+
+
+def _render(snapshot: bytes, path: str):
+    """后台线程：从快照恢复图形并写入PNG"""
+    figure = pickle.loads(snapshot)
+    figure.savefig(path)
+
+
+class FigureSink:
+    """跟踪一个执行环境中每个代码单元写入的文件和图片，并在单元格结束时释放图形"""
+
+    def __init__(self, exclude_dirs: Iterable[str] = ('checkpoint',), max_workers: int = None):
+        """
+        Args:
+            exclude_dirs: 不属于代码单元产出的子目录（如智能体写入的检查点）
+            max_workers: 后台保存未保存图形的线程数，默认读取环境变量 FIGURE_SAVE_WORKERS（默认0，不启用）
+        """
+        self.exclude_dirs = tuple(exclude_dirs)
+        self._output_dir: Optional[str] = None
+        self._files_before: Dict[str, int] = {}
+        self._figures_before = set()
+        # 上一次遍历得到的目录清单，目录之外的写入（如恢复缓存的文件）后需要 invalidate
+        self._listing_dir: Optional[str] = None
+        self._listing: Optional[Dict[str, int]] = None
+
+        max_workers = max_workers if max_workers is not None else int(os.environ.get("FIGURE_SAVE_WORKERS", "0"))
+        self._pool = (concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="figure-sink")
+                      if max_workers > 0 else None)
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, output_dir: str) -> Dict[str, int]:
+        """会话目录的文件清单，沿用上一个单元格结束时的结果，目录变化或失效后重新遍历"""
+        output_dir = os.path.abspath(output_dir)
+        if self._listing is None or self._listing_dir != output_dir:
+            self._listing = list_output_files(output_dir, self.exclude_dirs)
+            self._listing_dir = output_dir
+        return self._listing
+
+    def invalidate(self):
+        """单元格之外有文件写入会话目录时调用，下次使用前重新遍历"""
+        self._listing = None
+
+    def begin_cell(self, output_dir: str):
+        """单元格开始执行前调用，记录会话目录中已有的文件和已打开的图形"""
+        self._output_dir = os.path.abspath(output_dir)
+        self._files_before = self.snapshot(self._output_dir)
+        self._figures_before = set(plt.get_fignums())
+
+    def end_cell(self, save_unsaved: bool = True) -> Tuple[List[str], List[str]]:
+        """
+        单元格执行结束后调用，关闭本单元格创建的图形
+
+        Args:
+            save_unsaved: 启用后台保存时是否保存未保存的图形，执行失败的单元格传 False
+
+        Returns:
+            (本单元格新写入或修改的文件, 其中的图片)。启用后台保存时，图片中还包括正在后台写入的
+            未保存图形，这些文件不在第一项中
+        """
+        unsaved = []
+        for number in plt.get_fignums():
+            if number in self._figures_before:
+                continue
+            if save_unsaved and self._pool is not None and self._output_dir is not None:
+                path = self._save_in_background(number)
+                if path:
+                    unsaved.append(path)
+            plt.close(number)
+        if self._output_dir is None:
+            return [], unsaved
+        listing = list_output_files(self._output_dir, self.exclude_dirs)
+        files = [path for path, mtime in listing.items() if self._files_before.get(path) != mtime]
+        figures = [path for path in files if path.lower().endswith(IMAGE_EXTENSIONS)] + unsaved
+        self._listing, self._listing_dir = listing, self._output_dir
+        self._output_dir = None
+        self._files_before = {}
+        return files, figures
+
+    def _save_in_background(self, number: int) -> Optional[str]:
+        """快照本单元格中未保存的图形并提交后台写入，返回图片路径；空白、已保存或无法快照的图形返回None"""
+        figure = plt.figure(number)
+        # Agg 画布在光栅化保存（png/jpg）后才有 renderer，据此跳过已经保存过的图形
+        if not figure.get_axes() or getattr(figure.canvas, 'renderer', None) is not None:
+            return None
+        path = os.path.join(self._output_dir, f"figure_{uuid.uuid4().hex[:8]}.png")
+        manager = figure.canvas.manager
+        try:
+            # 暂时解除与 pyplot 的关联，恢复出的副本不会注册到 pyplot 的全局图形列表
+            figure.canvas.manager = None
+            snapshot = pickle.dumps(figure)
+        except Exception as e:
+            logger.debug(f"图形无法快照，不自动保存: {e}")
+            return None
+        finally:
+            figure.canvas.manager = manager
+        with self._lock:
+            self._pending[path] = self._pool.submit(_render, snapshot, path)
+        return path
+
+    def flush(self, timeout: Optional[float] = 60) -> Dict[str, str]:
+        """
+        等待后台写入的图片完成，读取或收集会话目录中的文件之前调用
+
+        Args:
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            {图片路径: 错误信息}，只包含写入失败或超时未完成的图片
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return {}
+        _, not_done = concurrent.futures.wait(list(pending.values()), timeout=timeout)
+        failures = {}
+        for path, future in pending.items():
+            if future in not_done:
+                failures[path] = "保存超时"
+            elif future.exception() is not None:
+                failures[path] = f"{type(future.exception()).__name__}: {future.exception()}"
+        for path, error in failures.items():
+            logger.error(f"图片保存失败 {path}: {error}")
+        # 后台写入的文件不属于下一个单元格，补进目录清单
+        if self._listing is not None:
+            for path in pending:
+                if os.path.dirname(path) != self._listing_dir:
+                    continue
+                try:
+                    self._listing[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    self._listing.pop(path, None)
+        return failures
@@ -1,16 +1,16 @@
-
 from typing import Any, Dict
+from .output_budget import compact_text
 
 
 def format_execution_result(result: Dict[str, Any]) -> str:
-    """格式化执行结果为用户可读的反馈"""
+    """格式化执行结果为用户可读的反馈，输出和错误信息都按预算压缩，反馈大小可预期"""
     feedback = []
     
     if result['success']:
         feedback.append("✅ 代码执行成功")
         
         if result['output']:
-            feedback.append(f"📊 输出结果：\n{result['output']}")
+            feedback.append(f"📊 输出结果：\n{compact_text(result['output'])}")
         
         if result.get('variables'):
             feedback.append("📋 新生成的变量：")
@@ -18,8 +18,8 @@ def format_execution_result(result: Dict[str, Any]) -> str:
                 feedback.append(f"  - {var_name}: {var_info}")
     else:
         feedback.append("❌ 代码执行失败")
-        feedback.append(f"错误信息: {result['error']}")
+        feedback.append(f"错误信息: {compact_text(result['error'], max_chars=3000, max_lines=60)}")
         if result['output']:
-            feedback.append(f"部分输出: {result['output']}")
+            feedback.append(f"部分输出: {compact_text(result['output'], max_chars=3000, max_lines=60)}")
     
-    return "\n".join(feedback)
+    return "\n".join(feedback)
\ No newline at end of file
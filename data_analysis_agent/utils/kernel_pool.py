@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+预热的隔离执行内核池
+
+InteractiveShell.instance() 是进程级单例，同一进程内的多个 CodeExecutor 会共享同一个命名空间。
+这里每个内核运行在独立的子进程中，启动时即完成 pandas/numpy/matplotlib 导入和字体设置。
+分析会话从池中借出一个内核，用完后重置并归还，多个公司的分析可以安全地并行执行。
+
+父进程同时负责监督每个单元格的运行：超过墙钟时间先中断、中断无效则重启内核；
+常驻内存超过上限时直接重启内核；CPU时间由子进程内的 RLIMIT_CPU 限制。
+"""
+
+import os
+import sys
+import time
+import signal
+import atexit
+import queue
+import logging
+import threading
+import traceback
+import multiprocessing
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _process_rss_mb(pid: int) -> Optional[float]:
+    """读取进程的常驻内存（MB），无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class _CPUTimeExceeded(Exception):
+    """单元格CPU时间超限"""
+
+
+def _run_with_cpu_limit(fn, cpu_time_limit: Optional[float]):
+    """在 RLIMIT_CPU 软限制下运行 fn，超限时由 SIGXCPU 在用户代码中抛出异常"""
+    try:
+        import resource
+    except ImportError:
+        return fn()
+    if not cpu_time_limit or not hasattr(signal, 'SIGXCPU'):
+        return fn()
+
+    def on_sigxcpu(signum, frame):
+        raise _CPUTimeExceeded(f"单元格CPU时间超过 {cpu_time_limit} 秒")
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    new_soft = int(usage.ru_utime + usage.ru_stime + cpu_time_limit) + 1
+    if hard != resource.RLIM_INFINITY:
+        new_soft = min(new_soft, hard)
+    previous_handler = signal.signal(signal.SIGXCPU, on_sigxcpu)
+    resource.setrlimit(resource.RLIMIT_CPU, (new_soft, hard))
+    try:
+        return fn()
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        signal.signal(signal.SIGXCPU, previous_handler)
+
+
+def _run_interruptible(fn):
+    """只在运行 fn 期间响应父进程的中断信号（SIGINT），其余时间忽略"""
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        return fn()
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _kernel_main(conn, output_dir: str, cpu_time_limit: Optional[float] = None):
+    """子进程入口：创建执行器并循环处理父进程发来的调用请求"""
+    # 超时中断可能在单元格刚结束时才到达，等待请求、发送结果时收到的中断一律忽略，不能让内核退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 在子进程内导入，保证 IPython shell 单例只属于本进程
+    from .code_executor import CodeExecutor
+
+    executor = CodeExecutor(output_dir)
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            method, args, kwargs = conn.recv()
+        except EOFError:
+            break
+        if method == '__shutdown__':
+            break
+        try:
+            if method == 'execute_code':
+                result = _run_with_cpu_limit(
+                    lambda: _run_interruptible(lambda: executor.execute_code(*args, **kwargs)), cpu_time_limit
+                )
+            else:
+                result = getattr(executor, method)(*args, **kwargs)
+            conn.send(('ok', result))
+        except KeyboardInterrupt:
+            # 中断到达时用户代码已经结束，正在整理结果；内核和变量保留
+            conn.send(('ok', {'success': False, 'output': '', 'error': "执行被中断", 'variables': {}}))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+    conn.close()
+
+
+class KernelError(RuntimeError):
+    """内核调用失败或内核进程已退出"""
+
+
+class IsolatedKernel:
+    """
+    运行在独立子进程中的执行内核
+
+    对外提供与 CodeExecutor 相同的方法，DataAnalysisAgent 可以无差别地使用。
+    execute_code 受墙钟时间、CPU时间和常驻内存限制，超限时返回失败结果而不是阻塞或拖垮宿主进程。
+    """
+
+    # 超时后发送中断信号，等待用户代码响应的宽限时间（秒）
+    INTERRUPT_GRACE_SECONDS = 5.0
+    # 监督轮询间隔（秒）
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, output_dir: str = "outputs", mp_context=None,
+                 cell_timeout: Optional[float] = None,
+                 cpu_time_limit: Optional[float] = None,
+                 max_memory_mb: Optional[float] = None):
+        """
+        启动内核子进程（不等待其就绪）
+
+        Args:
+            output_dir: 初始输出目录
+            mp_context: multiprocessing 上下文，默认使用 spawn
+            cell_timeout: 单个单元格的墙钟时间上限（秒），None 表示不限制
+            cpu_time_limit: 单个单元格的CPU时间上限（秒），仅类Unix系统生效
+            max_memory_mb: 内核进程常驻内存上限（MB），None 表示不限制
+        """
+        self._ctx = mp_context or multiprocessing.get_context('spawn')
+        self.output_dir = os.path.abspath(output_dir)
+        self.cell_timeout = cell_timeout
+        self.cpu_time_limit = cpu_time_limit
+        self.max_memory_mb = max_memory_mb
+        # 通过 set_variable 注入的变量，内核重启后自动恢复
+        self._seeded_variables: Dict[str, Any] = {}
+        # 通过 load_datasets 预加载的数据文件，内核重启后重新加载（命中Arrow缓存，开销很小）
+        self._seeded_files: List[str] = []
+        # 通过 attach_statement_views 注册过报表视图的目录
+        self._seeded_view_dirs: List[str] = []
+        # 通过 restore_checkpoint 恢复过变量的会话目录
+        self._seeded_checkpoint: Optional[str] = None
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(
+            target=_kernel_main, args=(child_conn, self.output_dir, self.cpu_time_limit), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self._ready = False
+
+    def restart(self):
+        """强制结束当前内核进程并启动新进程，恢复输出目录和注入的变量"""
+        logger.warning(f"重启执行内核 (pid={self.pid})")
+        self.process.kill()
+        self.process.join(5)
+        self._conn.close()
+        self._start()
+        self.wait_ready()
+        self._send_and_receive('set_output_dir', (self.output_dir,), {})
+        for name, value in self._seeded_variables.items():
+            self._send_and_receive('set_variable', (name, value), {})
+        if self._seeded_files:
+            self._send_and_receive('load_datasets', (self._seeded_files,), {})
+        if self._seeded_view_dirs:
+            self._send_and_receive('attach_statement_views', (self._seeded_view_dirs,), {})
+        if self._seeded_checkpoint:
+            self._send_and_receive('restore_checkpoint', (self._seeded_checkpoint,), {})
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def wait_ready(self, timeout: Optional[float] = None):
+        """等待内核完成预热"""
+        if self._ready:
+            return
+        if not self._conn.poll(timeout):
+            raise KernelError(f"内核启动超时 (pid={self.pid})")
+        try:
+            status, _ = self._conn.recv()
+        except EOFError:
+            raise KernelError(f"内核启动失败 (pid={self.pid})")
+        if status != 'ready':
+            raise KernelError(f"内核启动异常: {status}")
+        self._ready = True
+
+    def _send_and_receive(self, method: str, args: tuple, kwargs: dict) -> Any:
+        try:
+            self._conn.send((method, args, kwargs))
+            status, payload = self._conn.recv()
+        except (EOFError, BrokenPipeError, OSError) as e:
+            raise KernelError(f"内核进程已退出 (pid={self.pid}): {e}")
+        if status == 'error':
+            raise KernelError(payload)
+        return payload
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        """在内核中调用执行器的方法并返回结果"""
+        with self._lock:
+            self.wait_ready()
+            return self._send_and_receive(method, args, kwargs)
+
+    def execute_code(self, code: str) -> Dict[str, Any]:
+        """在监督下执行代码，超时或内存超限时返回明确的失败结果"""
+        with self._lock:
+            self.wait_ready()
+            try:
+                self._conn.send(('execute_code', (code,), {}))
+            except (BrokenPipeError, OSError) as e:
+                self.restart()
+                return self._limit_result(f"执行内核已退出: {e}", restarted=True)
+
+            started = time.monotonic()
+            interrupted_at = None
+            while True:
+                try:
+                    if self._conn.poll(self.POLL_INTERVAL):
+                        status, payload = self._conn.recv()
+                        break
+                except (EOFError, OSError):
+                    self.restart()
+                    return self._limit_result("执行内核在运行代码时意外退出", restarted=True)
+
+                elapsed = time.monotonic() - started
+                rss = _process_rss_mb(self.pid) if self.max_memory_mb else None
+                if rss is not None and rss > self.max_memory_mb:
+                    logger.error(f"内核内存 {rss:.0f}MB 超过上限 {self.max_memory_mb}MB")
+                    self.restart()
+                    return self._limit_result(
+                        f"内存超限: 执行过程中内存占用达到 {rss:.0f}MB，超过上限 {self.max_memory_mb}MB，已终止",
+                        restarted=True, memory_exceeded=True
+                    )
+                if self.cell_timeout and elapsed > self.cell_timeout:
+                    if interrupted_at is None:
+                        if self._conn.poll(0):
+                            # 结果已在管道中，单元格刚好结束，不再中断
+                            continue
+                        logger.error(f"单元格运行超过 {self.cell_timeout} 秒，发送中断")
+                        interrupted_at = time.monotonic()
+                        if sys.platform != 'win32':
+                            os.kill(self.pid, signal.SIGINT)
+                    elif time.monotonic() - interrupted_at > self.INTERRUPT_GRACE_SECONDS or sys.platform == 'win32':
+                        self.restart()
+                        return self._limit_result(
+                            f"执行超时: 单元格运行超过 {self.cell_timeout} 秒且无法中断，已终止",
+                            restarted=True, timed_out=True
+                        )
+
+        if status == 'error':
+            raise KernelError(payload)
+        if interrupted_at is not None and not payload.get('success'):
+            # 中断成功，内核和变量都保留
+            payload.update(self._limit_result(
+                f"执行超时: 单元格运行超过 {self.cell_timeout} 秒，已中断",
+                timed_out=True, partial_output=payload.get('output', '')
+            ))
+        elif not payload.get('success') and '单元格CPU时间超过' in payload.get('error', ''):
+            payload['timed_out'] = True
+            payload['error'] = (f"CPU时间超限: 单元格CPU时间超过 {self.cpu_time_limit} 秒，已中断。"
+                                "请减少计算量（例如避免笛卡尔积、嵌套循环，或先对数据抽样）后重试。")
+        return payload
+
+    def _limit_result(self, reason: str, restarted: bool = False, timed_out: bool = False,
+                      memory_exceeded: bool = False, partial_output: str = '') -> Dict[str, Any]:
+        """构造资源超限时返回给智能体的执行结果"""
+        hint = "请减少计算量或内存占用（例如避免笛卡尔积、无限循环，对大表先筛选列或抽样）后重试。"
+        if restarted:
+            hint += "执行内核已重启，之前定义的变量已丢失，需要重新加载数据。"
+            if self._seeded_files:
+                hint += "预加载的数据变量（df_开头）已自动恢复，可以直接使用。"
+        return {
+            'success': False,
+            'output': partial_output,
+            'error': f"{reason}。{hint}",
+            'variables': {},
+            'timed_out': timed_out,
+            'memory_exceeded': memory_exceeded,
+            'kernel_restarted': restarted,
+        }
+
+    def set_variable(self, name: str, value: Any):
+        self._seeded_variables[name] = value
+        return self.call('set_variable', name, value)
+
+    def load_datasets(self, files: List[str]) -> Dict[str, str]:
+        self._seeded_files = [f for f in self._seeded_files if f not in files] + list(files)
+        return self.call('load_datasets', files)
+
+    def attach_statement_views(self, data_dirs: List[str]) -> str:
+        self._seeded_view_dirs = list(data_dirs)
+        return self.call('attach_statement_views', data_dirs)
+
+    def save_checkpoint(self, session_output_dir: str) -> Dict[str, Any]:
+        return self.call('save_checkpoint', session_output_dir)
+
+    def restore_checkpoint(self, session_output_dir: str) -> List[str]:
+        self._seeded_checkpoint = session_output_dir
+        return self.call('restore_checkpoint', session_output_dir)
+
+    def get_environment_info(self) -> str:
+        return self.call('get_environment_info')
+
+    def get_current_figures_info(self) -> List[Dict[str, Any]]:
+        return self.call('get_current_figures_info')
+
+    def flush_figures(self, timeout: Optional[float] = 60) -> Dict[str, str]:
+        return self.call('flush_figures', timeout)
+
+    def reset_environment(self):
+        self._seeded_variables = {}
+        self._seeded_files = []
+        self._seeded_view_dirs = []
+        self._seeded_checkpoint = None
+        return self.call('reset_environment')
+
+    def set_output_dir(self, output_dir: str):
+        self.output_dir = os.path.abspath(output_dir)
+        return self.call('set_output_dir', self.output_dir)
+
+    def shutdown(self, timeout: float = 5.0):
+        """关闭内核子进程"""
+        try:
+            if self.is_alive():
+                self._conn.send(('__shutdown__', (), {}))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self._conn.close()
+
+
+class KernelPool:
+    """
+    预热的隔离内核池
+
+    用法:
+        pool = KernelPool(size=4)
+        with pool.checkout(session_dir) as kernel:
+            kernel.execute_code("print(1)")
+    """
+
+    def __init__(self, size: int = 2, output_dir: str = "outputs", start_method: str = 'spawn',
+                 cell_timeout: Optional[float] = 300, cpu_time_limit: Optional[float] = None,
+                 max_memory_mb: Optional[float] = 4096):
+        """
+        初始化内核池并立即在后台启动全部内核
+
+        Args:
+            size: 内核数量，即最大并行会话数
+            output_dir: 内核的初始输出目录
+            start_method: 子进程启动方式，默认 spawn（跨平台且不继承父进程的 matplotlib 状态）
+            cell_timeout: 单个单元格的墙钟时间上限（秒）
+            cpu_time_limit: 单个单元格的CPU时间上限（秒）
+            max_memory_mb: 每个内核的常驻内存上限（MB）
+        """
+        self.size = size
+        self.output_dir = output_dir
+        self.kernel_limits = {
+            'cell_timeout': cell_timeout,
+            'cpu_time_limit': cpu_time_limit,
+            'max_memory_mb': max_memory_mb,
+        }
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle: "queue.Queue[IsolatedKernel]" = queue.Queue()
+        self._kernels: List[IsolatedKernel] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+        logger.info(f"内核池已启动 {size} 个内核")
+
+    def _spawn(self) -> IsolatedKernel:
+        kernel = IsolatedKernel(self.output_dir, mp_context=self._ctx, **self.kernel_limits)
+        with self._lock:
+            self._kernels.append(kernel)
+        return kernel
+
+    def _discard(self, kernel: IsolatedKernel):
+        with self._lock:
+            if kernel in self._kernels:
+                self._kernels.remove(kernel)
+        kernel.shutdown(timeout=1.0)
+
+    def acquire(self, output_dir: str, timeout: Optional[float] = None) -> IsolatedKernel:
+        """
+        借出一个空闲内核，并将其输出目录切换到会话目录
+
+        Args:
+            output_dir: 会话输出目录
+            timeout: 等待空闲内核的超时时间（秒），None 表示一直等待
+        """
+        if self._closed:
+            raise KernelError("内核池已关闭")
+        try:
+            kernel = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise KernelError(f"等待空闲内核超时 ({timeout}s)")
+        try:
+            kernel.wait_ready()
+            kernel.set_output_dir(output_dir)
+        except KernelError as e:
+            logger.warning(f"内核不可用，重新启动: {e}")
+            self._discard(kernel)
+            kernel = self._spawn()
+            kernel.wait_ready()
+            kernel.set_output_dir(output_dir)
+        return kernel
+
+    def release(self, kernel: IsolatedKernel):
+        """归还内核：在后台重置后放回空闲队列，调用方无需等待"""
+        threading.Thread(target=self._recycle, args=(kernel,), daemon=True).start()
+
+    def _recycle(self, kernel: IsolatedKernel):
+        if self._closed:
+            self._discard(kernel)
+            return
+        try:
+            kernel.reset_environment()
+        except KernelError as e:
+            logger.warning(f"内核重置失败，替换为新内核: {e}")
+            self._discard(kernel)
+            kernel = self._spawn()
+        self._idle.put(kernel)
+
+    @contextmanager
+    def checkout(self, output_dir: str, timeout: Optional[float] = None):
+        """借出内核的上下文管理器，退出时自动归还"""
+        kernel = self.acquire(output_dir, timeout)
+        try:
+            yield kernel
+        finally:
+            self.release(kernel)
+
+    def shutdown(self):
+        """关闭池中所有内核"""
+        self._closed = True
+        with self._lock:
+            kernels, self._kernels = self._kernels, []
+        for kernel in kernels:
+            kernel.shutdown(timeout=1.0)
+
+
+_default_pool: Optional[KernelPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_kernel_pool(size: int = None) -> KernelPool:
+    """
+    获取进程级默认内核池，首次调用时创建
+
+    资源限制读取环境变量 CELL_TIMEOUT、CELL_CPU_TIME_LIMIT、KERNEL_MAX_MEMORY_MB，设置为0表示不限制。
+
+    Args:
+        size: 内核数量，默认读取环境变量 KERNEL_POOL_SIZE，未设置时为2
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            size = size or int(os.environ.get("KERNEL_POOL_SIZE", "2"))
+            _default_pool = KernelPool(
+                size=size,
+                cell_timeout=float(os.environ.get("CELL_TIMEOUT", "300")) or None,
+                cpu_time_limit=float(os.environ.get("CELL_CPU_TIME_LIMIT", "0")) or None,
+                max_memory_mb=float(os.environ.get("KERNEL_MAX_MEMORY_MB", "4096")) or None,
+            )
+            atexit.register(_default_pool.shutdown)
+        return _default_pool
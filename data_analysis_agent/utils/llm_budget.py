@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+LLM并发预算模块
+
+多个分析会话并行运行时，所有会话共享同一个LLM并发上限，避免同时发出过多请求触发限流。
+等待预算的时间计入调用指标中的 queue_wait。
+"""
+
+import os
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+class LLMConcurrencyBudget:
+    """进程级LLM并发上限，可跨线程、跨事件循环使用"""
+
+    # 等待空闲名额时的轮询间隔（秒）
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, limit: int = 4):
+        """
+        Args:
+            limit: 同时在途的LLM请求数上限
+        """
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._in_use = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        占用一个并发名额，退出时释放
+
+        各会话运行在各自线程的事件循环中，这里以非阻塞方式轮询线程信号量，不会阻塞所在的事件循环。
+        """
+        while not self._semaphore.acquire(blocking=False):
+            await asyncio.sleep(self.POLL_INTERVAL)
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._semaphore.release()
+
+    def in_use(self) -> int:
+        """当前占用的名额数"""
+        with self._lock:
+            return self._in_use
+
+
+_budget: Optional[LLMConcurrencyBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_llm_budget() -> LLMConcurrencyBudget:
+    """获取进程级LLM并发预算，上限读取环境变量 LLM_MAX_CONCURRENCY，默认4"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = LLMConcurrencyBudget(int(os.environ.get("LLM_MAX_CONCURRENCY", "4")))
+        return _budget
+
+
+def set_llm_concurrency(limit: int) -> LLMConcurrencyBudget:
+    """
+    重新设置LLM并发上限，应在并行会话开始之前调用
+
+    Args:
+        limit: 同时在途的LLM请求数上限
+    """
+    global _budget
+    with _budget_lock:
+        _budget = LLMConcurrencyBudget(limit)
+        return _budget
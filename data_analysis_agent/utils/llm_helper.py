@@ -4,13 +4,70 @@ LLM调用辅助模块
 """
 
 import asyncio
+import time
+import queue
+import threading
+import json
+import hashlib
 import yaml
+from openai import APIStatusError
 from ..config.llm_config import LLMConfig
 from .fallback_openai_client import AsyncFallbackOpenAIClient
+from .llm_metrics import start_call, finish_call, current_stage, note_dispatch
+from .llm_budget import get_llm_budget
+from .prompt_cache import get_prompt_cache
+from .single_flight import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 进程内共享，不同LLMHelper实例发出的相同请求也会合并
+_in_flight = SingleFlight()
+
+
+class LLMStream:
+    """
+    在后台线程中运行的流式LLM调用
+
+    迭代得到逐段到达的文本；消费方处理文本（例如执行已完整的代码块）期间，后台线程继续接收后续内容。
+    """
+
+    _END = object()
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._parts = []
+        self._cancelled = threading.Event()
+
+    @property
+    def text(self) -> str:
+        """已消费的完整文本"""
+        return "".join(self._parts)
+
+    def cancel(self):
+        """取消生成，后台线程会在收到下一个数据块时关闭连接"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def put(self, delta: str):
+        self._queue.put(delta)
+
+    def close(self):
+        self._queue.put(self._END)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                return
+            if self.cancelled:
+                continue
+            self._parts.append(item)
+            yield item
+
 
 class LLMHelper:
     """LLM调用辅助类，支持同步和异步调用"""
@@ -22,9 +79,22 @@ class LLMHelper:
             primary_base_url=config.base_url,
             primary_model_name=config.model
         )
+        # 流式调用时请求在最后一个数据块中返回token用量；服务端不支持该参数时自动关闭
+        self.stream_usage = True
+        # 提示词缓存，默认关闭
+        self.prompt_cache = None
+        if getattr(config, 'prompt_cache', False):
+            self.prompt_cache = get_prompt_cache(config.prompt_cache_dir, config.prompt_cache_threshold)
     
-    async def async_call(self, prompt: str, system_prompt: str = None, max_tokens: int = None, temperature: float = None) -> str:
-        """异步调用LLM"""
+    async def async_call(self, prompt: str, system_prompt: str = None, max_tokens: int = None,
+                         temperature: float = None, cache: str = "exact") -> str:
+        """异步调用LLM，cache 的含义见 call"""
+        return await self._timed_call(prompt, system_prompt, max_tokens, temperature,
+                                      submitted_at=time.perf_counter(), stage=current_stage(), cache=cache)
+
+    async def _timed_call(self, prompt: str, system_prompt: str, max_tokens: int, temperature: float,
+                          submitted_at: float, stage: str, cache: str = "exact") -> str:
+        """调用LLM并记录本次调用的耗时、token用量等指标"""
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
@@ -41,20 +111,153 @@ class LLMHelper:
         else:
             kwargs['temperature'] = self.config.temperature
             
+        cache_params = {'model': self.config.model, **kwargs}
+        semantic = cache == "semantic"
+        if self.prompt_cache is not None:
+            cached = self.prompt_cache.lookup(prompt, system_prompt, cache_params, semantic=semantic)
+            if cached is not None:
+                record, token = start_call(self.config.model, stage, submitted_at)
+                record.endpoint = 'cache'
+                finish_call(record, token)
+                return cached
+
+        # 相同端点、模型、消息和参数的并发请求只发出一次
+        flight_key = hashlib.sha256(json.dumps(
+            {'base_url': self.config.base_url, 'messages': messages, **cache_params},
+            ensure_ascii=False, sort_keys=True
+        ).encode('utf-8')).hexdigest()
+
+        record, token = start_call(self.config.model, stage, submitted_at)
         try:
             # 这里使用了await，是因为chat_completions_create方法是一个异步（async）方法，返回的是一个协程对象（coroutine）。
             # 在async函数内部，调用其他异步方法时需要用await等待其执行完成并获取结果，这样不会阻塞主线程，可以高效地进行异步IO操作。
             # 例如，LLM的API请求通常涉及网络IO，使用await可以在等待响应时让出控制权，提高并发效率。
-            response = await self.client.chat_completions_create(
-                messages=messages,
-                **kwargs
-            )
-            return response.choices[0].message.content
+            async def dispatch():
+                # 所有会话共享LLM并发预算，合并请求的跟随者不占用名额
+                async with get_llm_budget().slot():
+                    note_dispatch()
+                    return await self.client.chat_completions_create(messages=messages, **kwargs)
+
+            response, shared = await _in_flight.do(flight_key, dispatch)
+            if shared:
+                # 共享他人的结果，不重复统计token用量
+                record.endpoint = 'coalesced'
+                finish_call(record, token)
+            else:
+                finish_call(record, token, response=response)
+            logger.debug(f"LLM调用完成: {record.to_dict()}")
+            content = response.choices[0].message.content
+            if self.prompt_cache is not None and not shared:
+                self.prompt_cache.store(prompt, system_prompt, cache_params, content, semantic=semantic)
+            return content
         except Exception as e:
+            finish_call(record, token, error=e)
             logger.info(f"LLM调用失败: {e}")
             return ""
-    def call(self, prompt: str, system_prompt: str = None, max_tokens: int = None, temperature: float = None) -> str:
-        """同步调用LLM"""
+    def stream_call(self, prompt: str, system_prompt: str = None, max_tokens: int = None,
+                    temperature: float = None, cache: str = "exact") -> LLMStream:
+        """
+        流式调用LLM，立即返回，生成的文本在后台线程中逐段写入返回的 LLMStream
+
+        与 call 一样在失败时只记录日志，流会以已收到的内容结束；cache 的含义见 call。
+        """
+        stream = LLMStream()
+        submitted_at = time.perf_counter()
+        stage = current_stage()
+
+        def run():
+            try:
+                asyncio.run(self._stream_worker(stream, prompt, system_prompt, max_tokens, temperature,
+                                                submitted_at, stage, cache))
+            finally:
+                stream.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return stream
+
+    async def _stream_worker(self, stream: LLMStream, prompt: str, system_prompt: str, max_tokens: int,
+                             temperature: float, submitted_at: float, stage: str, cache: str = "exact"):
+        """后台线程中的流式调用：逐块写入文本并记录调用指标"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        kwargs = {
+            'max_tokens': max_tokens if max_tokens is not None else self.config.max_tokens,
+            'temperature': temperature if temperature is not None else self.config.temperature,
+        }
+
+        cache_params = {'model': self.config.model, **kwargs}
+        semantic = cache == "semantic"
+        if self.prompt_cache is not None:
+            cached = self.prompt_cache.lookup(prompt, system_prompt, cache_params, semantic=semantic)
+            if cached is not None:
+                record, token = start_call(self.config.model, stage, submitted_at)
+                record.endpoint = 'cache'
+                finish_call(record, token)
+                stream.put(cached)
+                return
+
+        record, token = start_call(self.config.model, stage, submitted_at)
+        parts = []
+        try:
+            async with get_llm_budget().slot():
+                note_dispatch()
+                if not self.stream_usage:
+                    usage = await self._consume_stream(stream, messages, kwargs, parts)
+                else:
+                    try:
+                        usage = await self._consume_stream(
+                            stream, messages, {**kwargs, 'stream_options': {'include_usage': True}}, parts
+                        )
+                    except APIStatusError as e:
+                        # 不支持 stream_options 的服务端在建立流时返回参数错误，去掉该参数重试
+                        if parts or e.status_code not in (400, 422):
+                            raise
+                        logger.info(f"服务端拒绝 stream_options，流式调用不再请求token用量: {e}")
+                        usage = await self._consume_stream(stream, messages, kwargs, parts)
+                        self.stream_usage = False
+            finish_call(record, token, response=usage)
+            if self.prompt_cache is not None and not stream.cancelled:
+                self.prompt_cache.store(prompt, system_prompt, cache_params, "".join(parts), semantic=semantic)
+        except Exception as e:
+            finish_call(record, token, error=e)
+            logger.info(f"LLM流式调用失败: {e}")
+
+    async def _consume_stream(self, stream: LLMStream, messages: list, kwargs: dict, parts: list):
+        """逐块读取流式响应并写入 stream，返回带token用量的数据块（服务端未返回时为None）"""
+        usage = None
+        chunks = self.client.chat_completions_stream(messages=messages, **kwargs)
+        try:
+            async for chunk in chunks:
+                if stream.cancelled:
+                    break
+                # 请求了 include_usage 时，用量在最后一个 choices 为空的数据块中
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    stream.put(chunk.choices[0].delta.content)
+        finally:
+            # 取消时立即关闭连接，不再等待剩余内容
+            await chunks.aclose()
+        return usage
+
+    def call(self, prompt: str, system_prompt: str = None, max_tokens: int = None, temperature: float = None,
+             cache: str = "exact") -> str:
+        """
+        同步调用LLM
+
+        Args:
+            cache: 启用提示词缓存时的匹配方式。"exact"（默认）只复用原文完全相同的请求；
+                "semantic" 允许复用规范化后近似相同的请求，只用于只差时间戳、顺序等无关内容的提示词
+        """
+        submitted_at = time.perf_counter()
+        stage = current_stage()
+
+        def make_coro():
+            return self._timed_call(prompt, system_prompt, max_tokens, temperature, submitted_at, stage, cache)
+
         try:
             # 尝试获取当前事件循环
             # 获取当前线程的事件循环（event loop），用于后续判断是否已存在异步事件循环环境（如Jupyter Notebook等）。
@@ -65,12 +268,9 @@ class LLMHelper:
                 try:
                     import nest_asyncio
                     nest_asyncio.apply()
-                    return asyncio.run(self.async_call(prompt, system_prompt, max_tokens, temperature))
+                    return asyncio.run(make_coro())
                 except ImportError:
-                    # 如果没有nest_asyncio，使用create_task
-                    task = asyncio.create_task(self.async_call(prompt, system_prompt, max_tokens, temperature))
-                    # 等待任务完成
-                    import concurrent.futures
+                    # 如果没有nest_asyncio，在新线程中运行
                     import threading
                     
                     result = None
@@ -81,7 +281,7 @@ class LLMHelper:
                         try:
                             new_loop = asyncio.new_event_loop()
                             asyncio.set_event_loop(new_loop)
-                            result = new_loop.run_until_complete(self.async_call(prompt, system_prompt, max_tokens, temperature))
+                            result = new_loop.run_until_complete(make_coro())
                             new_loop.close()
                         except Exception as e:
                             exception = e
@@ -95,10 +295,10 @@ class LLMHelper:
                     return result
             else:
                 # 如果事件循环未运行，直接使用asyncio.run
-                return asyncio.run(self.async_call(prompt, system_prompt, max_tokens, temperature))
+                return asyncio.run(make_coro())
         except RuntimeError:
             # 如果没有事件循环，创建新的
-            return asyncio.run(self.async_call(prompt, system_prompt, max_tokens, temperature))
+            return asyncio.run(make_coro())
     
     def parse_yaml_response(self, response: str) -> dict:
         """解析YAML格式的响应"""
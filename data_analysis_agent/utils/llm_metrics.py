@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+LLM调用指标模块
+
+记录每一次LLM调用的模型、端点（主/备用）、排队等待、首字节时间、总耗时、
+token用量、重试次数和费用，汇总到进程内的指标注册表，支持按阶段汇总并导出为JSON/CSV。
+"""
+
+import os
+import csv
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+
+# 当前所处的流程阶段（如 stage1_data_collection），用于按阶段汇总
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("llm_metrics_stage", default="")
+# 当前正在进行的调用记录，供底层客户端回填端点、重试次数和首字节时间
+_current_record: contextvars.ContextVar[Optional["LLMCallRecord"]] = contextvars.ContextVar(
+    "llm_metrics_record", default=None
+)
+
+
+@dataclass
+class LLMCallRecord:
+    """单次LLM调用的指标记录"""
+
+    model: str = ""
+    endpoint: str = "primary"  # primary, fallback, cache, coalesced
+    stage: str = ""
+    started_at: str = ""
+    queue_wait: float = 0.0  # 提交到实际发出请求之间的等待时间（秒）
+    ttfb: Optional[float] = None  # 发出请求到收到首字节的时间（秒）
+    latency: float = 0.0  # 发出请求到拿到完整结果的时间（秒）
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    success: bool = True
+    error: str = ""
+    cost: float = 0.0
+
+    # 内部计时起点，不参与导出
+    _dispatched_at: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（不含内部字段）"""
+        return {k: v for k, v in asdict(self).items() if not k.startswith('_')}
+
+
+class LLMMetricsRegistry:
+    """进程内LLM调用指标注册表，线程安全"""
+
+    def __init__(self):
+        self._records: List[LLMCallRecord] = []
+        self._pricing: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def set_pricing(self, model: str, prompt_price_per_1k: float, completion_price_per_1k: float):
+        """
+        设置模型单价，用于估算调用费用
+
+        Args:
+            model: 模型名称
+            prompt_price_per_1k: 每1000个输入token的价格
+            completion_price_per_1k: 每1000个输出token的价格
+        """
+        with self._lock:
+            self._pricing[model] = (prompt_price_per_1k, completion_price_per_1k)
+
+    def record(self, record: LLMCallRecord):
+        """登记一条调用记录，并按单价计算费用"""
+        with self._lock:
+            prompt_price, completion_price = self._pricing.get(record.model, (0.0, 0.0))
+            record.cost = (record.prompt_tokens * prompt_price + record.completion_tokens * completion_price) / 1000
+            self._records.append(record)
+
+    def records(self) -> List[LLMCallRecord]:
+        """返回所有调用记录的副本"""
+        with self._lock:
+            return list(self._records)
+
+    def reset(self):
+        """清空所有调用记录"""
+        with self._lock:
+            self._records = []
+
+    def rollup(self, key: str = "stage") -> Dict[str, Dict[str, Any]]:
+        """
+        按指定字段汇总调用指标
+
+        Args:
+            key: 汇总字段，如 stage、model、endpoint
+
+        Returns:
+            {分组值: 汇总指标字典}
+        """
+        groups: Dict[str, List[LLMCallRecord]] = {}
+        for record in self.records():
+            groups.setdefault(str(getattr(record, key, "")) or "未分组", []).append(record)
+
+        rollups = {}
+        for group, records in groups.items():
+            latencies = sorted(r.latency for r in records)
+            ttfbs = [r.ttfb for r in records if r.ttfb is not None]
+            rollups[group] = {
+                'calls': len(records),
+                'failures': sum(1 for r in records if not r.success),
+                'fallback_calls': sum(1 for r in records if r.endpoint == 'fallback'),
+                'cache_hits': sum(1 for r in records if r.endpoint == 'cache'),
+                'coalesced_calls': sum(1 for r in records if r.endpoint == 'coalesced'),
+                'retries': sum(r.retries for r in records),
+                'total_latency': round(sum(latencies), 3),
+                'avg_latency': round(sum(latencies) / len(latencies), 3),
+                'p95_latency': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                'avg_ttfb': round(sum(ttfbs) / len(ttfbs), 3) if ttfbs else None,
+                'total_queue_wait': round(sum(r.queue_wait for r in records), 3),
+                'prompt_tokens': sum(r.prompt_tokens for r in records),
+                'completion_tokens': sum(r.completion_tokens for r in records),
+                'cost': round(sum(r.cost for r in records), 6),
+            }
+        return rollups
+
+    def dump(self, output_dir: str, prefix: str = "llm_metrics") -> Dict[str, str]:
+        """
+        将调用明细和汇总导出为JSON和CSV文件
+
+        Args:
+            output_dir: 输出目录
+            prefix: 文件名前缀
+
+        Returns:
+            {'json': JSON文件路径, 'csv': CSV文件路径}
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        json_path = os.path.join(output_dir, f"{prefix}_{timestamp}.json")
+        csv_path = os.path.join(output_dir, f"{prefix}_{timestamp}.csv")
+
+        rows = [record.to_dict() for record in self.records()]
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'by_stage': self.rollup('stage'),
+                'by_model': self.rollup('model'),
+                'by_endpoint': self.rollup('endpoint'),
+                'calls': rows,
+            }, f, ensure_ascii=False, indent=2)
+
+        columns = [f.name for f in fields(LLMCallRecord) if not f.name.startswith('_')]
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        return {'json': json_path, 'csv': csv_path}
+
+    def summary(self) -> str:
+        """生成按阶段汇总的简要文本"""
+        lines = []
+        for stage, stats in self.rollup('stage').items():
+            lines.append(
+                f"- {stage}: {stats['calls']} 次调用, 总耗时 {stats['total_latency']}s, "
+                f"平均 {stats['avg_latency']}s, tokens {stats['prompt_tokens']}+{stats['completion_tokens']}, "
+                f"重试 {stats['retries']} 次, 费用 {stats['cost']}"
+            )
+        return "\n".join(lines)
+
+
+_registry = LLMMetricsRegistry()
+
+
+def get_metrics_registry() -> LLMMetricsRegistry:
+    """获取进程级的指标注册表"""
+    return _registry
+
+
+@contextmanager
+def metrics_stage(name: str):
+    """
+    标记当前所处的流程阶段，嵌套时以 "/" 连接
+
+    用法:
+        with metrics_stage("stage1_data_collection"):
+            ...
+    """
+    parent = _current_stage.get()
+    token = _current_stage.set(f"{parent}/{name}" if parent else name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_stage() -> str:
+    """获取当前阶段名称"""
+    return _current_stage.get()
+
+
+def start_call(model: str, stage: str, submitted_at: float) -> Tuple[LLMCallRecord, contextvars.Token]:
+    """开始一次调用的计时，返回记录对象和上下文令牌"""
+    now = time.perf_counter()
+    record = LLMCallRecord(
+        model=model,
+        stage=stage,
+        started_at=datetime.now().isoformat(timespec='seconds'),
+        queue_wait=max(0.0, now - submitted_at),
+        _dispatched_at=now,
+    )
+    return record, _current_record.set(record)
+
+
+def finish_call(record: LLMCallRecord, token: contextvars.Token, response: Any = None, error: Exception = None):
+    """结束一次调用的计时，回填token用量并登记到注册表"""
+    _current_record.reset(token)
+    record.latency = time.perf_counter() - record._dispatched_at
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        record.prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        record.completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    if error is not None:
+        record.success = False
+        record.error = f"{type(error).__name__}: {error}"
+    _registry.record(record)
+
+
+def note_dispatch():
+    """等到并发名额、真正发出请求时调用：等待时间计入排队时间，耗时从此刻开始计算"""
+    record = _current_record.get()
+    if record is None:
+        return
+    now = time.perf_counter()
+    record.queue_wait += now - record._dispatched_at
+    record._dispatched_at = now
+
+
+def note_attempt(api_name: str, model_name: str, attempt: int):
+    """由底层客户端在每次尝试前调用，记录端点、实际模型和重试次数"""
+    record = _current_record.get()
+    if record is None:
+        return
+    endpoint = 'fallback' if api_name == "备用" else 'primary'
+    if attempt > 0 or endpoint != record.endpoint:
+        record.retries += 1
+    record.endpoint = endpoint
+    record.model = model_name
+    # 重新尝试时首字节时间以最后一次成功的请求为准
+    record.ttfb = None
+
+
+async def mark_first_byte(*_args):
+    """httpx响应钩子：收到响应头时记录首字节时间"""
+    record = _current_record.get()
+    if record is not None and record.ttfb is None:
+        record.ttfb = time.perf_counter() - record._dispatched_at
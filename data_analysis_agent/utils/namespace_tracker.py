@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+执行环境命名空间跟踪模块
+
+每轮都完整扫描 shell.user_ns 并对每个变量调用 hasattr/str，在命名空间里有很多大表时开销不断增长。
+NamespaceTracker 只为身份（id）或版本（如 shape）发生变化的变量重新生成描述，
+并缓存有长度上限的摘要字符串，命名空间没有变化时直接复用。
+"""
+
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+# IPython 内置的特殊变量
+IGNORED_NAMES = {'In', 'Out', 'get_ipython', 'exit', 'quit'}
+# 需要完整展示取值的重要配置变量
+IMPORTANT_NAMES = {'session_output_dir'}
+
+
+def _data_shape(value: Any) -> Optional[tuple]:
+    """返回 pandas/numpy 等数据对象的形状，其他对象返回None"""
+    shape = getattr(value, 'shape', None)
+    return shape if isinstance(shape, tuple) else None
+
+
+def describe_variable(name: str, value: Any) -> Optional[str]:
+    """
+    生成变量的简要描述，不值得展示的变量返回None
+
+    Args:
+        name: 变量名
+        value: 变量值
+    """
+    try:
+        shape = _data_shape(value)
+        if shape is not None:
+            # pandas的DataFrame或numpy的ndarray，记录其类型和shape信息
+            return f"{type(value).__name__} with shape {shape}"
+        if name in IMPORTANT_NAMES:
+            return str(value)
+        if isinstance(value, (int, float, str, bool)) and len(str(value)) < 100:
+            return f"{type(value).__name__}: {value}"
+        module = getattr(value, '__module__', None)
+        if module in ('pandas', 'numpy', 'matplotlib.pyplot'):
+            return f"导入的模块: {module}"
+    except Exception:
+        # 某些变量在获取属性时可能会报错，直接跳过
+        pass
+    return None
+
+
+class NamespaceTracker:
+    """
+    增量跟踪命名空间变化
+
+    版本号由对象身份和数据形状组成：重新赋值会改变身份，DataFrame 增删行列会改变形状，
+    两者都不变的变量沿用上一轮的描述。
+    """
+
+    def __init__(self, max_vars: int = 60, max_chars: int = 4000):
+        """
+        Args:
+            max_vars: 摘要中最多列出的变量数
+            max_chars: 摘要字符串的最大长度
+        """
+        self.max_vars = max_vars
+        self.max_chars = max_chars
+        self._versions: Dict[str, Tuple[int, Optional[tuple]]] = {}
+        self._descriptions: Dict[str, str] = {}
+        self._summary: Optional[str] = None
+
+    def reset(self):
+        """清空跟踪状态"""
+        self._versions = {}
+        self._descriptions = {}
+        self._summary = None
+
+    def update(self, namespace: Dict[str, Any]) -> Set[str]:
+        """
+        与上一次的状态对比，只重新描述发生变化的变量
+
+        Args:
+            namespace: 执行环境的用户命名空间
+
+        Returns:
+            新增或发生变化的变量名集合
+        """
+        changed = set()
+        seen = set()
+        for name, value in namespace.items():
+            if name.startswith('_') or name in IGNORED_NAMES:
+                continue
+            seen.add(name)
+            version = (id(value), _data_shape(value))
+            if self._versions.get(name) == version:
+                continue
+            self._versions[name] = version
+            changed.add(name)
+            description = describe_variable(name, value)
+            if description is None:
+                self._descriptions.pop(name, None)
+            else:
+                self._descriptions[name] = description
+
+        removed = set(self._versions) - seen
+        for name in removed:
+            self._versions.pop(name, None)
+            self._descriptions.pop(name, None)
+
+        if changed or removed:
+            self._summary = None
+        return changed
+
+    def description(self, name: str) -> Optional[str]:
+        """获取变量的缓存描述"""
+        return self._descriptions.get(name)
+
+    def version(self, name: str) -> Optional[Tuple[int, Optional[tuple]]]:
+        """变量当前的版本号（对象身份, 数据形状），未跟踪的变量返回None"""
+        return self._versions.get(name)
+
+    def is_data(self, name: str) -> bool:
+        """变量是否为带形状的数据对象（DataFrame、ndarray等）"""
+        version = self._versions.get(name)
+        return version is not None and version[1] is not None
+
+    def summary(self, namespace: Dict[str, Any]) -> str:
+        """
+        获取有长度上限的变量摘要，命名空间未变化时直接返回缓存
+
+        Args:
+            namespace: 执行环境的用户命名空间
+        """
+        self.update(namespace)
+        if self._summary is not None:
+            return self._summary
+
+        lines = []
+        total = 0
+        items = list(self._descriptions.items())
+        for index, (name, description) in enumerate(items):
+            line = f"- {name}: {description}"
+            if index >= self.max_vars or total + len(line) > self.max_chars:
+                lines.append(f"- ……另有 {len(items) - index} 个变量未列出")
+                break
+            lines.append(line)
+            total += len(line) + 1
+        self._summary = "\n".join(lines)
+        return self._summary
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+有上限的执行输出捕获与压缩
+
+生成的代码里一句 print(df) 或一个啰嗦的循环就可能输出几十KB，并被带进之后每一轮的提示词。
+BoundedOutput 在写入时就按字符数和行数预算截断：保留开头和结尾、合并连续重复的行、
+折叠进度条的回车刷新、去掉终端颜色码，无论代码打印多少内容，反馈的大小都是可预期的。
+"""
+
+import io
+import os
+import re
+import sys
+from collections import deque
+from contextlib import contextmanager
+from typing import Any
+
+# 输出预算，可通过环境变量调整
+MAX_OUTPUT_CHARS = int(os.environ.get("EXEC_OUTPUT_MAX_CHARS", "8000"))
+MAX_OUTPUT_LINES = int(os.environ.get("EXEC_OUTPUT_MAX_LINES", "200"))
+# 单行最大长度，超出部分截断
+MAX_LINE_CHARS = 1000
+
+_ANSI_PATTERN = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+
+class BoundedOutput(io.TextIOBase):
+    """
+    有预算的文本输出流
+
+    前一半预算保留最先输出的内容，后一半以滑动窗口保留最后输出的内容，中间省略的行数会被标注。
+    """
+
+    def __init__(self, max_chars: int = None, max_lines: int = None):
+        """
+        Args:
+            max_chars: 保留的最大字符数
+            max_lines: 保留的最大行数
+        """
+        self.max_chars = max_chars or MAX_OUTPUT_CHARS
+        self.max_lines = max_lines or MAX_OUTPUT_LINES
+        self._head = []
+        self._head_chars = 0
+        self._tail = deque()
+        self._tail_chars = 0
+        self._partial = ""
+        self._last_line = None
+        self._repeats = 0
+        self._dropped = 0
+        self.total_chars = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return False
+
+    @property
+    def encoding(self) -> str:
+        return 'utf-8'
+
+    def write(self, s: str) -> int:
+        self.total_chars += len(s)
+        data = self._partial + _ANSI_PATTERN.sub('', s)
+        lines = data.split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._add_line(line)
+        if len(self._partial) > MAX_LINE_CHARS * 2:
+            # 超长且没有换行的输出，先按单行处理，避免缓冲区无限增长
+            self._add_line(self._partial)
+            self._partial = ""
+        return len(s)
+
+    def _add_line(self, line: str):
+        # 进度条等用回车刷新同一行，只保留最后的状态
+        if '\r' in line:
+            line = line.rstrip('\r').rsplit('\r', 1)[-1]
+        if len(line) > MAX_LINE_CHARS:
+            line = f"{line[:MAX_LINE_CHARS]}……（本行共 {len(line)} 个字符，已截断）"
+        if line == self._last_line:
+            self._repeats += 1
+            return
+        self._flush_repeats()
+        self._last_line = line
+        self._append(line)
+
+    def _flush_repeats(self):
+        if self._repeats:
+            repeats, self._repeats = self._repeats, 0
+            self._append(f"……（上一行又重复了 {repeats} 次）")
+
+    def _append(self, line: str):
+        size = len(line) + 1
+        if len(self._head) < self.max_lines // 2 and self._head_chars + size <= self.max_chars // 2:
+            self._head.append(line)
+            self._head_chars += size
+            return
+        self._tail.append(line)
+        self._tail_chars += size
+        while self._tail and (len(self._tail) > self.max_lines - len(self._head)
+                              or self._tail_chars > self.max_chars - self._head_chars):
+            self._tail_chars -= len(self._tail.popleft()) + 1
+            self._dropped += 1
+
+    def getvalue(self) -> str:
+        """获取压缩后的输出"""
+        lines = list(self._head)
+        if self._dropped:
+            lines.append(f"……（省略 {self._dropped} 行输出，原始输出共 {self.total_chars} 个字符）……")
+        lines.extend(self._tail)
+        if self._repeats:
+            lines.append(f"……（上一行又重复了 {self._repeats} 次）")
+        text = "\n".join(lines)
+        if self._partial:
+            text = f"{text}\n{self._partial[:MAX_LINE_CHARS]}" if lines else self._partial[:MAX_LINE_CHARS]
+        elif lines:
+            text += "\n"
+        return text
+
+
+@contextmanager
+def bounded_capture(max_chars: int = None, max_lines: int = None):
+    """
+    捕获标准输出（有预算），标准错误单独捕获后丢弃，与 IPython capture_output 的用法一致
+
+    用法:
+        with bounded_capture() as out:
+            shell.run_cell(code)
+        text = out.getvalue()
+    """
+    out = BoundedOutput(max_chars, max_lines)
+    err = BoundedOutput(max_chars, max_lines)
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err
+    try:
+        yield out
+    finally:
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+
+
+def compact_text(text: str, max_chars: int = None, max_lines: int = None) -> str:
+    """
+    按预算压缩一段已有的文本
+
+    Args:
+        text: 原始文本
+        max_chars: 保留的最大字符数
+        max_lines: 保留的最大行数
+    """
+    if not text:
+        return text
+    out = BoundedOutput(max_chars, max_lines)
+    out.write(text)
+    return out.getvalue()
+
+
+def summarize_dataframe(obj: Any, max_rows: int = 15, max_columns: int = 20) -> str:
+    """
+    生成 DataFrame/Series 的紧凑摘要：形状、列类型、首尾行和数值列的描述统计
+
+    Args:
+        obj: pandas DataFrame 或 Series
+        max_rows: 行数不超过该值时完整展示，否则只展示前5行和后5行
+        max_columns: 最多展示的列数
+    """
+    import pandas as pd
+
+    if isinstance(obj, pd.Series):
+        obj = obj.to_frame()
+    rows, cols = obj.shape
+    parts = [f"数据表形状: {rows}行 x {cols}列"]
+
+    dtypes = [f"{col}({dtype})" for col, dtype in list(obj.dtypes.items())[:max_columns]]
+    more = f" ……另有 {cols - max_columns} 列" if cols > max_columns else ""
+    parts.append(f"列及类型: {', '.join(dtypes)}{more}")
+
+    view = obj.iloc[:, :max_columns]
+    with pd.option_context('display.max_columns', max_columns, 'display.width', 200):
+        if rows <= max_rows:
+            parts.append(str(view))
+        else:
+            parts.append(f"{view.head(5)}\n...\n(省略 {rows - 10} 行)\n...\n{view.tail(5)}")
+            numeric = view.select_dtypes('number')
+            if not numeric.empty:
+                parts.append(f"数值列统计:\n{numeric.describe().T.round(4)}")
+    return "\n".join(parts)
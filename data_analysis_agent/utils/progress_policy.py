@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+分析进度跟踪与轮次策略
+
+智能体会一直运行到 analysis_complete 或 max_rounds，后期经常连续几轮只是重复检查数据、
+重画同样的图，没有任何新产出，却每轮都要付出一次完整的LLM调用。
+代码执行失败的轮次是模型在修正代码，不算停滞：既不计入、也不打断连续无进展的轮数。
+
+ProgressTracker 统计每轮新增的产出（图片、数据变量、此前未出现过的输出内容、收集的图片），
+ProgressPolicy 在边际产出停滞时介入：先要求收集已生成但未收集的图片，仍无进展则直接结束多轮分析、
+进入最终报告，并记录节省的轮数。
+"""
+
+import os
+import hashlib
+from typing import Any, Dict, List, Set
+
+# 连续无进展多少轮后结束分析，0表示不启用
+STALL_PATIENCE = int(os.environ.get("AGENT_STALL_PATIENCE", "3"))
+
+
+class RoundProgress:
+    """单轮的新增产出"""
+
+    __slots__ = ('round', 'action', 'figures', 'variables', 'findings', 'collected', 'failed')
+
+    def __init__(self, round_number: int, action: str):
+        self.round = round_number
+        self.action = action
+        self.figures = 0
+        self.variables = 0
+        self.findings = 0
+        self.collected = 0
+        # 代码执行失败的轮次
+        self.failed = False
+
+    @property
+    def score(self) -> int:
+        """新增产出总数，为0表示本轮没有进展"""
+        return self.figures + self.variables + self.findings + self.collected
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ProgressTracker:
+    """按轮记录新增产出"""
+
+    def __init__(self):
+        self.rounds: List[RoundProgress] = []
+        self._figures: Set[str] = set()
+        self._collected: Set[str] = set()
+        self._variables: Set[str] = set()
+        self._lines: Set[str] = set()
+
+    def record(self, round_number: int, process_result: Dict[str, Any]) -> RoundProgress:
+        """
+        记录一轮的处理结果
+
+        Args:
+            round_number: 轮次
+            process_result: _process_response 的返回值
+
+        Returns:
+            本轮的新增产出
+        """
+        action = process_result.get('action', '')
+        progress = RoundProgress(round_number, action)
+
+        if action == 'generate_code':
+            result = process_result.get('result') or {}
+            if result.get('success'):
+                for path in result.get('figures') or []:
+                    if path not in self._figures:
+                        self._figures.add(path)
+                        progress.figures += 1
+                for name in result.get('variables') or {}:
+                    if name not in self._variables:
+                        self._variables.add(name)
+                        progress.variables += 1
+                progress.findings = self._new_lines(result.get('output', ''))
+            else:
+                progress.failed = True
+        elif action == 'collect_figures':
+            for figure in process_result.get('collected_figures', []):
+                path = figure.get('file_path')
+                if path and path not in self._collected:
+                    self._collected.add(path)
+                    progress.collected += 1
+
+        self.rounds.append(progress)
+        return progress
+
+    def _new_lines(self, output: str) -> int:
+        """统计此前各轮从未出现过的输出行，重复打印同样的表格或提示不算新结论"""
+        count = 0
+        for line in output.splitlines():
+            line = " ".join(line.split())
+            if len(line) < 4:
+                continue
+            key = hashlib.md5(line.encode('utf-8')).hexdigest()
+            if key not in self._lines:
+                self._lines.add(key)
+                count += 1
+        return count
+
+    def stalled_rounds(self) -> int:
+        """最近连续没有进展的轮数，代码执行失败的轮次跳过不计"""
+        count = 0
+        for progress in reversed(self.rounds):
+            if progress.failed:
+                continue
+            if progress.score:
+                break
+            count += 1
+        return count
+
+    def uncollected_figures(self) -> List[str]:
+        """已生成但还未被收集的图片"""
+        return sorted(self._figures - self._collected)
+
+
+class ProgressPolicy:
+    """根据进展决定继续、要求收集图片还是结束分析"""
+
+    CONTINUE = 'continue'
+    COLLECT_FIGURES = 'collect_figures'
+    FINISH = 'finish'
+
+    def __init__(self, patience: int = None, min_rounds: int = 3):
+        """
+        Args:
+            patience: 连续无进展多少轮后结束分析，默认读取环境变量 AGENT_STALL_PATIENCE，0表示不启用
+            min_rounds: 至少运行的轮数，之前不做干预
+        """
+        self.patience = STALL_PATIENCE if patience is None else patience
+        self.min_rounds = min_rounds
+        self._collect_requested = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.patience > 0
+
+    def decide(self, tracker: ProgressTracker) -> str:
+        """
+        根据最近的进展给出下一步动作
+
+        停滞一半耐心轮数且有未收集的图片时，要求收集图片（每次停滞只要求一次）；
+        停滞达到耐心轮数时结束分析。
+        """
+        if not self.enabled or len(tracker.rounds) < self.min_rounds:
+            return self.CONTINUE
+        stalled = tracker.stalled_rounds()
+        if stalled == 0:
+            self._collect_requested = False
+            return self.CONTINUE
+        if stalled >= self.patience:
+            return self.FINISH
+        if (stalled >= max(1, self.patience // 2) and not self._collect_requested
+                and tracker.uncollected_figures()):
+            self._collect_requested = True
+            return self.COLLECT_FIGURES
+        return self.CONTINUE
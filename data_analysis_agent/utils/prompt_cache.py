@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+近似重复提示词缓存模块
+
+很多提示词之间只差时间戳、搜索结果顺序或空白字符。本模块先对输入做规范化，
+再用 MinHash + LSH 建立本地相似度索引，相似度超过阈值的请求直接复用之前的回答。
+
+近似匹配只用于调用方明确声明的场景（如 company_infos 整理），其余调用只按原文精确匹配：
+多轮对话的下一轮提示词是上一轮的超集，不同公司的长报告提示词只差公司名称，
+这类提示词的相似度都很高，但不能复用彼此的回答。
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import threading
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 时间戳、会话目录等每次运行都会变化但不影响语义的片段；日期本身保留，
+# 报告期（如 2023-12-31 00:00:00）不同的提示词不能视为相同
+_VOLATILE_PATTERNS = [
+    (re.compile(r'session_[0-9a-f]{32}'), 'session_<id>'),
+    (re.compile(r'\d{8}_\d{6}'), '<timestamp>'),
+    (re.compile(r'(\d{4}-\d{2}-\d{2})[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?'), r'\1 <time>'),
+    (re.compile(r'\d{1,2}:\d{2}:\d{2}'), '<time>'),
+]
+# 本仓库拼接多段材料时使用的【xxx开始】...【xxx结束】分段
+_BLOCK_PATTERN = re.compile(r'【([^】]*?)开始】.*?【\1结束】', re.S)
+_WHITESPACE = re.compile(r'\s+')
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def _canonicalize_block(block: str) -> str:
+    """分段内部按 ---- 分隔的条目（如搜索结果）排序"""
+    if '\n----\n' not in block:
+        return block
+    entries = block.split('\n----\n')
+    return '\n----\n'.join(sorted(entries))
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    规范化提示词：屏蔽易变片段，对无序的分段排序，折叠空白
+
+    Args:
+        text: 原始提示词
+
+    Returns:
+        规范化后的文本
+    """
+    if not text:
+        return ""
+    for pattern, placeholder in _VOLATILE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+
+    blocks = [_canonicalize_block(m.group(0)) for m in _BLOCK_PATTERN.finditer(text)]
+    if len(blocks) > 1:
+        # 多个分段的先后顺序不影响语义（例如 os.listdir 的顺序），排序后拼回原位
+        skeleton = _BLOCK_PATTERN.sub('\x00', text)
+        parts = skeleton.split('\x00')
+        ordered = iter(sorted(blocks))
+        text = ''.join(part + next(ordered, '') for part in parts)
+
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class MinHasher:
+    """基于字符n-gram的MinHash签名计算器"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 42):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """计算文本的MinHash签名"""
+        k = self.shingle_size
+        if len(text) <= k:
+            shingles = {text}
+        else:
+            shingles = {text[i:i + k] for i in range(len(text) - k + 1)}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def similarity(sig1: np.ndarray, sig2: np.ndarray) -> float:
+        """估算两个签名对应文本的Jaccard相似度"""
+        return float(np.mean(sig1 == sig2))
+
+
+class SemanticPromptCache:
+    """
+    近似重复提示词缓存
+
+    - 精确层（默认）：提示词、系统提示词原文完全一致时命中
+    - 近似层（semantic=True）：规范化文本的哈希一致时命中；否则MinHash签名经LSH分桶召回候选，
+      相似度不低于阈值时命中。近似层的条目只和近似层的请求互相匹配
+    - 模型、温度、最大token数必须完全一致
+    """
+
+    def __init__(self, cache_dir: str = ".llm_cache", threshold: float = 0.9,
+                 num_perm: int = 64, bands: int = 16, max_entries: int = 5000):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存持久化目录
+            threshold: 相似度阈值（0~1），越高越严格
+            num_perm: MinHash签名长度
+            bands: LSH分段数，须能整除 num_perm
+            max_entries: 最多保留的条目数
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.hasher = MinHasher(num_perm=num_perm)
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._buckets: Dict[Tuple[str, int, bytes], set] = {}
+        self._lock = threading.Lock()
+        self._path = os.path.join(cache_dir, "prompt_cache.jsonl")
+        self._load()
+
+    @staticmethod
+    def _params_key(system_prompt: Optional[str], params: Dict[str, Any], semantic: bool) -> str:
+        """请求参数键：除用户提示词外的所有参数都必须完全一致，精确层和近似层的键互不相同"""
+        payload = json.dumps({
+            'mode': 'semantic' if semantic else 'exact',
+            'system': normalize_prompt(system_prompt or "") if semantic else (system_prompt or ""),
+            'params': params,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_key(self, prompt: str, system_prompt: Optional[str], params: Dict[str, Any],
+                   semantic: bool) -> Tuple[str, str, str]:
+        """返回 (参数键, 条目ID, 参与匹配的文本)"""
+        text = normalize_prompt(prompt) if semantic else (prompt or "")
+        params_key = self._params_key(system_prompt, params, semantic)
+        entry_id = hashlib.sha256(f"{params_key}:{text}".encode('utf-8')).hexdigest()
+        return params_key, entry_id, text
+
+    def _band_keys(self, params_key: str, signature: np.ndarray) -> List[Tuple[str, int, bytes]]:
+        return [
+            (params_key, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _index(self, entry_id: str, entry: Dict[str, Any]):
+        self._entries[entry_id] = entry
+        if entry['signature'] is None:
+            return
+        for band_key in self._band_keys(entry['params_key'], entry['signature']):
+            self._buckets.setdefault(band_key, set()).add(entry_id)
+
+    def _evict(self):
+        """超过容量时按创建时间淘汰最旧的条目"""
+        overflow = len(self._entries) - self.max_entries
+        if overflow <= 0:
+            return
+        oldest = sorted(self._entries, key=lambda k: self._entries[k]['created'])[:overflow]
+        for entry_id in oldest:
+            entry = self._entries.pop(entry_id)
+            if entry['signature'] is None:
+                continue
+            for band_key in self._band_keys(entry['params_key'], entry['signature']):
+                self._buckets.get(band_key, set()).discard(entry_id)
+
+    @staticmethod
+    def _serialize(entry: Dict[str, Any]) -> str:
+        signature = entry['signature']
+        return json.dumps({**entry, 'signature': None if signature is None else signature.tolist()},
+                          ensure_ascii=False)
+
+    def _load(self):
+        """从磁盘加载已持久化的缓存条目"""
+        if not os.path.exists(self._path):
+            return
+        try:
+            line_count = 0
+            with open(self._path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    data = json.loads(line)
+                    line_count += 1
+                    if 'mode' not in data:
+                        # 旧版本的条目全部参与近似匹配，且规范化会屏蔽报告期日期，不再使用
+                        continue
+                    if data['signature'] is not None:
+                        data['signature'] = np.array(data['signature'], dtype=np.uint64)
+                    self._index(data['id'], data)
+            self._evict()
+            if line_count > len(self._entries):
+                self._compact()
+            logger.info(f"加载提示词缓存 {len(self._entries)} 条: {self._path}")
+        except Exception as e:
+            logger.warning(f"加载提示词缓存失败，忽略已有缓存: {e}")
+            self._entries, self._buckets = {}, {}
+
+    def _compact(self):
+        """重写持久化文件，去掉重复和已淘汰的条目"""
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self._entries.values():
+                f.write(self._serialize(entry) + "\n")
+        os.replace(tmp_path, self._path)
+
+    def lookup(self, prompt: str, system_prompt: Optional[str], params: Dict[str, Any],
+               semantic: bool = False) -> Optional[str]:
+        """
+        查找可复用的回答
+
+        Args:
+            prompt: 用户提示词
+            system_prompt: 系统提示词
+            params: 模型、温度等请求参数
+            semantic: 是否允许近似匹配，只应用于只差时间戳、顺序等无关内容的提示词
+
+        Returns:
+            命中时返回缓存的回答，否则返回None
+        """
+        params_key, entry_id, normalized = self._entry_key(prompt, system_prompt, params, semantic)
+
+        with self._lock:
+            if entry_id in self._entries:
+                logger.info("提示词缓存精确命中")
+                return self._entries[entry_id]['response']
+        if not semantic:
+            return None
+
+        signature = self.hasher.signature(normalized)
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(params_key, signature):
+                candidates |= self._buckets.get(band_key, set())
+            best_id, best_score = None, 0.0
+            for candidate_id in candidates:
+                score = MinHasher.similarity(signature, self._entries[candidate_id]['signature'])
+                if score > best_score:
+                    best_id, best_score = candidate_id, score
+            if best_id is not None and best_score >= self.threshold:
+                logger.info(f"提示词缓存相似命中，相似度 {best_score:.3f}")
+                return self._entries[best_id]['response']
+        return None
+
+    def store(self, prompt: str, system_prompt: Optional[str], params: Dict[str, Any], response: str,
+              semantic: bool = False):
+        """保存一次调用的回答，semantic 与查找时一致"""
+        if not response:
+            return
+        params_key, entry_id, normalized = self._entry_key(prompt, system_prompt, params, semantic)
+        entry = {
+            'id': entry_id,
+            'mode': 'semantic' if semantic else 'exact',
+            'params_key': params_key,
+            'signature': self.hasher.signature(normalized) if semantic else None,
+            'response': response,
+            'created': time.time(),
+        }
+        with self._lock:
+            self._index(entry_id, entry)
+            self._evict()
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(self._path, 'a', encoding='utf-8') as f:
+                    f.write(self._serialize(entry) + "\n")
+            except Exception as e:
+                logger.warning(f"写入提示词缓存失败: {e}")
+
+
+_caches: Dict[Tuple[str, float], SemanticPromptCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_prompt_cache(cache_dir: str = ".llm_cache", threshold: float = 0.9) -> SemanticPromptCache:
+    """获取共享的缓存实例，同一目录和阈值在进程内只加载一次"""
+    key = (os.path.abspath(cache_dir), threshold)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = SemanticPromptCache(cache_dir=cache_dir, threshold=threshold)
+        return _caches[key]
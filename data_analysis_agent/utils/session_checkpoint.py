@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+分析会话检查点
+
+多轮分析过程中进程一旦退出，对话历史、分析结果和执行环境中的变量全部丢失，只能从头再跑一遍。
+检查点保存在会话目录的 checkpoint/ 下：
+    state.json: 对话历史、分析结果、轮次和输入文件等会话状态
+    variables/manifest.json: 执行环境变量清单
+    variables/*.parquet / *.npz: DataFrame、Series 和 numpy 数组
+简单的标量、列表和字典直接写入清单；预加载的数据文件变量可以从原文件重建，不重复保存。
+上一次保存后没有变化的变量直接链接上一份快照中的文件，不重新编码写入。
+
+每次保存都先写入临时文件/目录再原子替换，中途退出也不会留下半份检查点：
+变量目录替换过程中退出时，读取会回退到同名的 .old（上一份快照）或已写完的 .tmp（新快照）目录。
+"""
+
+import os
+import glob
+import json
+import uuid
+import shutil
+import logging
+from typing import Any, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIRNAME = "checkpoint"
+_STATE_FILE = "state.json"
+_VARIABLES_DIRNAME = "variables"
+_MANIFEST_FILE = "manifest.json"
+
+
+def checkpoint_dir(session_output_dir: str) -> str:
+    """会话目录对应的检查点目录"""
+    return os.path.join(session_output_dir, CHECKPOINT_DIRNAME)
+
+
+def has_checkpoint(session_output_dir: str) -> bool:
+    """会话目录中是否存在检查点"""
+    return os.path.isfile(os.path.join(checkpoint_dir(session_output_dir), _STATE_FILE))
+
+
+def _write_json(path: str, data: Any):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def save_session_state(session_output_dir: str, state: Dict[str, Any]):
+    """
+    保存会话状态
+
+    Args:
+        session_output_dir: 会话目录
+        state: 可JSON序列化的会话状态，无法序列化的值按字符串保存
+    """
+    directory = checkpoint_dir(session_output_dir)
+    os.makedirs(directory, exist_ok=True)
+    _write_json(os.path.join(directory, _STATE_FILE), state)
+
+
+def load_session_state(session_output_dir: str) -> Dict[str, Any]:
+    """
+    读取会话状态
+
+    Raises:
+        FileNotFoundError: 会话目录中没有检查点
+    """
+    with open(os.path.join(checkpoint_dir(session_output_dir), _STATE_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _is_json_value(value: Any, depth: int = 0) -> bool:
+    """是否为可以直接写入清单的简单值（限制嵌套深度和元素个数）"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True
+    if depth >= 3:
+        return False
+    if isinstance(value, (list, tuple)):
+        return len(value) <= 1000 and all(_is_json_value(v, depth + 1) for v in value)
+    if isinstance(value, dict):
+        return (len(value) <= 1000 and all(isinstance(k, str) for k in value)
+                and all(_is_json_value(v, depth + 1) for v in value.values()))
+    return False
+
+
+def _save_variable(directory: str, index: int, name: str, value: Any) -> Optional[Dict[str, Any]]:
+    """保存单个变量，返回清单条目；不支持的类型返回None"""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame):
+        filename = f"{index}.parquet"
+        frame = value.copy(deep=False)
+        # Parquet 要求列名为字符串，原列名记录在清单中以便恢复
+        columns = list(frame.columns)
+        frame.columns = [str(i) for i in range(len(columns))]
+        frame.to_parquet(os.path.join(directory, filename))
+        return {'kind': 'dataframe', 'file': filename, 'columns': [_to_json_key(c) for c in columns]}
+    if isinstance(value, pd.Series):
+        filename = f"{index}.parquet"
+        value.to_frame('value').to_parquet(os.path.join(directory, filename))
+        return {'kind': 'series', 'file': filename, 'series_name': _to_json_key(value.name)}
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return None
+        filename = f"{index}.npz"
+        np.savez(os.path.join(directory, filename), value=value)
+        return {'kind': 'ndarray', 'file': filename}
+    if _is_json_value(value):
+        return {'kind': 'tuple' if isinstance(value, tuple) else 'json', 'value': value}
+    return None
+
+
+def _to_json_key(value: Any) -> Any:
+    """列名/Series名只能按简单值保存，其他类型转为字符串"""
+    if isinstance(value, tuple):
+        return {'tuple': [_to_json_key(v) for v in value]}
+    return value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+
+
+def _from_json_key(value: Any) -> Any:
+    if isinstance(value, dict) and 'tuple' in value:
+        return tuple(_from_json_key(v) for v in value['tuple'])
+    return value
+
+
+def _reuse_variable(source: str, entry: Optional[Dict[str, Any]], directory: str,
+                    index: int) -> Optional[Dict[str, Any]]:
+    """把上一份快照中变量的文件链接（不支持硬链接时复制）到新目录，返回清单条目；没有可复用的文件时返回None"""
+    if not entry or 'file' not in entry:
+        return None
+    filename = f"{index}{os.path.splitext(entry['file'])[1]}"
+    src, dst = os.path.join(source, entry['file']), os.path.join(directory, filename)
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            shutil.copy2(src, dst)
+        except OSError:
+            return None
+    return {**entry, 'file': filename}
+
+
+def write_variables(target: str, variables: Dict[str, Any], unchanged: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    把变量写入目录（先写入临时目录再原子替换）
+
+    Args:
+        target: 目标目录，已存在时整体替换
+        variables: {变量名: 值}
+        unchanged: 自上一次写入 target 后没有变化的变量名，直接复用上一份快照中的文件
+
+    Returns:
+        清单 {'variables': {变量名: 条目}, 'skipped': [不支持保存的变量名]}
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = f"{target}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(staging)
+
+    unchanged = set(unchanged)
+    source, source_entries = (_latest_snapshot(target) if unchanged else None), {}
+    if source is not None:
+        try:
+            with open(os.path.join(source, _MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                source_entries = json.load(f).get('variables', {})
+        except (OSError, ValueError):
+            source = None
+
+    manifest = {'variables': {}, 'skipped': []}
+    reused = 0
+    try:
+        for index, (name, value) in enumerate(variables.items()):
+            entry = None
+            if source is not None and name in unchanged:
+                entry = _reuse_variable(source, source_entries.get(name), staging, index)
+                reused += entry is not None
+            try:
+                if entry is None:
+                    entry = _save_variable(staging, index, name, value)
+            except Exception as e:
+                logger.warning(f"保存变量 {name} 失败: {e}")
+                entry = None
+            if entry is None:
+                manifest['skipped'].append(name)
+            else:
+                manifest['variables'][name] = entry
+        _write_json(os.path.join(staging, _MANIFEST_FILE), manifest)
+
+        # 先把旧目录移开再换入新目录；两次重命名之间退出时磁盘上只有 .old 和已写完的 .tmp，
+        # read_variables 会从中选出最新的完整快照
+        previous = None
+        if os.path.exists(target):
+            previous = f"{target}.{uuid.uuid4().hex}.old"
+            os.rename(target, previous)
+        os.rename(staging, target)
+        # 连同之前中途退出留下的旧快照一起删除
+        for stale in glob.glob(f"{glob.escape(target)}.*.old"):
+            shutil.rmtree(stale, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if reused:
+        logger.debug(f"检查点复用未变化的变量文件 {reused} 个")
+    return manifest
+
+
+def _latest_snapshot(directory: str) -> Optional[str]:
+    """
+    目录本身或 write_variables 中途退出留下的同名 .old/.tmp 目录中，清单最新的完整快照
+
+    清单最后写入，有清单的目录就是完整的；都没有清单时返回None。
+    """
+    candidates = [directory] + glob.glob(f"{glob.escape(directory)}.*.old") \
+        + glob.glob(f"{glob.escape(directory)}.*.tmp")
+    latest, latest_mtime = None, None
+    for candidate in candidates:
+        try:
+            mtime = os.stat(os.path.join(candidate, _MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            continue
+        if latest is None or mtime > latest_mtime:
+            latest, latest_mtime = candidate, mtime
+    return latest
+
+
+def read_variables(directory: str) -> Dict[str, Any]:
+    """
+    读取 write_variables 写入的变量，没有完整快照时返回空字典
+
+    Returns:
+        {变量名: 值}
+    """
+    import numpy as np
+    import pandas as pd
+
+    directory = _latest_snapshot(directory)
+    if directory is None:
+        return {}
+    manifest_path = os.path.join(directory, _MANIFEST_FILE)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    variables = {}
+    for name, entry in manifest.get('variables', {}).items():
+        kind = entry['kind']
+        try:
+            if kind == 'dataframe':
+                frame = pd.read_parquet(os.path.join(directory, entry['file']))
+                frame.columns = [_from_json_key(c) for c in entry['columns']]
+                variables[name] = frame
+            elif kind == 'series':
+                series = pd.read_parquet(os.path.join(directory, entry['file']))['value']
+                series.name = _from_json_key(entry['series_name'])
+                variables[name] = series
+            elif kind == 'ndarray':
+                with np.load(os.path.join(directory, entry['file']), allow_pickle=False) as data:
+                    variables[name] = data['value']
+            elif kind == 'tuple':
+                variables[name] = tuple(entry['value'])
+            else:
+                variables[name] = entry['value']
+        except Exception as e:
+            logger.warning(f"恢复变量 {name} 失败: {e}")
+    return variables
+
+
+def save_variables(session_output_dir: str, variables: Dict[str, Any], unchanged: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    保存执行环境变量到会话检查点
+
+    Args:
+        session_output_dir: 会话目录
+        variables: {变量名: 值}，调用方负责排除模块、函数和可重建的变量
+        unchanged: 自上一次保存后没有变化的变量名，复用上一份快照中的文件
+
+    Returns:
+        清单 {'variables': {变量名: 条目}, 'skipped': [不支持保存的变量名]}
+    """
+    return write_variables(os.path.join(checkpoint_dir(session_output_dir), _VARIABLES_DIRNAME), variables,
+                           unchanged)
+
+
+def load_variables(session_output_dir: str) -> Dict[str, Any]:
+    """读取会话检查点中保存的执行环境变量，没有变量快照时返回空字典"""
+    return read_variables(os.path.join(checkpoint_dir(session_output_dir), _VARIABLES_DIRNAME))
+
+
+def restorable_variables(namespace: Dict[str, Any], exclude: Iterable[str]) -> Dict[str, Any]:
+    """
+    从执行环境命名空间中挑出需要保存的用户变量
+
+    排除下划线开头的变量、IPython 内置变量、模块、函数和类，以及 exclude 中可重建的变量。
+    """
+    import types
+    from .namespace_tracker import IGNORED_NAMES
+
+    exclude = set(exclude) | IGNORED_NAMES
+    selected = {}
+    for name, value in namespace.items():
+        if name.startswith('_') or name in exclude:
+            continue
+        if isinstance(value, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)):
+            continue
+        selected[name] = value
+    return selected
+
+
+
+# 出现在代码中时，代码可以修改任意变量，无法判断哪些变量没有变化
+_UNTRACKABLE_NAMES = {'globals', 'locals', 'vars', 'exec', 'eval', 'get_ipython', 'setattr'}
+
+
+def touched_variables(namespace: Dict[str, Any], names: Iterable[str]) -> Optional[Set[str]]:
+    """
+    代码可能原地修改的变量名
+
+    包括代码中出现的名称、这些名称对应的用户函数中引用的全局名称，以及与它们共享对象的其他变量
+    （别名、容器中的元素、numpy 视图的底层数组）。
+
+    Args:
+        namespace: 执行环境的用户命名空间
+        names: 代码中出现过的名称
+
+    Returns:
+        变量名集合；代码可能修改任意变量（如调用 globals、exec）时返回None
+    """
+    import types
+    import numpy as np
+
+    touched = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in touched:
+            continue
+        if name in _UNTRACKABLE_NAMES:
+            return None
+        touched.add(name)
+        value = namespace.get(name)
+        if isinstance(value, types.FunctionType):
+            codes = [value.__code__]
+            while codes:
+                code = codes.pop()
+                pending.extend(code.co_names)
+                codes.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+
+    def objects(value: Any) -> Set[int]:
+        ids = {id(value)}
+        if isinstance(value, np.ndarray) and value.base is not None:
+            ids |= objects(value.base)
+        return ids
+
+    shared = set()
+    for name in touched:
+        if name not in namespace:
+            continue
+        value = namespace[name]
+        shared |= objects(value)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            items = value
+        elif isinstance(value, dict):
+            items = value.values()
+        else:
+            items = ()
+        for item in list(items)[:1000]:
+            shared |= objects(item)
+
+    return touched | {name for name, value in namespace.items() if objects(value) & shared}
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+并发分析会话运行器
+
+单个分析会话的大部分时间都在等待LLM响应，多个公司或公司对的会话逐个运行时总耗时是各会话之和。
+run_sessions 在线程中并行运行多个会话：每个会话从内核池借出独立的执行内核，
+所有会话共享进程级的LLM并发预算，报告在完成时逐个收集，总耗时接近最慢的那个会话。
+"""
+
+import time
+import logging
+import contextvars
+import concurrent.futures
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def run_sessions(jobs: Dict[str, Callable[[], Any]], max_workers: int = 1,
+                 on_complete: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+    """
+    并行运行多个分析会话
+
+    Args:
+        jobs: {会话名称: 无参数的会话函数}，会话函数通常调用 quick_analysis 并传入内核池
+        max_workers: 最大并行会话数，一般等于内核池大小；为1时按顺序运行
+        on_complete: 每个会话完成时的回调 (会话名称, 结果)
+
+    Returns:
+        {会话名称: 结果}，顺序与 jobs 一致；失败的会话结果为None
+    """
+    results: Dict[str, Any] = {}
+    started = time.perf_counter()
+    max_workers = max(1, min(max_workers, len(jobs))) if jobs else 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-session") as pool:
+        # 复制当前上下文，使会话线程中的LLM调用继承指标阶段等上下文变量
+        futures = {
+            pool.submit(contextvars.copy_context().run, job): name
+            for name, job in jobs.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                print(f"✅ 会话完成: {name} ({len(results)}/{len(jobs)}，已用时 {time.perf_counter() - started:.1f}s)")
+            except Exception as e:
+                logger.exception(f"分析会话失败: {name}")
+                print(f"❌ 会话失败: {name}: {e}")
+                results[name] = None
+            if on_complete is not None:
+                on_complete(name, results[name])
+
+    return {name: results.get(name) for name in jobs}
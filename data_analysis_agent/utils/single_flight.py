@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+在途请求合并模块
+
+多个公司或章节并发处理时，完全相同的请求可能同时在途。SingleFlight 保证同一个键
+同一时刻只有一个真正的上游调用，其余调用方等待并共享同一个结果。
+不同线程、不同事件循环中的调用方同样可以合并。
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """相同键的并发调用只执行一次，结果共享给所有等待者"""
+
+    def __init__(self):
+        self._calls: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 请求的唯一键
+            fn: 真正发起调用的协程工厂，只有第一个调用方会执行
+
+        Returns:
+            (结果, 是否为共享的结果)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            # concurrent.futures.Future 可以跨线程、跨事件循环等待
+            return await asyncio.wrap_future(future), True
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        """当前在途的调用数"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+财务报表 DuckDB 视图模块
+
+把数据目录中按 {公司}_{市场}_{代码}_{报表类型}_{期间}.parquet/.csv 命名的报表文件注册为 DuckDB 视图：
+每个文件一个视图，另外按报表类型合并为统一的长表视图（公司、报告日期、科目、金额）。
+视图直接扫描磁盘上的文件，跨公司的聚合以向量化SQL执行，无需先把所有文件读入pandas。
+同名的Parquet和CSV文件只注册Parquet。
+
+港股报表本身是长表（STD_ITEM_NAME/AMOUNT），A股报表是宽表，注册时用 UNPIVOT 转为长表。
+"""
+
+import os
+import re
+import glob
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_TYPES = ('balance_sheet', 'income_statement', 'cash_flow_statement')
+STATEMENT_NAMES = {
+    'balance_sheet': '资产负债表',
+    'income_statement': '利润表',
+    'cash_flow_statement': '现金流量表',
+}
+PERIOD_NAMES = {'年度': 'annual', '中期': 'interim'}
+
+_FILENAME_PATTERN = re.compile(
+    r'^(?:(?P<company>.+?)_)?(?P<market>HK|A)_(?P<code>[^_]+)_'
+    r'(?P<statement>' + '|'.join(STATEMENT_TYPES) + r')_(?P<period>[^_]+)\.(?:csv|parquet)$'
+)
+
+# 宽表中不属于报表科目的标识/描述列
+_ID_COLUMNS = {
+    'SECUCODE', 'SECURITY_CODE', 'SECURITY_NAME_ABBR', 'ORG_CODE', 'ORG_TYPE',
+    'REPORT_DATE', 'REPORT_TYPE', 'REPORT_DATE_NAME', 'SECURITY_TYPE_CODE',
+    'NOTICE_DATE', 'UPDATE_DATE', 'CURRENCY', 'FISCAL_YEAR', 'STD_REPORT_DATE',
+    'DATE_TYPE_CODE', 'OPINION_TYPE', 'OSOPINION_TYPE', 'LISTING_STATE',
+}
+_NUMERIC_TYPES = ('DOUBLE', 'FLOAT', 'REAL', 'DECIMAL', 'BIGINT', 'INTEGER', 'SMALLINT', 'TINYINT', 'HUGEINT')
+
+
+def parse_statement_filename(path: str) -> Optional[Dict[str, str]]:
+    """
+    解析报表文件名
+
+    Args:
+        path: 报表文件路径
+
+    Returns:
+        包含 company、market、code、statement、period 的字典，文件名不符合约定时返回None
+    """
+    match = _FILENAME_PATTERN.match(os.path.basename(path))
+    if not match:
+        return None
+    info = match.groupdict()
+    info['company'] = info['company'] or f"{info['market']}_{info['code']}"
+    return info
+
+
+def _view_name(info: Dict[str, str]) -> str:
+    period = PERIOD_NAMES.get(info['period'], info['period'])
+    name = f"{info['market']}_{info['code']}_{info['statement']}_{period}".lower()
+    return re.sub(r'\W', '_', name)
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _source(path: str) -> str:
+    """读取报表文件的表函数"""
+    if path.endswith('.parquet'):
+        return f"read_parquet({_literal(path)})"
+    return f"read_csv_auto({_literal(path)}, header=true)"
+
+
+def _long_select(con, info: Dict[str, Any]) -> Optional[str]:
+    """生成把单个报表文件转为统一长表的查询，无法识别格式时返回None"""
+    source = _source(info['path'])
+    columns = {row[0]: row[1] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+    constants = (f"{_literal(info['company'])} AS company, {_literal(info['market'])} AS market, "
+                 f"{_literal(info['code'])} AS code, {_literal(info['statement'])} AS statement, "
+                 f"{_literal(info['period'])} AS period")
+
+    if 'STD_ITEM_NAME' in columns and 'AMOUNT' in columns:
+        # 港股：本身就是长表
+        return (f"SELECT {constants}, TRY_CAST(REPORT_DATE AS DATE) AS report_date, "
+                f"CAST(STD_ITEM_NAME AS VARCHAR) AS item, TRY_CAST(AMOUNT AS DOUBLE) AS amount FROM {source}")
+
+    if 'REPORT_DATE' not in columns:
+        return None
+    # A股：宽表，只展开数值型的科目列（同比列 *_YOY 是比率，不是金额）
+    items = [
+        name for name, dtype in columns.items()
+        if name not in _ID_COLUMNS and not name.endswith('_YOY') and dtype.upper().startswith(_NUMERIC_TYPES)
+    ]
+    if not items:
+        return None
+    casts = ", ".join(f"CAST({_quote(name)} AS DOUBLE) AS {_quote(name)}" for name in items)
+    return (f"SELECT {constants}, report_date, item, amount FROM ("
+            f"UNPIVOT (SELECT TRY_CAST(REPORT_DATE AS DATE) AS report_date, {casts} FROM {source}) "
+            f"ON {', '.join(_quote(name) for name in items)} INTO NAME item VALUE amount)")
+
+
+def find_statement_files(data_dirs: Iterable[str] = (), files: Iterable[str] = ()) -> List[Dict[str, str]]:
+    """
+    查找数据目录中（以及直接给出的文件里）符合命名约定的报表文件
+
+    Args:
+        data_dirs: 数据目录列表
+        files: 报表文件路径列表
+
+    Returns:
+        报表文件信息列表，每项包含文件名解析结果、path 和 view 名称
+    """
+    paths = []
+    for data_dir in data_dirs:
+        for ext in ('parquet', 'csv'):
+            paths.extend(sorted(glob.glob(os.path.join(glob.escape(os.path.abspath(data_dir)), f"*.{ext}"))))
+    paths.extend(os.path.abspath(path) for path in files)
+
+    entries = {}
+    for path in paths:
+        info = parse_statement_filename(path)
+        if info is None:
+            continue
+        info['path'] = path
+        info['view'] = _view_name(info)
+        # 同一报表同时存在Parquet和CSV时使用Parquet
+        stem = os.path.splitext(path)[0]
+        current = entries.get(stem)
+        if current is None or (current['path'].endswith('.csv') and path.endswith('.parquet')):
+            entries[stem] = info
+    return list(entries.values())
+
+
+def register_statement_views(con, data_dirs: Iterable[str] = (), files: Iterable[str] = ()) -> List[Dict[str, str]]:
+    """
+    在 DuckDB 连接上注册报表视图
+
+    注册的视图:
+        statement_files: 报表文件目录（公司、市场、代码、报表类型、期间、视图名、路径）
+        <市场>_<代码>_<报表类型>_<期间>: 单个报表文件的原始视图，例如 hk_00020_balance_sheet_annual
+        balance_sheet_long / income_statement_long / cash_flow_statement_long: 按报表类型合并的长表
+        statements_long: 所有报表合并的长表
+
+    Args:
+        con: duckdb 连接
+        data_dirs: 数据目录列表
+        files: 额外的报表文件路径列表
+
+    Returns:
+        成功注册的报表文件信息列表
+    """
+    registered = []
+    long_selects: Dict[str, List[str]] = {statement: [] for statement in STATEMENT_TYPES}
+    for info in find_statement_files(data_dirs, files):
+        try:
+            con.execute(
+                f"CREATE OR REPLACE VIEW {_quote(info['view'])} AS "
+                f"SELECT * FROM {_source(info['path'])}"
+            )
+            select = _long_select(con, info)
+        except Exception as e:
+            logger.warning(f"注册报表视图失败 {info['path']}: {e}")
+            continue
+        if select is not None:
+            long_selects[info['statement']].append(select)
+        registered.append(info)
+
+    empty = ("SELECT NULL::VARCHAR AS company, NULL::VARCHAR AS market, NULL::VARCHAR AS code, "
+             "NULL::VARCHAR AS statement, NULL::VARCHAR AS period, NULL::DATE AS report_date, "
+             "NULL::VARCHAR AS item, NULL::DOUBLE AS amount WHERE false")
+    for statement, selects in long_selects.items():
+        body = "\nUNION ALL\n".join(selects) if selects else empty
+        con.execute(f"CREATE OR REPLACE VIEW {statement}_long AS {body}")
+    con.execute("CREATE OR REPLACE VIEW statements_long AS " + "\nUNION ALL\n".join(
+        f"SELECT * FROM {statement}_long" for statement in STATEMENT_TYPES
+    ))
+
+    rows = ", ".join(
+        "(" + ", ".join(_literal(info[key]) for key in ('company', 'market', 'code', 'statement', 'period', 'view', 'path')) + ")"
+        for info in registered
+    )
+    if rows:
+        con.execute(f"CREATE OR REPLACE VIEW statement_files AS SELECT * FROM (VALUES {rows}) "
+                    f"AS t(company, market, code, statement, period, view_name, path)")
+    else:
+        con.execute("CREATE OR REPLACE VIEW statement_files AS SELECT NULL::VARCHAR AS company, NULL::VARCHAR AS market, "
+                    "NULL::VARCHAR AS code, NULL::VARCHAR AS statement, NULL::VARCHAR AS period, "
+                    "NULL::VARCHAR AS view_name, NULL::VARCHAR AS path WHERE false")
+    logger.info(f"已注册 {len(registered)} 个报表视图")
+    return registered
+
+
+def describe_statement_views(entries: List[Dict[str, str]], connection_name: str = 'db') -> str:
+    """
+    生成供提示词使用的视图说明
+
+    Args:
+        entries: register_statement_views 的返回值
+        connection_name: 执行环境中 DuckDB 连接的变量名
+    """
+    if not entries:
+        return ""
+    companies: Dict[str, List[str]] = {}
+    for info in entries:
+        companies.setdefault(info['company'], []).append(
+            f"{info['view']}（{STATEMENT_NAMES[info['statement']]}·{info['period']}）"
+        )
+    lines = [
+        f"执行环境中已创建DuckDB连接 {connection_name}，可以直接用SQL查询所有已下载的财务报表，例如 "
+        f"{connection_name}.sql(\"SELECT company, report_date, amount FROM income_statement_long WHERE item LIKE '%营业%'\").df()",
+        "- 统一长表视图（列: company, market, code, statement, period, report_date, item, amount）: "
+        "balance_sheet_long, income_statement_long, cash_flow_statement_long, statements_long",
+        "- 报表文件目录视图: statement_files",
+        "- 单个报表文件的原始视图:",
+    ]
+    for company, views in companies.items():
+        lines.append(f"  - {company}: {', '.join(views)}")
+    return "\n".join(lines)
+
+
+# 关键指标及其在港股（STD_ITEM_NAME）和A股（宽表列名）报表中的候选科目，按优先级排列
+KEY_METRIC_ITEMS = {
+    'revenue': ['营业额', '营运收入', '经营收入总额', 'TOTAL_OPERATE_INCOME', 'OPERATE_INCOME'],
+    'gross_profit': ['毛利'],
+    'net_profit': ['股东应占溢利', '除税后溢利', 'PARENT_NETPROFIT', 'NETPROFIT'],
+    'operating_cash_flow': ['经营业务现金净额', '经营活动现金流量净额', 'NETCASH_OPERATE'],
+    'total_assets': ['总资产', 'TOTAL_ASSETS'],
+    'total_liabilities': ['总负债', 'TOTAL_LIABILITIES'],
+    'total_equity': ['股东权益', '总权益', '净资产', 'TOTAL_PARENT_EQUITY', 'TOTAL_EQUITY'],
+}
+
+
+def key_metrics_table(files: Iterable[str] = (), data_dirs: Iterable[str] = ()):
+    """
+    从报表文件中提取各公司各报告期的关键指标
+
+    Args:
+        files: 报表文件路径列表
+        data_dirs: 数据目录列表
+
+    Returns:
+        DataFrame，列为 company, market, code, period, report_date 以及 KEY_METRIC_ITEMS 中的各指标
+    """
+    import duckdb
+
+    con = duckdb.connect()
+    try:
+        register_statement_views(con, data_dirs, files)
+        candidates = ", ".join(
+            f"({_literal(metric)}, {_literal(item)}, {priority})"
+            for metric, items in KEY_METRIC_ITEMS.items()
+            for priority, item in enumerate(items)
+        )
+        long_df = con.execute(f"""
+            SELECT s.company, s.market, s.code, s.period, s.report_date, c.metric, s.amount
+            FROM statements_long s
+            JOIN (VALUES {candidates}) AS c(metric, item, priority) ON s.item = c.item
+            WHERE s.amount IS NOT NULL AND s.report_date IS NOT NULL
+            QUALIFY row_number() OVER (
+                PARTITION BY s.company, s.period, s.report_date, c.metric ORDER BY c.priority
+            ) = 1
+        """).df()
+    finally:
+        con.close()
+
+    index = ['company', 'market', 'code', 'period', 'report_date']
+    table = long_df.pivot_table(index=index, columns='metric', values='amount', aggfunc='first').reset_index()
+    table.columns.name = None
+    for metric in KEY_METRIC_ITEMS:
+        if metric not in table.columns:
+            table[metric] = float('nan')
+    return table[index + list(KEY_METRIC_ITEMS)].sort_values(['company', 'report_date']).reset_index(drop=True)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+流式响应中的代码块解析
+
+LLM按YAML格式输出 action、reasoning、code、next_steps。StreamingCodeParser 随文本到达逐行解析，
+对代码块中的导入语句做增量安全检查，在 code 块结束（出现下一个顶层键或代码围栏）时预编译代码，
+使智能体可以在LLM继续生成 next_steps 的同时开始执行代码。
+"""
+
+import re
+import ast
+import textwrap
+from typing import Iterable, List, Optional
+
+_ACTION_PATTERN = re.compile(r'''^action:\s*["']?(\w+)''')
+_CODE_BLOCK_PATTERN = re.compile(r'^code:\s*\|[-+]?\s*$')
+_IMPORT_PATTERN = re.compile(r'^\s*import\s+(.+)$')
+_FROM_IMPORT_PATTERN = re.compile(r'^\s*from\s+(\S+)\s+import\b')
+
+
+class StreamingCodeParser:
+    """逐段接收LLM输出，识别完整的 generate_code 代码块"""
+
+    def __init__(self, allowed_imports: Iterable[str]):
+        """
+        Args:
+            allowed_imports: 允许导入的模块名，与执行器的安全检查保持一致
+        """
+        self.allowed_imports = set(allowed_imports)
+        self.action: Optional[str] = None
+        self.code: Optional[str] = None
+        self.unsafe_reason: Optional[str] = None
+        self._buffer = ""
+        self._in_code = False
+        self._code_lines: List[str] = []
+
+    @property
+    def code_ready(self) -> bool:
+        """代码块是否已完整且通过预检查，可以提前执行"""
+        return self.code is not None and self.action == 'generate_code' and self.unsafe_reason is None
+
+    def feed(self, text: str):
+        """接收新到达的文本，逐个处理已完整的行"""
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            self._process_line(line)
+
+    def _process_line(self, line: str):
+        if self._in_code:
+            if line.strip().startswith('```') or (line.strip() and not line[0].isspace()):
+                self._finish_code()
+            else:
+                self._code_lines.append(line)
+                self._check_imports(line)
+                return
+
+        match = _ACTION_PATTERN.match(line)
+        if match and self.action is None:
+            self.action = match.group(1)
+        elif _CODE_BLOCK_PATTERN.match(line) and self.code is None:
+            self._in_code = True
+
+    def _check_imports(self, line: str):
+        """增量检查导入语句，规则与 CodeExecutor._check_code_safety 相同"""
+        if self.unsafe_reason is not None:
+            return
+        match = _FROM_IMPORT_PATTERN.match(line)
+        if match:
+            if match.group(1) not in self.allowed_imports:
+                self.unsafe_reason = f"不允许的导入: {match.group(1)}"
+            return
+        match = _IMPORT_PATTERN.match(line)
+        if match:
+            for part in match.group(1).split('#')[0].split(','):
+                name = part.strip().split(' as ')[0].strip()
+                if name and name not in self.allowed_imports:
+                    self.unsafe_reason = f"不允许的导入: {name}"
+                    return
+
+    def _finish_code(self):
+        """代码块结束：去除YAML缩进并预编译，语法不完整时放弃提前执行"""
+        self._in_code = False
+        code = textwrap.dedent("\n".join(self._code_lines)).strip('\n')
+        if not code.strip():
+            return
+        try:
+            ast.parse(code)
+        except SyntaxError:
+            return
+        self.code = code
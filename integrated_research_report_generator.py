@@ -6,23 +6,28 @@
 """
 
 import os
-import glob
 import time
 import json
 import yaml
 import re
-import shutil
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
 import importlib
 from urllib.parse import urlparse
 
-from data_analysis_agent import quick_analysis
+from data_analysis_agent import quick_analysis, get_kernel_pool
 from data_analysis_agent.config.llm_config import LLMConfig
 from data_analysis_agent.utils.llm_helper import LLMHelper
+from data_analysis_agent.utils.llm_metrics import get_metrics_registry, metrics_stage
+from data_analysis_agent.utils.session_runner import run_sessions
+from data_analysis_agent.utils.statement_views import key_metrics_table, KEY_METRIC_ITEMS
+from data_analysis_agent.utils.artifact_store import get_artifact_store, file_digest
 from utils.get_shareholder_info import get_shareholder_info, get_table_content
-from utils.get_financial_statements import get_all_financial_statements, save_financial_statements_to_csv
+from utils.get_financial_statements import fetch_financial_statements_concurrently
+from utils.statement_store import save_financial_statements, list_statement_files, statement_files_by_company
+from utils.statement_warehouse import get_statement_warehouse
+from utils.financial_ratios import refresh_financial_ratios, build_ratio_table, format_ratio_table
 from utils.identify_competitors import identify_competitors_with_ai
 from utils.get_stock_intro import get_stock_intro, save_stock_intro_to_txt
 
@@ -89,6 +94,7 @@ class IntegratedResearchReportGenerator:
         self.data_dir = "./download_financial_statement_files"
         self.company_info_dir = "./company_info"
         self.industry_info_dir = "./industry_info"
+        self.metrics_dir = "./llm_metrics"
         
         # 创建必要的目录
         for dir_path in [self.data_dir, self.company_info_dir, self.industry_info_dir]:
@@ -104,6 +110,17 @@ class IntegratedResearchReportGenerator:
         )
         self.llm = LLMHelper(self.llm_config)
         
+        # 本地报表仓库：所有公司的报表按长表写入同一张表，跨公司查询直接走索引
+        self.warehouse = get_statement_warehouse()
+        # 各公司预先计算好的财务比率表 {公司名称: 文件路径}
+        self.ratio_files = {}
+        
+        # 预热执行内核池：数据采集期间内核在后台完成导入和字体设置
+        self.kernel_pool = get_kernel_pool()
+        
+        # 对比分析模式：nway 复用单公司分析结果做一次多方对比，pairwise 为原有的两两对比会话
+        self.comparison_mode = os.getenv("COMPARISON_MODE", "nway")
+        
         # 存储分析结果
         self.analysis_results = {}
     
@@ -123,80 +140,46 @@ class IntegratedResearchReportGenerator:
         )
         listed_companies = [company for company in other_companies if company.get('market') != "未上市"]
         
-        # 2. 获取目标公司财务数据
-        print(f"\n📊 获取目标公司 {self.target_company} 的财务数据...")
-        target_financials = get_all_financial_statements(
-            stock_code=self.target_company_code,
-            market=self.target_company_market,
-            period="年度",
-            verbose=False
-        )
-        save_financial_statements_to_csv(
-            financial_statements=target_financials,
-            stock_code=self.target_company_code,
-            market=self.target_company_market,
-            company_name=self.target_company,
-            period="年度",
-            save_dir=self.data_dir
-        )
+        # 2. 并发获取目标公司和竞争对手的财务数据
+        print(f"\n📊 获取目标公司 {self.target_company} 及竞争对手的财务数据...")
+        fetch_targets = {(self.target_company_code, self.target_company_market, "年度"): self.target_company}
+        for company in listed_companies:
+            listing = self.resolve_listing(company)
+            if listing is None:
+                print(f"  跳过 {company.get('name')}：无法识别的市场 {company.get('market')}")
+                continue
+            company_name, company_code, market = listing
+            fetch_targets.setdefault((company_code, market, "年度"), company_name)
         
-        # 3. 获取竞争对手的财务数据
-        print("\n📊 获取竞争对手的财务数据...")
+        # 3. 报表请求在有界线程池中执行，按数据源限速，每家公司完成后立即保存
         competitors_financials = {}
-        for company in listed_companies:
-            company_name = company.get('name')
-            company_code = company.get('code')
-            market_str = company.get('market', '')
-            
-            if "A" in market_str:
-                market = "A"
-                if not (company_code.startswith('SH') or company_code.startswith('SZ')):
-                    if company_code.startswith('6'):
-                        company_code = f"SH{company_code}"
-                    else:
-                        company_code = f"SZ{company_code}"
-            elif "港" in market_str:
-                market = "HK"
-            
-            print(f"  获取 {company_name}({market}:{company_code}) 的财务数据")
-            try:
-                company_financials = get_all_financial_statements(
-                    stock_code=company_code,
-                    market=market,
-                    period="年度",
-                    verbose=False
-                )
-                save_financial_statements_to_csv(
-                    financial_statements=company_financials,
-                    stock_code=company_code,
-                    market=market,
-                    company_name=company_name,
-                    period="年度",
-                    save_dir=self.data_dir
-                )
+        for (company_code, market, period), company_financials in fetch_financial_statements_concurrently(fetch_targets):
+            company_name = fetch_targets[(company_code, market, period)]
+            print(f"  已获取 {company_name}({market}:{company_code}) 的财务数据")
+            save_financial_statements(
+                financial_statements=company_financials,
+                stock_code=company_code,
+                market=market,
+                company_name=company_name,
+                period=period,
+                save_dir=self.data_dir
+            )
+            self.warehouse.upsert_statements(company_financials, company_name, market, company_code, period)
+            if company_name != self.target_company:
                 competitors_financials[company_name] = company_financials
-                time.sleep(2)
-            except Exception as e:
-                print(f"  获取 {company_name} 财务数据失败: {e}")
+        
+        # 财务比率和同比增长在仓库上一次性算好，供各分析会话和报告直接使用
+        self.ratio_files = refresh_financial_ratios(self.warehouse, self.data_dir)
+        print(f"  已计算 {len(self.ratio_files)} 家公司的财务比率")
         
         # 4. 获取公司基础信息
         print("\n🏢 获取公司基础信息...")
         all_base_info_targets = [(self.target_company, self.target_company_code, self.target_company_market)]
         
         for company in listed_companies:
-            company_name = company.get('name')
-            company_code = company.get('code')
-            market_str = company.get('market', '')
-            if "A" in market_str:
-                market = "A"
-                if not (company_code.startswith('SH') or company_code.startswith('SZ')):
-                    if company_code.startswith('6'):
-                        company_code = f"SH{company_code}"
-                    else:
-                        company_code = f"SZ{company_code}"
-            elif "港" in market_str:
-                market = "HK"
-            all_base_info_targets.append((company_name, company_code, market))
+            listing = self.resolve_listing(company)
+            if listing is not None:
+                all_base_info_targets.append(listing)
         
         # 添加特定公司如百度
         all_base_info_targets.append(("百度", "09888", "HK"))
@@ -210,7 +193,6 @@ class IntegratedResearchReportGenerator:
                 print(f"    信息已保存到: {save_path}")
             else:
                 print(f"    未能获取到 {company_name} 的基础信息")
-            time.sleep(1)
         
         # 5. 搜索行业信息
         print("\n🔍 搜索行业信息...")
@@ -240,9 +222,9 @@ class IntegratedResearchReportGenerator:
         # 单公司分析
         results = self.analyze_companies_in_directory(self.data_dir, self.llm_config)
         
-        # 两两对比分析
+        # 对比分析（默认复用单公司分析的关键指标和图表，做一次多方对比）
         comparison_results = self.run_comparison_analysis(
-            self.data_dir, self.target_company, self.llm_config
+            self.data_dir, self.target_company, self.llm_config, individual_reports=results
         )
         
         # 合并所有报告
@@ -263,7 +245,9 @@ class IntegratedResearchReportGenerator:
             f"请整理以下公司信息内容，确保格式清晰易读，并保留关键信息：\n{company_infos}",
             system_prompt="你是一个专业的公司信息整理师。",
             max_tokens=8192,
-            temperature=0.5
+            temperature=0.5,
+            # 公司信息文件的读取顺序不固定，允许复用近似相同提示词的结果
+            cache="semantic"
         )
         
         # 整理股权信息
@@ -292,6 +276,7 @@ class IntegratedResearchReportGenerator:
         
         # 保存阶段一结果
         formatted_report = self.format_final_reports(merged_results)
+        ratio_table = format_ratio_table(build_ratio_table(self.warehouse))
         
         # 统一保存为markdown
         md_output_file = f"财务研报汇总_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
@@ -299,7 +284,9 @@ class IntegratedResearchReportGenerator:
             f.write(f"# 公司基础信息\n\n## 整理后公司信息\n\n{company_infos}\n\n")
             f.write(f"# 股权信息分析\n\n{shareholder_analysis}\n\n")
             f.write(f"# 行业信息搜索结果\n\n{search_res}\n\n")
-            f.write(f"# 财务数据分析与两两对比\n\n{formatted_report}\n\n")
+            if ratio_table:
+                f.write(f"# 财务比率与同比增长\n\n{ratio_table}\n\n")
+            f.write(f"# 财务数据分析与同业对比\n\n{formatted_report}\n\n")
             if sensetime_valuation_report and isinstance(sensetime_valuation_report, dict):
                 f.write(f"# 商汤科技估值与预测分析\n\n{sensetime_valuation_report.get('final_report', '未生成报告')}\n\n")
         
@@ -312,6 +299,7 @@ class IntegratedResearchReportGenerator:
             'shareholder_analysis': shareholder_analysis,
             'search_res': search_res,
             'formatted_report': formatted_report,
+            'ratio_table': ratio_table,
             'sensetime_valuation_report': sensetime_valuation_report
         }
         
@@ -375,15 +363,23 @@ class IntegratedResearchReportGenerator:
         print("="*100)
         
         # 第一阶段：数据采集与基础分析
-        md_file = self.stage1_data_collection()
+        with metrics_stage("stage1_data_collection"):
+            md_file = self.stage1_data_collection()
         
         # 第二阶段：深度研报生成
-        final_report = self.stage2_deep_report_generation(md_file)
+        with metrics_stage("stage2_deep_report_generation"):
+            final_report = self.stage2_deep_report_generation(md_file)
+        
+        # 导出LLM调用指标
+        registry = get_metrics_registry()
+        metrics_files = registry.dump(self.metrics_dir)
         
         print("\n" + "="*100)
         print("🎉 完整流程执行完毕！")
         print(f"📊 基础分析报告: {md_file}")
         print(f"📋 深度研报: {final_report}")
+        print(f"⏱️ LLM调用指标: {metrics_files['json']}")
+        print(registry.summary())
         print("="*100)
         
         return md_file, final_report
@@ -392,7 +388,8 @@ class IntegratedResearchReportGenerator:
     
     def get_company_infos(self, data_dir="./company_info"):
         """获取公司信息"""
-        all_files = os.listdir(data_dir)
+        # 固定文件顺序，保证相同的公司信息生成相同的提示词
+        all_files = sorted(os.listdir(data_dir))
         company_infos = ""
         for file in all_files:
             if file.endswith(".txt"):
@@ -402,26 +399,63 @@ class IntegratedResearchReportGenerator:
                 company_infos += f"【公司信息开始】\n公司名称: {company_name}\n{content}\n【公司信息结束】\n\n"
         return company_infos
     
+    def resolve_listing(self, company):
+        """把竞争对手信息转为 (公司名, 股票代码, 市场)，A股代码补全SH/SZ前缀，无法识别市场时返回None"""
+        company_name = company.get('name')
+        company_code = company.get('code')
+        market_str = company.get('market', '')
+        if "A" in market_str:
+            market = "A"
+            if not (company_code.startswith('SH') or company_code.startswith('SZ')):
+                if company_code.startswith('6'):
+                    company_code = f"SH{company_code}"
+                else:
+                    company_code = f"SZ{company_code}"
+        elif "港" in market_str:
+            market = "HK"
+        else:
+            return None
+        return company_name, company_code, market
+    
     def get_company_files(self, data_dir):
         """获取公司文件"""
-        all_files = glob.glob(f"{data_dir}/*.csv")
-        companies = {}
-        for file in all_files:
-            filename = os.path.basename(file)
-            company_name = filename.split("_")[0]
-            companies.setdefault(company_name, []).append(file)
-        return companies
+        return statement_files_by_company(data_dir)
     
     def analyze_individual_company(self, company_name, files, llm_config, query=None, verbose=True):
         """分析单个公司"""
         if query is None:
             query = "基于表格的数据，分析有价值的内容，并绘制相关图表。最后生成汇报给我。"
+        ratio_file = self.ratio_files.get(company_name)
+        if ratio_file:
+            files = list(files) + [ratio_file]
+            query += ("\n毛利率、净利率、ROE、ROA、资产负债率、现金转换率和各项同比增长已预先计算在财务比率表中"
+                      f"（{os.path.basename(ratio_file)}），请直接使用，不要重新计算这些指标。")
         report = quick_analysis(
             query=query, files=files, llm_config=llm_config, 
-            absolute_path=True, max_rounds=20
+            absolute_path=True, max_rounds=20, kernel_pool=self.kernel_pool
         )
+        if report and report.get('session_output_dir'):
+            report['key_metrics_file'] = self.save_company_key_metrics(
+                company_name, files, report['session_output_dir']
+            )
         return report
     
+    def save_company_key_metrics(self, company_name, files, output_dir):
+        """提取公司的关键指标（收入、利润、现金流、资产负债等），保存到会话目录"""
+        try:
+            # 优先从报表仓库按索引查询，仓库中没有该公司时再扫描报表文件
+            metrics = self.warehouse.metric_table(KEY_METRIC_ITEMS, companies=[company_name])
+            if metrics.empty:
+                metrics = key_metrics_table(files=files)
+        except Exception as e:
+            print(f"⚠️ 提取{company_name}关键指标失败: {e}")
+            return None
+        if metrics.empty:
+            return None
+        metrics_file = os.path.join(output_dir, f"{company_name}_关键指标.csv")
+        metrics.to_csv(metrics_file, index=False, encoding='utf-8-sig')
+        return metrics_file
+    
     def format_final_reports(self, all_reports):
         """格式化最终报告"""
         formatted_output = []
@@ -434,14 +468,14 @@ class IntegratedResearchReportGenerator:
         return "\n".join(formatted_output)
     
     def analyze_companies_in_directory(self, data_directory, llm_config, query="基于表格的数据，分析有价值的内容，并绘制相关图表。最后生成汇报给我。"):
-        """分析目录中的所有公司"""
+        """分析目录中的所有公司，各公司的会话在内核池上并行运行"""
         company_files = self.get_company_files(data_directory)
-        all_reports = {}
-        for company_name, files in company_files.items():
-            report = self.analyze_individual_company(company_name, files, llm_config, query, verbose=False)
-            if report:
-                all_reports[company_name] = report
-        return all_reports
+        jobs = {
+            company_name: (lambda c=company_name, f=files: self.analyze_individual_company(c, f, llm_config, query, verbose=False))
+            for company_name, files in company_files.items()
+        }
+        reports = run_sessions(jobs, max_workers=self.kernel_pool.size)
+        return {company_name: report for company_name, report in reports.items() if report}
     
     def compare_two_companies(self, company1_name, company1_files, company2_name, company2_files, llm_config):
         """比较两个公司"""
@@ -452,24 +486,92 @@ class IntegratedResearchReportGenerator:
             files=all_files,
             llm_config=llm_config,
             absolute_path=True,
-            max_rounds=20
+            max_rounds=20,
+            kernel_pool=self.kernel_pool
         )
         return report
     
-    def run_comparison_analysis(self, data_directory, target_company_name, llm_config):
-        """运行对比分析"""
+    def compare_companies_from_analyses(self, target_company_name, individual_reports, llm_config):
+        """
+        基于已完成的单公司分析做一次多方对比
+        
+        输入是各公司会话已经产出的关键指标表、图表和报告摘要，而不是原始三大报表，
+        一个会话即可完成目标公司与所有竞争对手的对比，不再为每个竞争对手重新分析原始数据。
+        """
+        metrics_files = []
+        summaries = []
+        for company_name, report in individual_reports.items():
+            if report.get('key_metrics_file'):
+                metrics_files.append(report['key_metrics_file'])
+            figures = "\n".join(
+                f"  - {figure.get('file_path', '')}：{figure.get('description', '')}"
+                for figure in report.get('collected_figures', [])
+            ) or "  （无）"
+            summary = report.get('final_report', '')
+            if len(summary) > 1500:
+                summary = summary[:1500] + "……（已截断）"
+            summaries.append(f"【{company_name}】\n已有图表:\n{figures}\n分析摘要:\n{summary}")
+        if not metrics_files:
+            return None
+        
+        competitors = [company for company in individual_reports if company != target_company_name]
+        metrics_files.extend(self.ratio_files[company] for company in individual_reports if company in self.ratio_files)
+        ratio_table = format_ratio_table(build_ratio_table(self.warehouse, companies=list(individual_reports)))
+        query = (
+            f"以下表格是{target_company_name}及其竞争对手（{'、'.join(competitors)}）的关键财务指标，"
+            f"每家公司的单独分析已经完成。请以{target_company_name}为中心，对所有公司做横向对比："
+            "统一口径对比规模、盈利能力、增长、现金流和资产负债结构，绘制多公司对比的表格和图表，"
+            "单公司的趋势图已经存在，可直接引用其路径，不要重复绘制。最后生成汇报给我。\n\n"
+            + (f"已预先计算的财务比率（直接使用，不要重新计算）:\n{ratio_table}\n\n" if ratio_table else "")
+            + "各公司已有的分析结果:\n" + "\n\n".join(summaries)
+        )
+        return quick_analysis(
+            query=query,
+            files=metrics_files,
+            llm_config=llm_config,
+            absolute_path=True,
+            max_rounds=12,
+            kernel_pool=self.kernel_pool
+        )
+    
+    def run_comparison_analysis(self, data_directory, target_company_name, llm_config, individual_reports=None):
+        """
+        运行对比分析
+        
+        传入单公司分析结果且 comparison_mode 为 nway 时，复用这些结果做一次多方对比；
+        否则目标公司与各竞争对手的两两对比会话在内核池上并行运行。
+        """
         company_files = self.get_company_files(data_directory)
         if not company_files or target_company_name not in company_files:
             return {}
         competitors = [company for company in company_files.keys() if company != target_company_name]
+        
+        if individual_reports and self.comparison_mode == "nway" and target_company_name in individual_reports:
+            report = self.compare_companies_from_analyses(target_company_name, individual_reports, llm_config)
+            if report:
+                compared = [company for company in competitors if company in individual_reports]
+                return {
+                    f"{target_company_name}_vs_同业": {
+                        'company1': target_company_name,
+                        'company2': '、'.join(compared),
+                        'report': report
+                    }
+                }
+            print("⚠️ 单公司分析缺少关键指标表，回退为两两对比")
+        
+        jobs = {
+            f"{target_company_name}_vs_{competitor}": (lambda c=competitor: self.compare_two_companies(
+                target_company_name, company_files[target_company_name],
+                c, company_files[c],
+                llm_config
+            ))
+            for competitor in competitors
+        }
+        reports = run_sessions(jobs, max_workers=self.kernel_pool.size)
         comparison_reports = {}
         for competitor in competitors:
             comparison_key = f"{target_company_name}_vs_{competitor}"
-            report = self.compare_two_companies(
-                target_company_name, company_files[target_company_name],
-                competitor, company_files[competitor],
-                llm_config
-            )
+            report = reports.get(comparison_key)
             if report:
                 comparison_reports[comparison_key] = {
                     'company1': target_company_name,
@@ -489,7 +591,7 @@ class IntegratedResearchReportGenerator:
     
     def get_sensetime_files(self, data_dir):
         """获取商汤科技的财务数据文件"""
-        all_files = glob.glob(f"{data_dir}/*.csv")
+        all_files = list_statement_files(data_dir)
         sensetime_files = []
         for file in all_files:
             filename = os.path.basename(file)
@@ -502,7 +604,8 @@ class IntegratedResearchReportGenerator:
         """分析商汤科技的估值与预测"""
         query = "基于三大表的数据，构建估值与预测模型，模拟关键变量变化对财务结果的影响,并绘制相关图表。最后生成汇报给我。"
         report = quick_analysis(
-            query=query, files=files, llm_config=llm_config, absolute_path=True, max_rounds=20
+            query=query, files=files, llm_config=llm_config, absolute_path=True, max_rounds=20,
+            kernel_pool=self.kernel_pool
         )
         return report
     
@@ -755,9 +858,9 @@ class IntegratedResearchReportGenerator:
             return False
     
     def copy_image(self, src, dst):
-        """复制图片"""
+        """把图片放到目标位置：经由产物存储硬链接，不再复制文件内容"""
         try:
-            shutil.copy2(src, dst)
+            get_artifact_store().link(src, dst)
             return True
         except Exception as e:
             print(f"[复制失败] {src}: {e}")
@@ -775,9 +878,22 @@ class IntegratedResearchReportGenerator:
         used_names = set()
         replace_map = {}
         not_exist_set = set()
+        # 内容哈希 -> images 目录中的文件名，内容相同的图片只保留一个文件
+        digest_names = {}
 
         for img_path in matches:
             img_path = img_path.strip()
+            if img_path in replace_map or img_path in not_exist_set:
+                continue
+            if not self.is_url(img_path):
+                abs_img_path = img_path
+                if not os.path.isabs(img_path):
+                    abs_img_path = os.path.join(os.path.dirname(md_path), img_path)
+                if os.path.exists(abs_img_path):
+                    digest = file_digest(abs_img_path)
+                    if digest in digest_names:
+                        replace_map[img_path] = f'./images/{digest_names[digest]}'
+                        continue
             # 取文件名
             if self.is_url(img_path):
                 filename = os.path.basename(urlparse(img_path).path)
@@ -808,6 +924,7 @@ class IntegratedResearchReportGenerator:
                     img_exists = False
                 else:
                     self.copy_image(abs_img_path, new_img_path)
+                    digest_names[digest] = new_filename
             # 记录替换
             if img_exists:
                 replace_map[img_path] = f'./images/{new_filename}'
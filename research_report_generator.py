@@ -311,7 +311,7 @@ with open(search_results_file, 'w', encoding='utf-8') as f:
 # ========== 2. 公司信息整理 ==========
 #将从akshare中匹配到的公司基础信息串起来
 def get_company_infos(data_dir:str="./company_info"):
-    all_files = os.listdir(data_dir)
+    all_files = sorted(os.listdir(data_dir))
     company_infos = ""
     for file in all_files:
         if file.endswith(".txt"):
@@ -328,7 +328,9 @@ company_infos = llm.call(
     f"请整理以下公司信息内容，确保格式清晰易读，并保留关键信息：\n{company_infos}",
     system_prompt="你是一个专业的公司信息整理师。",
     max_tokens=8192,  
-    temperature=0.7
+    temperature=0.7,
+    # 公司信息文件的读取顺序不固定，允许复用近似相同提示词的结果
+    cache="semantic"
 )
 logger.info(f"整理后的公司信息:{company_infos}")
 
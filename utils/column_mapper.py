@@ -1,112 +1,336 @@
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib
-from utils.column_mapper import standardize_dataframe, get_available_columns
 
-# 设置matplotlib使用宋体显示中文
-matplotlib.use('Agg')
-plt.rcParams['font.sans-serif'] = ['SimSun', 'DejaVu Sans', 'Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
+# 标准科目及其在港股（STD_ITEM_NAME）和A股（宽表列名）报表中的同义科目，按优先级排列
+LINE_ITEMS = {
+    # 利润表
+    'REVENUE': {'statement': 'income_statement',
+                'HK': ['营业额', '营运收入', '经营收入总额', '收入'],
+                'A': ['TOTAL_OPERATE_INCOME', 'OPERATE_INCOME']},
+    'COST_OF_SALES': {'statement': 'income_statement',
+                      'HK': ['销售成本', '营运支出'],
+                      'A': ['OPERATE_COST']},
+    'GROSS_PROFIT': {'statement': 'income_statement',
+                     'HK': ['毛利'],
+                     'A': []},
+    'SELLING_EXPENSE': {'statement': 'income_statement',
+                        'HK': ['销售及分销费用', '销售费用'],
+                        'A': ['SALE_EXPENSE']},
+    'ADMIN_EXPENSE': {'statement': 'income_statement',
+                      'HK': ['行政开支', '管理费用'],
+                      'A': ['MANAGE_EXPENSE']},
+    'RD_EXPENSE': {'statement': 'income_statement',
+                   'HK': ['研发费用', '研究及开发费用'],
+                   'A': ['RESEARCH_EXPENSE']},
+    'OPERATING_PROFIT': {'statement': 'income_statement',
+                         'HK': ['经营溢利'],
+                         'A': ['OPERATE_PROFIT']},
+    'FINANCE_COST': {'statement': 'income_statement',
+                     'HK': ['融资成本'],
+                     'A': ['FINANCE_EXPENSE']},
+    'PROFIT_BEFORE_TAX': {'statement': 'income_statement',
+                          'HK': ['除税前溢利'],
+                          'A': ['TOTAL_PROFIT']},
+    'INCOME_TAX': {'statement': 'income_statement',
+                   'HK': ['税项'],
+                   'A': ['INCOME_TAX']},
+    'NET_PROFIT': {'statement': 'income_statement',
+                   'HK': ['股东应占溢利', '除税后溢利'],
+                   'A': ['PARENT_NETPROFIT', 'NETPROFIT']},
+    'NET_PROFIT_INCL_MINORITY': {'statement': 'income_statement',
+                                 'HK': ['除税后溢利'],
+                                 'A': ['NETPROFIT']},
+    'BASIC_EPS': {'statement': 'income_statement',
+                  'HK': ['每股基本盈利'],
+                  'A': ['BASIC_EPS']},
+    # 资产负债表
+    'CASH': {'statement': 'balance_sheet',
+             'HK': ['现金及等价物', '现金及现金等价物'],
+             'A': ['MONETARYFUNDS']},
+    'ACCOUNTS_RECEIVABLE': {'statement': 'balance_sheet',
+                            'HK': ['应收帐款', '应收账款'],
+                            'A': ['ACCOUNTS_RECE', 'NOTE_ACCOUNTS_RECE']},
+    'INVENTORY': {'statement': 'balance_sheet',
+                  'HK': ['存货'],
+                  'A': ['INVENTORY']},
+    'CURRENT_ASSETS': {'statement': 'balance_sheet',
+                       'HK': ['流动资产合计'],
+                       'A': ['TOTAL_CURRENT_ASSETS']},
+    'TOTAL_ASSETS': {'statement': 'balance_sheet',
+                     'HK': ['总资产', '资产总值'],
+                     'A': ['TOTAL_ASSETS']},
+    'CURRENT_LIABILITIES': {'statement': 'balance_sheet',
+                            'HK': ['流动负债合计'],
+                            'A': ['TOTAL_CURRENT_LIAB']},
+    'TOTAL_LIABILITIES': {'statement': 'balance_sheet',
+                          'HK': ['总负债', '负债总额'],
+                          'A': ['TOTAL_LIABILITIES']},
+    'SHORT_TERM_DEBT': {'statement': 'balance_sheet',
+                        'HK': ['短期贷款'],
+                        'A': ['SHORT_LOAN']},
+    'LONG_TERM_DEBT': {'statement': 'balance_sheet',
+                       'HK': ['长期贷款'],
+                       'A': ['LONG_LOAN']},
+    'TOTAL_EQUITY': {'statement': 'balance_sheet',
+                     'HK': ['股东权益', '总权益', '净资产'],
+                     'A': ['TOTAL_PARENT_EQUITY', 'TOTAL_EQUITY']},
+    # 现金流量表
+    'OPERATING_CASH_FLOW': {'statement': 'cash_flow_statement',
+                            'HK': ['经营业务现金净额', '经营活动现金流量净额', '经营活动现金净额'],
+                            'A': ['NETCASH_OPERATE', 'NET_OPERATE_CASH_FLOW', 'OPERATE_CASH_FLOW']},
+    'INVESTING_CASH_FLOW': {'statement': 'cash_flow_statement',
+                            'HK': ['投资业务现金净额', '投资活动现金流量净额'],
+                            'A': ['NETCASH_INVEST']},
+    'FINANCING_CASH_FLOW': {'statement': 'cash_flow_statement',
+                            'HK': ['融资业务现金净额', '融资活动现金流量净额'],
+                            'A': ['NETCASH_FINANCE']},
+    'CAPEX': {'statement': 'cash_flow_statement',
+              'HK': ['购建固定资产', '购买物业、厂房及设备'],
+              'A': ['CONSTRUCT_LONG_ASSET']},
+    'DEPRECIATION': {'statement': 'cash_flow_statement',
+                     'HK': ['折旧及摊销'],
+                     'A': ['FA_IR_DEPR']},
+}
+STANDARD_ITEMS = list(LINE_ITEMS)
+# 报告日期列的同义列名
+DATE_SYNONYMS = ['REPORT_DATE', '报告期', 'STD_REPORT_DATE']
+
+
+def _build_synonym_index() -> Dict[str, Dict[str, List[Tuple[str, int]]]]:
+    """反查表 {市场: {原始科目名: [(标准科目, 优先级), ...]}}，同一原始科目可以对应多个标准科目"""
+    index = {}
+    for standard_name, spec in LINE_ITEMS.items():
+        for market in ('HK', 'A'):
+            for priority, name in enumerate(spec[market]):
+                index.setdefault(market, {}).setdefault(name, []).append((standard_name, priority))
+    return index
+
+
+_SYNONYM_INDEX = _build_synonym_index()
+
+
+def schema_fingerprint(columns: Iterable, market_type: str = "HK") -> str:
+    """
+    表结构指纹，列名和顺序相同的表共享同一份列映射
+
+    Args:
+        columns (Iterable): 列名
+        market_type (str): 市场类型
+    """
+    text = "\x1f".join([market_type] + [str(column) for column in columns])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ColumnMapper:
+    """
+    港股/A股报表的列名标准化引擎
+
+    - 同义科目由 LINE_ITEMS 声明，新增科目只需修改表，不需要写判断分支
+    - 列映射按表结构指纹缓存，同一批接口返回的报表结构相同，只计算一次
+    - 重命名和投影不复制数据（pandas 写时复制）
+    - normalize_facts / normalize_statements 一次把多家公司、多张报表整理为同一张宽表
+    """
+
+    def __init__(self):
+        self._cache: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_mapping(self, columns: Iterable, market_type: str = "HK") -> Dict[str, str]:
+        """
+        获取列名映射（按表结构指纹缓存）
+
+        Args:
+            columns (Iterable): 宽表的列名
+            market_type (str): 市场类型，"HK"为港股，"A"为A股
+
+        Returns:
+            Dict[str, str]: {标准列名: 实际列名}，包括报告日期列 REPORT_DATE
+        """
+        columns = list(columns)
+        key = schema_fingerprint(columns, market_type)
+        with self._lock:
+            mapping = self._cache.get(key)
+            if mapping is not None:
+                self.hits += 1
+                return mapping
+            self.misses += 1
+
+        synonyms = _SYNONYM_INDEX.get(market_type, {})
+        best: Dict[str, Tuple[int, str]] = {}
+        for column in columns:
+            for standard_name, priority in synonyms.get(column, ()):
+                if standard_name not in best or priority < best[standard_name][0]:
+                    best[standard_name] = (priority, column)
+        mapping = {standard_name: best[standard_name][1] for standard_name in STANDARD_ITEMS if standard_name in best}
+        date_column = next((name for name in DATE_SYNONYMS if name in columns), None)
+        if date_column is not None:
+            mapping = {'REPORT_DATE': date_column, **mapping}
+
+        with self._lock:
+            self._cache[key] = mapping
+        return mapping
+
+    def project(self, df: pd.DataFrame, market_type: str = "HK", items: Iterable[str] = None) -> pd.DataFrame:
+        """
+        只保留标准科目列并改为标准列名，不复制数据
+
+        Args:
+            df (pd.DataFrame): 宽表格式的报表
+            market_type (str): 市场类型
+            items (Iterable[str]): 需要的标准科目，None表示全部可识别的科目
+
+        Returns:
+            pd.DataFrame: 列为 REPORT_DATE（如有）和标准科目
+        """
+        mapping = self.get_mapping(df.columns, market_type)
+        if items is not None:
+            wanted = set(items) | {'REPORT_DATE'}
+            mapping = {name: column for name, column in mapping.items() if name in wanted}
+        projected = df[list(mapping.values())]
+        return projected.set_axis(list(mapping), axis=1)
+
+    def to_facts(self, df: pd.DataFrame, market_type: str = "HK") -> pd.DataFrame:
+        """
+        把单张报表转换为 (report_date, item, value) 长表，只保留可识别的科目
+
+        港股报表本身是长表（STD_ITEM_NAME/AMOUNT），A股宽表只展开映射到的列。
+
+        Args:
+            df (pd.DataFrame): 接口返回的报表
+            market_type (str): 市场类型
+
+        Returns:
+            pd.DataFrame: 列为 report_date, item, value，item 为原始科目名
+        """
+        if 'STD_ITEM_NAME' in df.columns and 'AMOUNT' in df.columns:
+            facts = df[['REPORT_DATE', 'STD_ITEM_NAME', 'AMOUNT']].set_axis(['report_date', 'item', 'value'], axis=1)
+            return facts[facts['item'].isin(list(_SYNONYM_INDEX.get(market_type, {})))]
+        mapping = self.get_mapping(df.columns, market_type)
+        date_column = mapping.get('REPORT_DATE')
+        if date_column is None:
+            return pd.DataFrame(columns=['report_date', 'item', 'value'])
+        items = sorted({column for name, column in mapping.items() if name != 'REPORT_DATE'})
+        facts = df.melt(id_vars=[date_column], value_vars=items, var_name='item', value_name='value')
+        return facts.rename(columns={date_column: 'report_date'})
+
+    def normalize_facts(self, facts: pd.DataFrame, items: Iterable[str] = None) -> pd.DataFrame:
+        """
+        把多家公司的长表数据一次整理为标准宽表
+
+        Args:
+            facts (pd.DataFrame): 至少包含 company, market, report_date, item, value 列，
+                例如报表仓库 StatementWarehouse.facts() 的结果；其他标识列（code、period）会保留在索引中
+            items (Iterable[str]): 需要的标准科目，None表示全部
+
+        Returns:
+            pd.DataFrame: 每行一家公司的一个报告期，列为标识列、report_date 和标准科目（英文大写）
+        """
+        index = [column for column in ('company', 'market', 'code', 'period') if column in facts.columns]
+        index.append('report_date')
+        items = list(items) if items is not None else STANDARD_ITEMS
+
+        # 原始科目 -> (标准科目, 优先级)，按市场展开为查找表后与长表合并，一次完成全部映射
+        lookup = pd.DataFrame(
+            [(market, name, standard_name, priority)
+             for market, synonyms in _SYNONYM_INDEX.items()
+             for name, targets in synonyms.items()
+             for standard_name, priority in targets if standard_name in items],
+            columns=['market', 'item', 'standard_item', 'priority'],
+        )
+        matched = facts[index + ['item', 'value']].merge(lookup, on=['market', 'item'], how='inner')
+        matched = matched[matched['value'].notna()]
+        # 同一公司同一报告期同一标准科目取优先级最高的原始科目
+        matched = matched.sort_values('priority', kind='stable').drop_duplicates(index + ['standard_item'])
+        table = matched.pivot(index=index, columns='standard_item', values='value')
+        table = table.reindex(columns=items).reset_index()
+        table.columns.name = None
+        return table.sort_values(index).reset_index(drop=True)
+
+    def normalize_statements(self, tables: Iterable[Tuple[str, str, pd.DataFrame]],
+                             items: Iterable[str] = None) -> pd.DataFrame:
+        """
+        批量把多家公司的原始报表整理为标准宽表（同一公司的三张报表合并到同一行）
+
+        Args:
+            tables (Iterable[Tuple[str, str, pd.DataFrame]]): (公司名称, 市场类型, 报表) 列表
+            items (Iterable[str]): 需要的标准科目，None表示全部
+
+        Returns:
+            pd.DataFrame: 列为 company, market, report_date 和标准科目
+        """
+        frames = []
+        for company, market_type, df in tables:
+            if df is None or df.empty:
+                continue
+            facts = self.to_facts(df, market_type)
+            frames.append(facts.assign(company=company, market=market_type))
+        if not frames:
+            return pd.DataFrame(columns=['company', 'market', 'report_date'] + list(items or STANDARD_ITEMS))
+        facts = pd.concat(frames, ignore_index=True)
+        facts['report_date'] = pd.to_datetime(facts['report_date'], errors='coerce')
+        facts['value'] = pd.to_numeric(facts['value'], errors='coerce')
+        return self.normalize_facts(facts.dropna(subset=['report_date']), items)
+
+
+_default_mapper: Optional[ColumnMapper] = None
+_default_mapper_lock = threading.Lock()
+
+
+def get_column_mapper() -> ColumnMapper:
+    """获取进程级列名标准化引擎（共享映射缓存）"""
+    global _default_mapper
+    with _default_mapper_lock:
+        if _default_mapper is None:
+            _default_mapper = ColumnMapper()
+        return _default_mapper
+
 
 def get_column_mapping(df, market_type="HK"):
     """
     获取列名映射，将标准列名映射到实际数据文件中的列名
-    
+
     Args:
         df: DataFrame对象
         market_type: 市场类型，"HK"为港股，"A"为A股
-    
+
     Returns:
-        dict: 列名映射字典
+        dict: 列名映射字典，报告日期同时以 YEAR 提供（兼容旧的调用方）
     """
-    columns = df.columns.tolist()
-    mapping = {}
-    
-    if market_type == "HK":
-        # 港股列名映射
-        if "营业额" in columns:
-            mapping["REVENUE"] = "营业额"
-        elif "营运收入" in columns:
-            mapping["REVENUE"] = "营运收入"
-            
-        if "股东应占溢利" in columns:
-            mapping["NET_PROFIT"] = "股东应占溢利"
-        elif "除税后溢利" in columns:
-            mapping["NET_PROFIT"] = "除税后溢利"
-            
-        if "经营活动现金流量净额" in columns:
-            mapping["OPERATING_CASH_FLOW"] = "经营活动现金流量净额"
-        elif "经营活动现金净额" in columns:
-            mapping["OPERATING_CASH_FLOW"] = "经营活动现金净额"
-            
-        if "报告期" in columns:
-            mapping["YEAR"] = "报告期"
-        elif "REPORT_DATE" in columns:
-            mapping["YEAR"] = "REPORT_DATE"
-            
-    elif market_type == "A":
-        # A股列名映射
-        if "TOTAL_OPERATE_INCOME" in columns:
-            mapping["REVENUE"] = "TOTAL_OPERATE_INCOME"
-        elif "OPERATE_INCOME" in columns:
-            mapping["REVENUE"] = "OPERATE_INCOME"
-            
-        if "PARENT_NETPROFIT" in columns:
-            mapping["NET_PROFIT"] = "PARENT_NETPROFIT"
-        elif "NETPROFIT" in columns:
-            mapping["NET_PROFIT"] = "NETPROFIT"
-            
-        if "NET_OPERATE_CASH_FLOW" in columns:
-            mapping["OPERATING_CASH_FLOW"] = "NET_OPERATE_CASH_FLOW"
-        elif "OPERATE_CASH_FLOW" in columns:
-            mapping["OPERATING_CASH_FLOW"] = "OPERATE_CASH_FLOW"
-            
-        if "REPORT_DATE" in columns:
-            mapping["YEAR"] = "REPORT_DATE"
-    
+    mapping = dict(get_column_mapper().get_mapping(df.columns, market_type))
+    if 'REPORT_DATE' in mapping:
+        mapping['YEAR'] = mapping['REPORT_DATE']
     return mapping
 
+
 def standardize_dataframe(df, market_type="HK"):
     """
-    标准化DataFrame的列名
-    
+    标准化DataFrame的列名：保留原有列，另外以标准列名提供映射到的列（不复制数据）
+
     Args:
         df: 原始DataFrame
         market_type: 市场类型
-    
+
     Returns:
         DataFrame: 标准化后的DataFrame
     """
     mapping = get_column_mapping(df, market_type)
-    
-    # 创建新的DataFrame，使用标准列名
-    standardized_df = df.copy()
-    
-    # 重命名列
-    for standard_name, actual_name in mapping.items():
-        if actual_name in df.columns:
-            standardized_df[standard_name] = df[actual_name]
-    
-    return standardized_df
+    new_columns = {name: df[column] for name, column in mapping.items() if name != column}
+    return df.assign(**new_columns)
+
 
 def get_available_columns(df):
     """
     获取DataFrame中可用的列名
-    
+
     Args:
         df: DataFrame对象
-    
+
     Returns:
         list: 列名列表
     """
     return df.columns.tolist()
-
-# 在读取数据后，标准化DataFrame
-# 假设你已经有了merged_df，并且知道是港股还是A股数据
-market_type = "HK"  # 或者 "A"，根据你的数据来源
-merged_df = standardize_dataframe(merged_df, market_type)
-
-# 现在你可以安全地使用标准列名了
-plt.plot(merged_df['YEAR'], merged_df['REVENUE'], label='营业收入')
-plt.plot(merged_df['YEAR'], merged_df['NET_PROFIT'], label='净利润')
-plt.plot(merged_df['YEAR'], merged_df['OPERATING_CASH_FLOW'], label='经营活动现金流') 
\ No newline at end of file
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# 各类数据的默认有效期（秒），可通过环境变量 DATA_CACHE_TTL_{数据类型大写} 覆盖
+DEFAULT_TTLS = {
+    # 年报/中报一年只更新几次
+    'financial_statement': 7 * 86400,
+    # 主营介绍、公司概况很少变化
+    'stock_intro': 30 * 86400,
+    # 基础信息包含市值、市盈率等每日变化的字段
+    'base_info': 86400,
+}
+_METADATA_KEY = b'data_cache'
+
+
+class DataCache:
+    """
+    数据接口的持久化缓存
+
+    以 函数名 + 代码 + 市场 + 期间 为键，把 akshare/efinance 的返回结果保存为Parquet文件：
+    - 有效期内直接返回缓存，不访问网络
+    - 过期后先返回旧数据，同时在后台线程中重新获取（stale-while-revalidate），获取失败时保留旧数据
+    - 离线模式下只读缓存，缓存中没有的数据返回None
+    获取失败或结果为空时不写入缓存。
+    """
+
+    def __init__(self, cache_dir: str = ".data_source_cache", offline: bool = False):
+        """
+        Args:
+            cache_dir (str): 缓存目录
+            offline (bool): 是否为离线模式
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.offline = offline
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _path(self, function: str, symbol: str, market: str, period: str) -> str:
+        key = json.dumps([function, symbol, market, period], ensure_ascii=False)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        safe_symbol = "".join(c if c.isalnum() else "_" for c in f"{market}_{symbol}")
+        return os.path.join(self.cache_dir, function, f"{safe_symbol}_{digest}.parquet")
+
+    @staticmethod
+    def ttl_for(dataset: str) -> float:
+        """获取数据类型的有效期（秒）"""
+        return float(os.environ.get(f"DATA_CACHE_TTL_{dataset.upper()}", DEFAULT_TTLS.get(dataset, 86400)))
+
+    def _read(self, path: str):
+        """读取缓存文件，返回 (值, 获取时间)，不存在或损坏时返回 (None, None)"""
+        if not os.path.exists(path):
+            return None, None
+        try:
+            table = pq.read_table(path)
+            meta = json.loads(table.schema.metadata[_METADATA_KEY])
+            df = table.to_pandas()
+        except Exception as e:
+            logger.warning(f"读取数据缓存失败 {path}: {e}")
+            return None, None
+        kind = meta['kind']
+        if kind == 'text':
+            value = df['value'].iloc[0]
+        elif kind == 'series':
+            value = df['value']
+            value.name = meta.get('name')
+        elif kind == 'record':
+            value = df.iloc[0]
+            value.name = meta.get('name')
+        else:
+            value = df
+        return value, meta['fetched_at']
+
+    def _write(self, path: str, value: Any) -> bool:
+        """写入缓存文件，不支持的类型或写入失败时返回False"""
+        if isinstance(value, str):
+            kind, df, name = 'text', pd.DataFrame({'value': [value]}), None
+        elif isinstance(value, pd.Series) and value.dtype == object:
+            # 字段类型混杂的单条记录（如 efinance 的基础信息）按一行保存，每个字段单独推断类型
+            kind, name = 'record', value.name
+            df = pd.DataFrame([value.tolist()], columns=[str(k) for k in value.index])
+        elif isinstance(value, pd.Series):
+            kind, df, name = 'series', value.to_frame('value'), value.name
+        elif isinstance(value, pd.DataFrame):
+            kind, df, name = 'dataframe', value, None
+        else:
+            return False
+        try:
+            table = pa.Table.from_pandas(df)
+            metadata = dict(table.schema.metadata or {})
+            metadata[_METADATA_KEY] = json.dumps(
+                {'kind': kind, 'name': name, 'fetched_at': time.time()}, ensure_ascii=False, default=str
+            ).encode('utf-8')
+            table = table.replace_schema_metadata(metadata)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            pq.write_table(table, tmp)
+            os.replace(tmp, path)
+            return True
+        except Exception as e:
+            logger.warning(f"写入数据缓存失败 {path}: {e}")
+            return False
+
+    @staticmethod
+    def _is_empty(value: Any) -> bool:
+        if value is None:
+            return True
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return value.empty
+        return isinstance(value, str) and not value.strip()
+
+    def _fetch_and_store(self, path: str, fetch: Callable[[], Any]) -> Any:
+        value = fetch()
+        if not self._is_empty(value):
+            self._write(path, value)
+        return value
+
+    def _refresh_in_background(self, path: str, fetch: Callable[[], Any]):
+        with self._lock:
+            if path in self._refreshing:
+                return
+            self._refreshing.add(path)
+
+        def refresh():
+            try:
+                self._fetch_and_store(path, fetch)
+            except Exception as e:
+                logger.warning(f"后台刷新数据失败，继续使用旧数据 {path}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(path)
+
+        threading.Thread(target=refresh, name="data-cache-refresh", daemon=True).start()
+
+    def get(self, function: str, fetch: Callable[[], Any], symbol: str = "", market: str = "",
+            period: str = "", dataset: str = None, refresh: bool = False) -> Any:
+        """
+        从缓存获取数据，必要时调用 fetch 访问网络
+
+        Args:
+            function (str): 数据接口名称，作为缓存键的一部分
+            fetch (Callable): 无参数的获取函数，返回 DataFrame、Series 或字符串
+            symbol (str): 股票代码
+            market (str): 市场
+            period (str): 报告期间等其他区分参数
+            dataset (str): 数据类型，决定有效期，默认与 function 相同
+            refresh (bool): 忽略缓存，直接访问网络并更新缓存（离线模式下无效）
+
+        Returns:
+            数据；离线模式且没有缓存时返回None
+        """
+        path = self._path(function, symbol, market, period)
+        if refresh and not self.offline:
+            return self._fetch_and_store(path, fetch)
+        value, fetched_at = self._read(path)
+        if value is not None:
+            if self.offline or time.time() - fetched_at < self.ttl_for(dataset or function):
+                return value
+            # 过期：先返回旧数据，后台刷新
+            self._refresh_in_background(path, fetch)
+            return value
+        if self.offline:
+            logger.info(f"离线模式，缓存中没有 {function} {market} {symbol} {period}")
+            return None
+        return self._fetch_and_store(path, fetch)
+
+
+_data_cache: Optional[DataCache] = None
+_data_cache_lock = threading.Lock()
+
+
+def get_data_cache() -> DataCache:
+    """
+    获取进程级数据接口缓存
+
+    缓存目录读取环境变量 DATA_SOURCE_CACHE_DIR（默认 .data_source_cache），
+    DATA_OFFLINE=1 时为离线模式。
+    """
+    global _data_cache
+    with _data_cache_lock:
+        if _data_cache is None:
+            _data_cache = DataCache(
+                os.environ.get("DATA_SOURCE_CACHE_DIR", ".data_source_cache"),
+                offline=os.environ.get("DATA_OFFLINE", "0") == "1",
+            )
+        return _data_cache
+
+
+def cached_call(function: str, fetch: Callable[[], Any], symbol: str = "", market: str = "",
+                period: str = "", dataset: str = None, refresh: bool = False) -> Any:
+    """
+    通过进程级缓存调用数据接口，参数同 DataCache.get
+    """
+    return get_data_cache().get(function, fetch, symbol=symbol, market=market, period=period,
+                                dataset=dataset, refresh=refresh)
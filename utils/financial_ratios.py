@@ -0,0 +1,189 @@
+import os
+import uuid
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.column_mapper import STANDARD_ITEMS, get_column_mapper
+from utils.statement_warehouse import StatementWarehouse, get_statement_warehouse
+
+# 财务比率及其中文名称和展示方式：pct 按百分比，ratio 按倍数，amount 为金额（按亿展示）
+RATIO_COLUMNS = {
+    'gross_margin': ('毛利率', 'pct'),
+    'operating_margin': ('经营利润率', 'pct'),
+    'net_margin': ('净利率', 'pct'),
+    'rd_ratio': ('研发费用率', 'pct'),
+    'roe': ('净资产收益率ROE', 'pct'),
+    'roa': ('总资产收益率ROA', 'pct'),
+    'debt_to_assets': ('资产负债率', 'pct'),
+    'current_ratio': ('流动比率', 'ratio'),
+    'cash_conversion': ('现金转换率(经营现金流/净利润)', 'ratio'),
+    'free_cash_flow': ('自由现金流', 'amount'),
+    'revenue_growth': ('营收同比增长', 'pct'),
+    'net_profit_growth': ('净利润同比增长', 'pct'),
+    'operating_cash_flow_growth': ('经营现金流同比增长', 'pct'),
+    'total_assets_growth': ('总资产同比增长', 'pct'),
+}
+RATIO_TABLE_NAME = "financial_ratios"
+# 派生数据保存在报表目录的子目录中，不会被当作报表文件
+DERIVED_DIRNAME = "derived"
+
+# 计算同比和期初/期末平均值需要上年同期数据的科目
+_PRIOR_ITEMS = ['REVENUE', 'NET_PROFIT', 'OPERATING_CASH_FLOW', 'TOTAL_ASSETS', 'TOTAL_EQUITY']
+
+
+def _divide(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    """分母为0或缺失时结果为NaN"""
+    return numerator / denominator.where(denominator != 0)
+
+
+def _growth(current: pd.Series, prior: pd.Series) -> pd.Series:
+    """同比增长率，上期为负数或0时没有意义，结果为NaN"""
+    return current / prior.where(prior > 0) - 1
+
+
+def _average(current: pd.Series, prior: pd.Series) -> pd.Series:
+    """期初期末平均值，没有上年同期数据时使用期末值"""
+    return (current + prior.fillna(current)) / 2
+
+
+def compute_ratios(normalized: pd.DataFrame) -> pd.DataFrame:
+    """
+    一次计算所有公司、所有报告期的财务比率和同比增长
+
+    同比以上年同一报告日期为基期（按报告日期对齐合并，中间缺失年份不会错配），
+    ROE/ROA 使用期初期末平均的净资产/总资产。
+
+    Args:
+        normalized (pd.DataFrame): 标准宽表，ColumnMapper.normalize_facts 的返回值
+
+    Returns:
+        pd.DataFrame: 标识列、report_date 以及 RATIO_COLUMNS 中的各比率
+    """
+    keys = [column for column in ('company', 'market', 'code', 'period') if column in normalized.columns]
+    df = normalized.reindex(columns=keys + ['report_date'] + STANDARD_ITEMS)
+    df['report_date'] = pd.to_datetime(df['report_date'])
+
+    prior = df[keys + ['report_date'] + _PRIOR_ITEMS].copy()
+    prior['report_date'] = prior['report_date'] + pd.DateOffset(years=1)
+    df = df.merge(prior, on=keys + ['report_date'], how='left', suffixes=('', '_PRIOR'))
+
+    revenue = df['REVENUE']
+    # 港股报表中的成本、资本开支可能以负数列示，统一取绝对值
+    gross_profit = df['GROSS_PROFIT'].fillna(revenue - df['COST_OF_SALES'].abs())
+    ratios = df[keys + ['report_date']].copy()
+    ratios['gross_margin'] = _divide(gross_profit, revenue)
+    ratios['operating_margin'] = _divide(df['OPERATING_PROFIT'], revenue)
+    ratios['net_margin'] = _divide(df['NET_PROFIT'], revenue)
+    ratios['rd_ratio'] = _divide(df['RD_EXPENSE'].abs(), revenue)
+    ratios['roe'] = _divide(df['NET_PROFIT'], _average(df['TOTAL_EQUITY'], df['TOTAL_EQUITY_PRIOR']))
+    ratios['roa'] = _divide(df['NET_PROFIT'], _average(df['TOTAL_ASSETS'], df['TOTAL_ASSETS_PRIOR']))
+    ratios['debt_to_assets'] = _divide(df['TOTAL_LIABILITIES'], df['TOTAL_ASSETS'])
+    ratios['current_ratio'] = _divide(df['CURRENT_ASSETS'], df['CURRENT_LIABILITIES'])
+    ratios['cash_conversion'] = _divide(df['OPERATING_CASH_FLOW'], df['NET_PROFIT'].where(df['NET_PROFIT'] > 0))
+    ratios['free_cash_flow'] = df['OPERATING_CASH_FLOW'] - df['CAPEX'].abs()
+    ratios['revenue_growth'] = _growth(revenue, df['REVENUE_PRIOR'])
+    ratios['net_profit_growth'] = _growth(df['NET_PROFIT'], df['NET_PROFIT_PRIOR'])
+    ratios['operating_cash_flow_growth'] = _growth(df['OPERATING_CASH_FLOW'], df['OPERATING_CASH_FLOW_PRIOR'])
+    ratios['total_assets_growth'] = _growth(df['TOTAL_ASSETS'], df['TOTAL_ASSETS_PRIOR'])
+
+    ratio_columns = list(RATIO_COLUMNS)
+    ratios[ratio_columns] = ratios[ratio_columns].replace([np.inf, -np.inf], np.nan)
+    return ratios.sort_values(keys + ['report_date']).reset_index(drop=True)
+
+
+def build_ratio_table(warehouse: StatementWarehouse = None, companies: Iterable[str] = None,
+                      period: str = "年度") -> pd.DataFrame:
+    """
+    从报表仓库计算财务比率表
+
+    Args:
+        warehouse (StatementWarehouse): 报表仓库，默认使用进程级仓库
+        companies (Iterable[str]): 公司名称列表，None表示全部
+        period (str): 报告期间
+
+    Returns:
+        pd.DataFrame: compute_ratios 的返回值
+    """
+    warehouse = warehouse or get_statement_warehouse()
+    facts = warehouse.facts(companies=companies, period=period)
+    if facts.empty:
+        return pd.DataFrame(columns=['company', 'market', 'code', 'period', 'report_date'] + list(RATIO_COLUMNS))
+    return compute_ratios(get_column_mapper().normalize_facts(facts))
+
+
+def _write_parquet(df: pd.DataFrame, path: str):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def refresh_financial_ratios(warehouse: StatementWarehouse = None, save_dir: str = None,
+                             period: str = "年度") -> Dict[str, str]:
+    """
+    重新计算全部公司的财务比率，写入仓库的 financial_ratios 表，并保存到报表目录
+
+    Args:
+        warehouse (StatementWarehouse): 报表仓库，默认使用进程级仓库
+        save_dir (str): 报表目录，设置时在其 derived/ 子目录中保存全部公司的比率表
+            financial_ratios.parquet 和每家公司的 {公司}_财务比率.parquet
+        period (str): 报告期间
+
+    Returns:
+        Dict[str, str]: {公司名称: 该公司比率表路径}，未设置 save_dir 时为空
+    """
+    warehouse = warehouse or get_statement_warehouse()
+    ratios = build_ratio_table(warehouse, period=period)
+    warehouse.write_table(RATIO_TABLE_NAME, ratios)
+    if not save_dir or ratios.empty:
+        return {}
+
+    derived_dir = os.path.join(save_dir, DERIVED_DIRNAME)
+    os.makedirs(derived_dir, exist_ok=True)
+    _write_parquet(ratios, os.path.join(derived_dir, f"{RATIO_TABLE_NAME}.parquet"))
+    company_files = {}
+    for company, company_ratios in ratios.groupby('company', sort=False):
+        path = os.path.join(derived_dir, f"{company}_财务比率.parquet")
+        _write_parquet(company_ratios.reset_index(drop=True), path)
+        company_files[company] = path
+    return company_files
+
+
+def format_ratio_table(ratios: pd.DataFrame, companies: Iterable[str] = None,
+                       latest_periods: Optional[int] = 3) -> str:
+    """
+    把比率表整理为 Markdown 表格，供提示词和报告使用
+
+    Args:
+        ratios (pd.DataFrame): compute_ratios 的返回值
+        companies (Iterable[str]): 只包含这些公司，None表示全部
+        latest_periods (int): 每家公司只保留最近几个报告期，None表示全部
+
+    Returns:
+        str: Markdown 表格，没有数据时返回空字符串
+    """
+    if companies is not None:
+        ratios = ratios[ratios['company'].isin(list(companies))]
+    if ratios.empty:
+        return ""
+    ratios = ratios.sort_values(['company', 'report_date'])
+    if latest_periods:
+        ratios = ratios.groupby('company', sort=False).tail(latest_periods)
+
+    headers = ["公司", "报告期"] + [label for label, _ in RATIO_COLUMNS.values()]
+    lines = ["| " + " | ".join(headers) + " |", "|" + "---|" * len(headers)]
+    for row in ratios.itertuples(index=False):
+        cells = [str(row.company), pd.Timestamp(row.report_date).strftime('%Y-%m-%d')]
+        for column, (_, kind) in RATIO_COLUMNS.items():
+            value = getattr(row, column)
+            if pd.isna(value):
+                cells.append("-")
+            elif kind == 'pct':
+                cells.append(f"{value:.1%}")
+            elif kind == 'ratio':
+                cells.append(f"{value:.2f}")
+            else:
+                cells.append(f"{value / 1e8:.2f}亿")
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
@@ -1,10 +1,12 @@
 import efinance as ef
 
+from utils.data_cache import cached_call
+
 
 def get_base_info(stock_code: str = "00020"):
-    """获取股票基础信息"""
+    """获取股票基础信息（经数据接口缓存，有效期见 utils.data_cache）"""
 
-    return ef.stock.get_base_info(stock_code)
+    return cached_call("base_info", lambda: ef.stock.get_base_info(stock_code), symbol=stock_code)
 
 
 
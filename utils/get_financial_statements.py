@@ -1,10 +1,26 @@
 import akshare as ak
 import pandas as pd
-from typing import Dict, Optional
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 import os
+import concurrent.futures
 
+from utils.rate_limiter import get_rate_limiter
+from utils.data_cache import cached_call
 
-def get_balance_sheet(stock_code: str = "00020", market: str = "HK", period: str = "年度", verbose: bool = False) -> Optional[pd.DataFrame]:
+# 三大报表接口（港股和A股）都来自东方财富，共享同一个限速器
+STATEMENT_SOURCE = "eastmoney"
+# 并发获取报表时的默认线程数
+DEFAULT_FETCH_WORKERS = int(os.environ.get("STATEMENT_FETCH_WORKERS", "6"))
+
+
+def _rate_limited(fetch):
+    """在数据源限速下访问网络，只有缓存未命中时才会调用"""
+    get_rate_limiter(STATEMENT_SOURCE).acquire()
+    return fetch()
+
+
+def get_balance_sheet(stock_code: str = "00020", market: str = "HK", period: str = "年度", verbose: bool = False,
+                      refresh: bool = False) -> Optional[pd.DataFrame]:
     """
     获取公司的资产负债表
     
@@ -13,6 +29,7 @@ def get_balance_sheet(stock_code: str = "00020", market: str = "HK", period: str
         market (str): 股票市场，"HK"为港股，"A"为A股
         period (str): 报告期间，可选"年度"或"中期"（仅港股适用），默认为"年度"
         verbose (bool): 是否打印详细信息，默认为False
+        refresh (bool): 忽略本地缓存，重新从数据源获取，默认为False
     
     Returns:
         pd.DataFrame: 资产负债表数据，如果获取失败则返回None
@@ -22,15 +39,18 @@ def get_balance_sheet(stock_code: str = "00020", market: str = "HK", period: str
             print(f"正在获取{market}股票代码 {stock_code} 的{period}资产负债表...")
         
         if market == "HK":
-            df_balance_sheet = ak.stock_financial_hk_report_em(
-                stock=stock_code, 
-                symbol="资产负债表", 
-                indicator=period
-            )
+            fetch = lambda: ak.stock_financial_hk_report_em(stock=stock_code, symbol="资产负债表", indicator=period)
         elif market == "A":
-            df_balance_sheet = ak.stock_balance_sheet_by_yearly_em(symbol=stock_code)
+            fetch = lambda: ak.stock_balance_sheet_by_yearly_em(symbol=stock_code)
         else:
             raise ValueError(f"不支持的市场类型: {market}，请使用 'HK' 或 'A'")
+        df_balance_sheet = cached_call(
+            "balance_sheet", lambda: _rate_limited(fetch),
+            symbol=stock_code, market=market, period=period, dataset="financial_statement",
+            refresh=refresh
+        )
+        if df_balance_sheet is None:
+            raise ValueError("离线模式下缓存中没有该报表")
         
         if verbose:
             print(f"成功获取资产负债表，共 {len(df_balance_sheet)} 行数据")
@@ -46,7 +66,8 @@ def get_balance_sheet(stock_code: str = "00020", market: str = "HK", period: str
         return None
 
 
-def get_income_statement(stock_code: str = "00020", market: str = "HK", period: str = "年度", verbose: bool = False) -> Optional[pd.DataFrame]:
+def get_income_statement(stock_code: str = "00020", market: str = "HK", period: str = "年度", verbose: bool = False,
+                         refresh: bool = False) -> Optional[pd.DataFrame]:
     """    获取公司的利润表
     
     Args:
@@ -54,6 +75,7 @@ def get_income_statement(stock_code: str = "00020", market: str = "HK", period:
         market (str): 股票市场，"HK"为港股，"A"为A股
         period (str): 报告期间，可选"年度"或"中期"（仅港股适用），默认为"年度"
         verbose (bool): 是否打印详细信息，默认为False
+        refresh (bool): 忽略本地缓存，重新从数据源获取，默认为False
     
     Returns:
         pd.DataFrame: 利润表数据，如果获取失败则返回None
@@ -63,15 +85,18 @@ def get_income_statement(stock_code: str = "00020", market: str = "HK", period:
             print(f"正在获取{market}股票代码 {stock_code} 的{period}利润表...")
         
         if market == "HK":
-            df_income_statement = ak.stock_financial_hk_report_em(
-                stock=stock_code, 
-                symbol="利润表", 
-                indicator=period
-            )
+            fetch = lambda: ak.stock_financial_hk_report_em(stock=stock_code, symbol="利润表", indicator=period)
         elif market == "A":
-            df_income_statement = ak.stock_profit_sheet_by_yearly_em(symbol=stock_code)
+            fetch = lambda: ak.stock_profit_sheet_by_yearly_em(symbol=stock_code)
         else:
             raise ValueError(f"不支持的市场类型: {market}，请使用 'HK' 或 'A'")
+        df_income_statement = cached_call(
+            "income_statement", lambda: _rate_limited(fetch),
+            symbol=stock_code, market=market, period=period, dataset="financial_statement",
+            refresh=refresh
+        )
+        if df_income_statement is None:
+            raise ValueError("离线模式下缓存中没有该报表")
         
         if verbose:
             print(f"成功获取利润表，共 {len(df_income_statement)} 行数据")
@@ -87,7 +112,8 @@ def get_income_statement(stock_code: str = "00020", market: str = "HK", period:
         return None
 
 
-def get_cash_flow_statement(stock_code: str = "00020", market: str = "HK", period: str = "年度", verbose: bool = False) -> Optional[pd.DataFrame]:
+def get_cash_flow_statement(stock_code: str = "00020", market: str = "HK", period: str = "年度", verbose: bool = False,
+                            refresh: bool = False) -> Optional[pd.DataFrame]:
     """
     获取公司的现金流量表
     
@@ -96,6 +122,7 @@ def get_cash_flow_statement(stock_code: str = "00020", market: str = "HK", perio
         market (str): 股票市场，"HK"为港股，"A"为A股
         period (str): 报告期间，可选"年度"或"中期"（仅港股适用），默认为"年度"
         verbose (bool): 是否打印详细信息，默认为True
+        refresh (bool): 忽略本地缓存，重新从数据源获取，默认为False
     
     Returns:
         pd.DataFrame: 现金流量表数据，如果获取失败则返回None
@@ -105,15 +132,18 @@ def get_cash_flow_statement(stock_code: str = "00020", market: str = "HK", perio
             print(f"正在获取{market}股票代码 {stock_code} 的{period}现金流量表...")
         
         if market == "HK":
-            df_cash_flow = ak.stock_financial_hk_report_em(
-                stock=stock_code, 
-                symbol="现金流量表", 
-                indicator=period
-            )
+            fetch = lambda: ak.stock_financial_hk_report_em(stock=stock_code, symbol="现金流量表", indicator=period)
         elif market == "A":
-            df_cash_flow = ak.stock_cash_flow_sheet_by_yearly_em(symbol=stock_code)
+            fetch = lambda: ak.stock_cash_flow_sheet_by_yearly_em(symbol=stock_code)
         else:
             raise ValueError(f"不支持的市场类型: {market}，请使用 'HK' 或 'A'")
+        df_cash_flow = cached_call(
+            "cash_flow_statement", lambda: _rate_limited(fetch),
+            symbol=stock_code, market=market, period=period, dataset="financial_statement",
+            refresh=refresh
+        )
+        if df_cash_flow is None:
+            raise ValueError("离线模式下缓存中没有该报表")
         
         if verbose:
             print(f"成功获取现金流量表，共 {len(df_cash_flow)} 行数据")
@@ -149,11 +179,10 @@ def get_all_financial_statements(stock_code: str = "00020", market: str = "HK",
         print(f"开始获取{market}股票代码 {stock_code} 的所有{period}财务报表...")
         print("=" * 60)
     
-    financial_statements = {
-        'balance_sheet': get_balance_sheet(stock_code, market, period, verbose),
-        'income_statement': get_income_statement(stock_code, market, period, verbose),
-        'cash_flow_statement': get_cash_flow_statement(stock_code, market, period, verbose)
-    }
+    # 三张报表互不依赖，并发获取
+    _, financial_statements = next(fetch_financial_statements_concurrently(
+        [(stock_code, market, period)], max_workers=len(STATEMENT_FETCHERS), verbose=verbose
+    ))
     
     if verbose:
         print("=" * 60)
@@ -163,6 +192,61 @@ def get_all_financial_statements(stock_code: str = "00020", market: str = "HK",
     return financial_statements
 
 
+STATEMENT_FETCHERS = {
+    'balance_sheet': get_balance_sheet,
+    'income_statement': get_income_statement,
+    'cash_flow_statement': get_cash_flow_statement,
+}
+
+
+def fetch_financial_statements_concurrently(
+        requests: Iterable[Tuple[str, str, str]],
+        max_workers: int = None,
+        verbose: bool = False,
+        refresh: bool = False) -> Iterator[Tuple[Tuple[str, str, str], Dict[str, Optional[pd.DataFrame]]]]:
+    """
+    并发获取多家公司的三大财务报表，每家公司的报表全部获取完成时立即返回
+    
+    所有 (公司, 报表) 请求在有界线程池中执行，同一数据源的请求共享限速器（见 utils.rate_limiter），
+    不再需要在公司之间固定 sleep。
+    
+    Args:
+        requests (Iterable[Tuple[str, str, str]]): (股票代码, 市场, 报告期间) 列表，例如 [("00020", "HK", "年度")]
+        max_workers (int): 最大并发请求数，默认读取环境变量 STATEMENT_FETCH_WORKERS（默认6）
+        verbose (bool): 是否打印详细信息
+        refresh (bool): 忽略本地缓存，重新从数据源获取
+    
+    Yields:
+        ((股票代码, 市场, 报告期间), {报表类型: DataFrame或None})，按完成顺序返回
+    """
+    requests = list(dict.fromkeys(requests))
+    if not requests:
+        return
+    max_workers = max_workers or DEFAULT_FETCH_WORKERS
+    pending = {request: {} for request in requests}
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="statement-fetch") as pool:
+        futures = {}
+        for stock_code, market, period in requests:
+            for statement_type, fetcher in STATEMENT_FETCHERS.items():
+                future = pool.submit(fetcher, stock_code, market, period, verbose, refresh)
+                futures[future] = ((stock_code, market, period), statement_type)
+        
+        for future in concurrent.futures.as_completed(futures):
+            request, statement_type = futures[future]
+            try:
+                df = future.result()
+            except Exception as e:
+                if verbose:
+                    print(f"获取 {request} 的 {statement_type} 失败: {e}")
+                df = None
+            statements = pending[request]
+            statements[statement_type] = df
+            if len(statements) == len(STATEMENT_FETCHERS):
+                # 按固定顺序返回报表
+                yield request, {name: statements[name] for name in STATEMENT_FETCHERS}
+
+
 def save_financial_statements_to_csv(financial_statements: Dict[str, Optional[pd.DataFrame]], 
                                    stock_code: str = "00020", 
                                    market: str = "HK",
@@ -2,6 +2,16 @@ import akshare as ak
 import pandas as pd
 from typing import Optional, Literal
 
+from utils.data_cache import cached_call
+from utils.rate_limiter import get_rate_limiter
+
+
+def _fetch_with_limit(source: str, fetch):
+    """在数据源限速下访问网络，只有缓存未命中时才会调用"""
+    get_rate_limiter(source).acquire()
+    return fetch()
+
+
 def get_stock_intro(symbol: str = "000066", market: Literal["A", "HK"] = "A") -> Optional[str]:
     """
     获取股票的基本介绍信息，包括主营业务、经营范围等。
@@ -15,7 +25,10 @@ def get_stock_intro(symbol: str = "000066", market: Literal["A", "HK"] = "A") ->
         # 去掉A股代码的SH/SZ前缀
         clean_symbol = symbol.replace('SH', '').replace('SZ', '')
         try:
-            df = ak.stock_zyjs_ths(symbol=clean_symbol)
+            df = cached_call(
+                "stock_intro", lambda: _fetch_with_limit("ths", lambda: ak.stock_zyjs_ths(symbol=clean_symbol)),
+                symbol=clean_symbol, market=market
+            )
             if df is not None and not df.empty:
                 return df.to_string(index=False)
         except Exception as e:
@@ -25,7 +38,11 @@ def get_stock_intro(symbol: str = "000066", market: Literal["A", "HK"] = "A") ->
         # 去掉港股代码的HK前缀
         clean_symbol = symbol.replace('HK', '')
         try:
-            df = ak.stock_hk_company_profile_em(symbol=clean_symbol)
+            df = cached_call(
+                "stock_intro",
+                lambda: _fetch_with_limit("eastmoney", lambda: ak.stock_hk_company_profile_em(symbol=clean_symbol)),
+                symbol=clean_symbol, market=market
+            )
             if df is not None and not df.empty:
                 return df.to_string(index=False)
         except Exception as e:
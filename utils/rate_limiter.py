@@ -0,0 +1,74 @@
+import os
+import time
+import threading
+from typing import Dict
+
+
+# 各数据源默认的每秒请求数上限，可通过环境变量 {数据源大写}_RATE_LIMIT 覆盖，例如 EASTMONEY_RATE_LIMIT=5
+DEFAULT_RATES = {
+    'eastmoney': 3.0,
+    'ths': 1.0,
+}
+
+
+class RateLimiter:
+    """
+    线程安全的令牌桶限速器
+
+    多个线程共享同一数据源的限速器，每次请求前调用 acquire()，超过速率时阻塞等待。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate (float): 每秒允许的请求数
+            burst (int): 允许的突发请求数（桶容量）
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        获取一个令牌，必要时阻塞等待
+
+        Returns:
+            float: 本次等待的秒数
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(source: str) -> RateLimiter:
+    """
+    获取数据源对应的进程级限速器
+
+    Args:
+        source (str): 数据源名称，例如 'eastmoney'、'ths'
+
+    Returns:
+        RateLimiter: 同一数据源在所有线程间共享的限速器
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(source)
+        if limiter is None:
+            rate = float(os.environ.get(f"{source.upper()}_RATE_LIMIT", DEFAULT_RATES.get(source, 2.0)))
+            limiter = RateLimiter(rate)
+            _limiters[source] = limiter
+        return limiter
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import uuid
+import glob
+import threading
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# 报表文件格式：parquet（默认）、csv 或 both，可通过环境变量 STATEMENT_FILE_FORMAT 修改
+DEFAULT_FILE_FORMAT = os.environ.get("STATEMENT_FILE_FORMAT", "parquet")
+FILE_FORMATS = ('parquet', 'csv', 'both')
+MANIFEST_FILE = "statements_manifest.json"
+MANIFEST_VERSION = 1
+
+# 报表中的文本列（标识、名称、科目代码等），其余列按数值保存
+TEXT_COLUMNS = {
+    'SECUCODE', 'SECURITY_CODE', 'SECURITY_NAME_ABBR', 'ORG_CODE', 'ORG_TYPE',
+    'REPORT_TYPE', 'REPORT_DATE_NAME', 'SECURITY_TYPE_CODE', 'CURRENCY',
+    'DATE_TYPE_CODE', 'FISCAL_YEAR', 'STD_ITEM_CODE', 'STD_ITEM_NAME',
+    'OPINION_TYPE', 'OSOPINION_TYPE', 'LISTING_STATE',
+}
+# 报表中的日期列，统一保存为毫秒精度的时间戳
+DATE_COLUMNS = {'REPORT_DATE', 'NOTICE_DATE', 'UPDATE_DATE', 'STD_REPORT_DATE', 'START_DATE'}
+
+_manifest_lock = threading.Lock()
+
+
+def statement_file_stem(stock_code: str, market: str, statement_type: str, period: str,
+                        company_name: str = None) -> str:
+    """
+    报表文件名（不含扩展名），与 save_financial_statements_to_csv 的命名约定一致
+
+    Args:
+        stock_code (str): 股票代码
+        market (str): 股票市场，"HK"为港股，"A"为A股
+        statement_type (str): 报表类型，例如 'balance_sheet'
+        period (str): 报告期间
+        company_name (str): 公司名称，为None时只使用股票代码
+    """
+    if company_name:
+        return f"{company_name}_{market}_{stock_code}_{statement_type}_{period}"
+    return f"{market}_{stock_code}_{statement_type}_{period}"
+
+
+def _column_type(name: str, series: pd.Series) -> pa.DataType:
+    """确定列的存储类型：日期列为时间戳，文本列为字符串，能完整转换为数值的列为float64"""
+    if name in DATE_COLUMNS or name.endswith('_DATE'):
+        return pa.timestamp('ms')
+    if name in TEXT_COLUMNS:
+        return pa.string()
+    if pd.api.types.is_bool_dtype(series):
+        return pa.bool_()
+    if pd.api.types.is_numeric_dtype(series):
+        return pa.float64()
+    non_null = series.dropna()
+    if pd.to_numeric(non_null, errors='coerce').notna().all():
+        # 全空或全部为数值字符串的科目列
+        return pa.float64()
+    return pa.string()
+
+
+def normalize_statement_frame(df: pd.DataFrame) -> pa.Table:
+    """
+    把接口返回的报表转换为类型确定的 Arrow 表
+
+    同一列在不同公司、不同批次的文件中类型保持一致：全空的科目列不会被推断为文本，
+    日期列不会保存为字符串，下游读取时无需再推断类型。
+
+    Args:
+        df (pd.DataFrame): 接口返回的报表
+
+    Returns:
+        pa.Table: 类型确定的表
+    """
+    columns = {}
+    fields = []
+    for name in df.columns:
+        series = df[name]
+        column_name = str(name)
+        dtype = _column_type(column_name, series)
+        if pa.types.is_timestamp(dtype):
+            values = pd.to_datetime(series, errors='coerce')
+        elif pa.types.is_floating(dtype):
+            values = pd.to_numeric(series, errors='coerce').astype('float64')
+        elif pa.types.is_string(dtype):
+            values = series.astype(object).where(series.notna(), None)
+            values = values.map(lambda v: v if v is None else str(v))
+        else:
+            values = series
+        columns[column_name] = pa.array(values, type=dtype, from_pandas=True)
+        fields.append(pa.field(column_name, dtype))
+    return pa.Table.from_arrays(list(columns.values()), schema=pa.schema(fields))
+
+
+def read_manifest(save_dir: str) -> Dict:
+    """
+    读取目录中的报表清单，不存在或损坏时返回空清单
+
+    Args:
+        save_dir (str): 报表目录
+
+    Returns:
+        Dict: {'version': 版本, 'files': {文件名: 文件信息}}
+    """
+    path = os.path.join(save_dir, MANIFEST_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('files'), dict):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+
+def _update_manifest(save_dir: str, entries: Dict[str, Dict]):
+    """把新写入的文件合并进清单（原子替换）"""
+    with _manifest_lock:
+        manifest = read_manifest(save_dir)
+        manifest['version'] = MANIFEST_VERSION
+        manifest['files'].update(entries)
+        path = os.path.join(save_dir, MANIFEST_FILE)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+def _write_parquet(table: pa.Table, path: str):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+
+
+def save_financial_statements(financial_statements: Dict[str, Optional[pd.DataFrame]],
+                              stock_code: str = "00020",
+                              market: str = "HK",
+                              period: str = "年度",
+                              company_name: str = None,
+                              save_dir: str = ".",
+                              file_format: str = None) -> List[str]:
+    """
+    保存财务报表，默认保存为带类型和压缩的Parquet文件，并在目录中维护报表清单
+
+    清单 statements_manifest.json 记录每个文件的公司、市场、代码、报表类型、期间、行数、
+    列类型和写入时间，下游无需打开文件就能知道每个文件的内容和结构。
+
+    Args:
+        financial_statements (Dict): 包含财务报表的字典
+        stock_code (str): 股票代码，用于文件命名
+        market (str): 股票市场，"HK"为港股，"A"为A股
+        period (str): 报告期间，用于文件命名
+        company_name (str): 公司名称，用于文件命名，如果为None则只使用股票代码
+        save_dir (str): 保存文件的目录，默认为当前目录
+        file_format (str): 'parquet'、'csv' 或 'both'，默认读取环境变量 STATEMENT_FILE_FORMAT（默认parquet）
+
+    Returns:
+        List[str]: 写入的文件路径
+    """
+    file_format = file_format or DEFAULT_FILE_FORMAT
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"不支持的报表文件格式: {file_format}，请使用 {'、'.join(FILE_FORMATS)}")
+    os.makedirs(save_dir, exist_ok=True)
+
+    written = []
+    entries = {}
+    for statement_type, df in financial_statements.items():
+        if df is None:
+            print(f"跳过保存 {statement_type}，因为数据获取失败")
+            continue
+        stem = statement_file_stem(stock_code, market, statement_type, period, company_name)
+        table = normalize_statement_frame(df)
+        info = {
+            'company': company_name or f"{market}_{stock_code}",
+            'market': market,
+            'code': stock_code,
+            'statement': statement_type,
+            'period': period,
+            'rows': table.num_rows,
+            'schema': [[field.name, str(field.type)] for field in table.schema],
+            'written_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        paths = []
+        if file_format in ('parquet', 'both'):
+            filepath = os.path.join(save_dir, f"{stem}.parquet")
+            _write_parquet(table, filepath)
+            entries[os.path.basename(filepath)] = dict(info, format='parquet')
+            paths.append(filepath)
+        if file_format in ('csv', 'both'):
+            filepath = os.path.join(save_dir, f"{stem}.csv")
+            table.to_pandas().to_csv(filepath, index=False, encoding='utf-8-sig')
+            entries[os.path.basename(filepath)] = dict(info, format='csv')
+            paths.append(filepath)
+        print(f"已保存 {statement_type} 到文件: {', '.join(paths)}")
+        written.extend(paths)
+
+    if entries:
+        _update_manifest(save_dir, entries)
+    return written
+
+
+def list_statement_files(save_dir: str) -> List[str]:
+    """
+    列出目录中的报表文件（Parquet和CSV），同名的Parquet和CSV文件只返回Parquet
+
+    Args:
+        save_dir (str): 报表目录
+
+    Returns:
+        List[str]: 报表文件路径
+    """
+    by_stem = {}
+    for ext in ('.parquet', '.csv'):
+        for path in sorted(glob.glob(os.path.join(glob.escape(save_dir), f"*{ext}"))):
+            by_stem.setdefault(os.path.splitext(os.path.basename(path))[0], path)
+    return list(by_stem.values())
+
+
+def statement_files_by_company(save_dir: str) -> Dict[str, List[str]]:
+    """
+    按公司分组列出目录中的报表文件
+
+    公司名称取自报表清单；清单中没有记录的旧文件按文件名的第一段识别公司。
+
+    Args:
+        save_dir (str): 报表目录
+
+    Returns:
+        Dict[str, List[str]]: {公司名称: [报表文件路径, ...]}
+    """
+    files_info = read_manifest(save_dir)['files']
+    companies = {}
+    for path in list_statement_files(save_dir):
+        info = files_info.get(os.path.basename(path))
+        company = info['company'] if info else os.path.basename(path).split("_")[0]
+        companies.setdefault(company, []).append(path)
+    return companies
@@ -0,0 +1,176 @@
+import os
+import datetime
+from typing import Dict, Tuple
+
+import pandas as pd
+
+from utils.get_financial_statements import STATEMENT_FETCHERS, fetch_financial_statements_concurrently
+from utils.statement_store import save_financial_statements
+from utils.statement_warehouse import StatementWarehouse, get_statement_warehouse
+
+# 各报告期间相邻两期报告日期的间隔（月）
+PERIOD_MONTHS = {'年度': 12, '中期': 6}
+# 报告期结束后最早可能披露的天数，之前不会有新一期报表，无需访问网络
+EARLIEST_DISCLOSURE_DAYS = int(os.environ.get("STATEMENT_SYNC_EARLIEST_DAYS", "30"))
+# 即使没有到期的新报告，超过这么多天未检查也重新获取一次，以发现重述和更正
+RECHECK_DAYS = int(os.environ.get("STATEMENT_SYNC_RECHECK_DAYS", "30"))
+
+SyncTarget = Tuple[str, str, str]
+
+
+def next_report_due(latest_report_date: datetime.date, period: str) -> datetime.date:
+    """
+    下一期报表最早可能披露的日期
+
+    Args:
+        latest_report_date (datetime.date): 仓库中最新一期的报告日期
+        period (str): 报告期间，"年度" 或 "中期"
+
+    Returns:
+        datetime.date: 下一期报告日期 + EARLIEST_DISCLOSURE_DAYS
+    """
+    next_report = pd.Timestamp(latest_report_date) + pd.DateOffset(months=PERIOD_MONTHS.get(period, 12))
+    return (next_report + pd.Timedelta(days=EARLIEST_DISCLOSURE_DAYS)).date()
+
+
+class StatementSync:
+    """
+    财务报表增量同步
+
+    数据接口每次都返回全部历史报告期，无法只请求新的一期。增量同步在仓库的 statement_sync 表中
+    记录每家公司每张报表最新的报告日期，据此判断是否可能已有新一期报表：
+    - 还没到下一期最早披露日期、且近期检查过的报表直接跳过，不访问网络
+    - 需要检查的报表绕过本地缓存重新获取，只把新增的报告期和取值变化的行写入仓库
+    - 返回每家公司新增的报告期和发生变化的报告期
+    大量同业公司的日常同步大多数时候只需要读本地状态。
+    """
+
+    def __init__(self, warehouse: StatementWarehouse = None, save_dir: str = None):
+        """
+        Args:
+            warehouse (StatementWarehouse): 报表仓库，默认使用进程级仓库
+            save_dir (str): 报表文件目录，设置时有变化的公司会重新保存报表文件
+        """
+        self.warehouse = warehouse or get_statement_warehouse()
+        self.save_dir = save_dir
+
+    def plan(self, targets: Dict[SyncTarget, str], today: datetime.date = None,
+             force: bool = False) -> Dict[SyncTarget, str]:
+        """
+        判断哪些公司需要访问数据源
+
+        Args:
+            targets (Dict): {(股票代码, 市场, 报告期间): 公司名称}
+            today (datetime.date): 当前日期，默认今天
+            force (bool): 是否全部重新获取
+
+        Returns:
+            Dict[SyncTarget, str]: {需要获取的目标: 原因}
+        """
+        today = today or datetime.date.today()
+        due = {}
+        for target in targets:
+            code, market, period = target
+            if force:
+                due[target] = "强制刷新"
+                continue
+            states = [self.warehouse.sync_state(market, code, statement, period) for statement in STATEMENT_FETCHERS]
+            if not all(states):
+                due[target] = "仓库中缺少报表"
+                continue
+            latest = min(state['latest_report_date'] for state in states)
+            checked_at = min(state['checked_at'] for state in states)
+            if latest is None:
+                due[target] = "仓库中缺少报表"
+            elif today >= next_report_due(latest, period):
+                due[target] = f"最新报告期 {latest}，下一期可能已披露"
+            elif (today - checked_at.date()).days >= RECHECK_DAYS:
+                due[target] = f"{RECHECK_DAYS}天内未检查"
+        return due
+
+    def sync(self, targets: Dict[SyncTarget, str], force: bool = False, max_workers: int = None,
+             today: datetime.date = None, verbose: bool = False) -> Dict[str, Dict]:
+        """
+        增量同步
+
+        Args:
+            targets (Dict): {(股票代码, 市场, 报告期间): 公司名称}
+            force (bool): 是否忽略披露时间，全部重新获取
+            max_workers (int): 最大并发请求数
+            today (datetime.date): 当前日期，默认今天
+            verbose (bool): 是否打印详细信息
+
+        Returns:
+            Dict[str, Dict]: {公司名称: {'status': 'skipped'/'unchanged'/'updated'/'failed',
+                'reason': 检查原因, 'statements': {报表类型: upsert_statements 的结果}}}
+        """
+        due = self.plan(targets, today=today, force=force)
+        report = {
+            company: {'status': 'skipped', 'reason': "未到下一期披露时间", 'statements': {}}
+            for target, company in targets.items() if target not in due
+        }
+        if verbose:
+            print(f"共 {len(targets)} 家公司，需要检查 {len(due)} 家")
+
+        for target, statements in fetch_financial_statements_concurrently(
+                due, max_workers=max_workers, verbose=verbose, refresh=True):
+            code, market, period = target
+            company = targets[target]
+            entry = {'status': 'failed', 'reason': due[target], 'statements': {}}
+            report[company] = entry
+            if all(df is None for df in statements.values()):
+                continue
+            entry['statements'] = self.warehouse.upsert_statements(statements, company, market, code, period)
+            changed = any(s['new_rows'] or s['changed_rows'] for s in entry['statements'].values())
+            entry['status'] = 'updated' if changed else 'unchanged'
+            if changed and self.save_dir:
+                save_financial_statements(statements, stock_code=code, market=market, period=period,
+                                          company_name=company, save_dir=self.save_dir)
+        return report
+
+    def known_targets(self) -> Dict[SyncTarget, str]:
+        """仓库中已有的全部公司，作为日常同步的默认范围"""
+        states = self.warehouse.sync_states()
+        return {
+            (row.code, row.market, row.period): row.company
+            for row in states.drop_duplicates(['code', 'market', 'period']).itertuples()
+        }
+
+
+def format_sync_report(report: Dict[str, Dict]) -> str:
+    """
+    把同步结果整理为文本
+
+    Args:
+        report (Dict): StatementSync.sync 的返回值
+    """
+    status_names = {'updated': "有更新", 'unchanged': "无变化", 'skipped': "跳过", 'failed': "获取失败"}
+    lines = []
+    for company, entry in sorted(report.items(), key=lambda item: item[1]['status'] != 'updated'):
+        line = f"{company}: {status_names.get(entry['status'], entry['status'])}"
+        if entry['status'] == 'updated':
+            details = []
+            for statement, change in entry['statements'].items():
+                parts = []
+                if change['new_report_dates']:
+                    parts.append(f"新增报告期 {', '.join(change['new_report_dates'])}")
+                if change['changed_report_dates']:
+                    parts.append(f"修订报告期 {', '.join(change['changed_report_dates'])}（{change['changed_rows']}项）")
+                if not parts and change['new_rows']:
+                    parts.append(f"新增科目 {change['new_rows']}项")
+                if parts:
+                    details.append(f"{statement} " + "；".join(parts))
+            line += "\n    " + "\n    ".join(details)
+        elif entry['status'] != 'skipped':
+            line += f"（{entry['reason']}）"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# 直接运行时同步仓库中已有的全部公司，可用于每日定时任务
+if __name__ == "__main__":
+    import sys
+
+    statement_sync = StatementSync(save_dir=os.environ.get("STATEMENT_SYNC_SAVE_DIR"))
+    sync_report = statement_sync.sync(statement_sync.known_targets(), force="--force" in sys.argv, verbose=True)
+    print(format_sync_report(sync_report))
@@ -0,0 +1,451 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import duckdb
+import pandas as pd
+
+from utils.statement_store import DATE_COLUMNS, TEXT_COLUMNS, normalize_statement_frame, read_manifest
+
+# 报表仓库默认路径，可通过环境变量 STATEMENT_WAREHOUSE_PATH 修改
+DEFAULT_WAREHOUSE_PATH = os.environ.get(
+    "STATEMENT_WAREHOUSE_PATH", os.path.join("download_financial_statement_files", "statements.duckdb")
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statement_facts (
+    company VARCHAR NOT NULL,
+    market VARCHAR NOT NULL,
+    code VARCHAR NOT NULL,
+    statement VARCHAR NOT NULL,
+    period VARCHAR NOT NULL,
+    report_date DATE NOT NULL,
+    item VARCHAR NOT NULL,
+    value DOUBLE,
+    updated_at TIMESTAMP DEFAULT current_timestamp,
+    PRIMARY KEY (market, code, statement, period, report_date, item)
+);
+CREATE INDEX IF NOT EXISTS idx_statement_facts_company ON statement_facts (company);
+CREATE INDEX IF NOT EXISTS idx_statement_facts_item ON statement_facts (item);
+CREATE INDEX IF NOT EXISTS idx_statement_facts_report_date ON statement_facts (report_date);
+CREATE TABLE IF NOT EXISTS statement_sync (
+    market VARCHAR NOT NULL,
+    code VARCHAR NOT NULL,
+    statement VARCHAR NOT NULL,
+    period VARCHAR NOT NULL,
+    company VARCHAR NOT NULL,
+    latest_report_date DATE,
+    checked_at TIMESTAMP,
+    changed_at TIMESTAMP,
+    PRIMARY KEY (market, code, statement, period)
+);
+"""
+_KEY_COLUMNS = ['market', 'code', 'statement', 'period', 'report_date', 'item']
+_FACT_COLUMNS = ['company', 'market', 'code', 'statement', 'period', 'report_date', 'item', 'value']
+
+
+def statement_to_facts(df: pd.DataFrame, company: str, market: str, code: str,
+                       statement: str, period: str) -> pd.DataFrame:
+    """
+    把单张报表转换为统一的长表
+
+    港股报表本身是长表（STD_ITEM_NAME/AMOUNT），A股报表是宽表（每个科目一列），
+    A股只展开数值型的科目列，同比列 *_YOY 是比率，不是金额，不展开。
+
+    Args:
+        df (pd.DataFrame): 接口返回的报表
+        company (str): 公司名称
+        market (str): 股票市场，"HK"为港股，"A"为A股
+        code (str): 股票代码
+        statement (str): 报表类型，例如 'balance_sheet'
+        period (str): 报告期间，例如 "年度"
+
+    Returns:
+        pd.DataFrame: 列为 company, market, code, statement, period, report_date, item, value
+    """
+    frame = normalize_statement_frame(df).to_pandas()
+    if 'REPORT_DATE' not in frame.columns:
+        return pd.DataFrame(columns=_FACT_COLUMNS)
+
+    if 'STD_ITEM_NAME' in frame.columns and 'AMOUNT' in frame.columns:
+        facts = frame[['REPORT_DATE', 'STD_ITEM_NAME', 'AMOUNT']].rename(
+            columns={'REPORT_DATE': 'report_date', 'STD_ITEM_NAME': 'item', 'AMOUNT': 'value'}
+        )
+    else:
+        items = [
+            name for name in frame.columns
+            if name not in TEXT_COLUMNS and name not in DATE_COLUMNS and not name.endswith(('_DATE', '_YOY'))
+            and pd.api.types.is_float_dtype(frame[name])
+        ]
+        facts = frame.melt(id_vars=['REPORT_DATE'], value_vars=items, var_name='item', value_name='value')
+        facts = facts.rename(columns={'REPORT_DATE': 'report_date'})
+
+    facts = facts.dropna(subset=['report_date', 'item'])
+    # 同一报告期同一科目只保留第一条
+    facts = facts.drop_duplicates(subset=['report_date', 'item'], keep='first')
+    facts['report_date'] = facts['report_date'].dt.date
+    facts.insert(0, 'period', period)
+    facts.insert(0, 'statement', statement)
+    facts.insert(0, 'code', code)
+    facts.insert(0, 'market', market)
+    facts.insert(0, 'company', company)
+    return facts[_FACT_COLUMNS].reset_index(drop=True)
+
+
+def _date_strings(dates: Iterable) -> set:
+    """把报告日期统一为 YYYY-MM-DD 字符串"""
+    return {pd.Timestamp(d).date().isoformat() for d in dates}
+
+
+class StatementWarehouse:
+    """
+    本地财务报表仓库
+
+    所有公司、所有报表、所有报告期的数据写入同一张长表 statement_facts：
+    (company, market, code, statement, period, report_date, item, value)，
+    在公司、科目和报告日期上建索引，跨公司查询和同业对比直接走索引，无需逐个扫描报表文件。
+    每次操作打开一个短连接，不长期占用数据库文件。
+    """
+
+    def __init__(self, path: str = DEFAULT_WAREHOUSE_PATH):
+        """
+        Args:
+            path (str): DuckDB 数据库文件路径
+        """
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute(_SCHEMA)
+
+    def _connect(self):
+        return duckdb.connect(self.path)
+
+    def upsert_facts(self, facts: pd.DataFrame) -> int:
+        """
+        写入长表数据，主键相同的行（同一公司、报表、期间、报告日期、科目）被覆盖
+
+        Args:
+            facts (pd.DataFrame): statement_to_facts 的返回值
+
+        Returns:
+            int: 写入的行数
+        """
+        if facts.empty:
+            return 0
+        with self._lock, self._connect() as con:
+            con.register('incoming_facts', facts[_FACT_COLUMNS])
+            con.execute(f"""
+                INSERT OR REPLACE INTO statement_facts ({', '.join(_FACT_COLUMNS)}, updated_at)
+                SELECT {', '.join(_FACT_COLUMNS)}, current_timestamp FROM incoming_facts
+            """)
+            con.unregister('incoming_facts')
+        return len(facts)
+
+    def apply_changes(self, facts: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        只写入仓库中没有的行和取值发生变化的行（例如报表被重述），并记录同步状态
+
+        Args:
+            facts (pd.DataFrame): 同一张报表的长表数据（statement_to_facts 的返回值）
+
+        Returns:
+            Tuple[pd.DataFrame, pd.DataFrame]: (新增的行, 取值变化的行)，变化的行带有 old_value 列
+        """
+        if facts.empty:
+            return facts.iloc[0:0], facts.iloc[0:0].assign(old_value=[])
+        first = facts.iloc[0]
+        join = " AND ".join(f"f.{column} = i.{column}" for column in _KEY_COLUMNS)
+        columns = ', '.join(f"i.{column}" for column in _FACT_COLUMNS)
+        with self._lock, self._connect() as con:
+            con.register('incoming_facts', facts[_FACT_COLUMNS])
+            new_facts = con.execute(f"""
+                SELECT {columns} FROM incoming_facts i
+                WHERE NOT EXISTS (SELECT 1 FROM statement_facts f WHERE {join})
+                ORDER BY i.report_date, i.item
+            """).df()
+            changed_facts = con.execute(f"""
+                SELECT {columns}, f.value AS old_value FROM incoming_facts i
+                JOIN statement_facts f ON {join}
+                WHERE i.value IS DISTINCT FROM f.value
+                ORDER BY i.report_date, i.item
+            """).df()
+            con.execute(f"""
+                INSERT OR REPLACE INTO statement_facts ({', '.join(_FACT_COLUMNS)}, updated_at)
+                SELECT {columns}, current_timestamp FROM incoming_facts i
+                WHERE NOT EXISTS (SELECT 1 FROM statement_facts f WHERE {join} AND f.value IS NOT DISTINCT FROM i.value)
+            """)
+            con.unregister('incoming_facts')
+            changed = not new_facts.empty or not changed_facts.empty
+            con.execute("""
+                INSERT OR REPLACE INTO statement_sync
+                SELECT ?, ?, ?, ?, ?,
+                       (SELECT max(report_date) FROM statement_facts
+                        WHERE market = ? AND code = ? AND statement = ? AND period = ?),
+                       current_timestamp,
+                       CASE WHEN ? THEN current_timestamp ELSE (
+                           SELECT changed_at FROM statement_sync
+                           WHERE market = ? AND code = ? AND statement = ? AND period = ?
+                       ) END
+            """, [first['market'], first['code'], first['statement'], first['period'], first['company']]
+                 + [first['market'], first['code'], first['statement'], first['period'], changed]
+                 + [first['market'], first['code'], first['statement'], first['period']])
+        return new_facts, changed_facts
+
+    def upsert_statements(self, financial_statements: Dict[str, Optional[pd.DataFrame]],
+                          company: str, market: str, code: str, period: str = "年度") -> Dict[str, Dict]:
+        """
+        写入一家公司的报表，只写入新增和变化的行
+
+        Args:
+            financial_statements (Dict): {报表类型: DataFrame或None}
+            company (str): 公司名称
+            market (str): 股票市场
+            code (str): 股票代码
+            period (str): 报告期间
+
+        Returns:
+            Dict[str, Dict]: {报表类型: {'new_rows': 新增行数, 'changed_rows': 变化行数,
+                'new_report_dates': 新增的报告日期, 'changed_report_dates': 有取值变化的报告日期}}
+        """
+        summary = {}
+        for statement, df in financial_statements.items():
+            if df is None:
+                continue
+            facts = statement_to_facts(df, company, market, code, statement, period)
+            if facts.empty:
+                continue
+            known_dates = set(self.sync_state(market, code, statement, period).get('report_dates', []))
+            new_facts, changed_facts = self.apply_changes(facts)
+            new_dates = sorted(_date_strings(new_facts['report_date']) - known_dates)
+            summary[statement] = {
+                'new_rows': len(new_facts),
+                'changed_rows': len(changed_facts),
+                'new_report_dates': new_dates,
+                'changed_report_dates': sorted(_date_strings(changed_facts['report_date'])),
+            }
+        return summary
+
+    def sync_state(self, market: str, code: str, statement: str, period: str) -> Dict:
+        """
+        一张报表的同步状态
+
+        Returns:
+            Dict: {'company', 'latest_report_date', 'checked_at', 'changed_at', 'report_dates'}，
+                仓库中没有该报表时返回空字典
+        """
+        with self._lock, self._connect() as con:
+            row = con.execute("""
+                SELECT company, latest_report_date, checked_at, changed_at FROM statement_sync
+                WHERE market = ? AND code = ? AND statement = ? AND period = ?
+            """, [market, code, statement, period]).fetchone()
+            if row is None:
+                return {}
+            dates = con.execute("""
+                SELECT DISTINCT report_date FROM statement_facts
+                WHERE market = ? AND code = ? AND statement = ? AND period = ? ORDER BY report_date
+            """, [market, code, statement, period]).fetchall()
+        return {
+            'company': row[0], 'latest_report_date': row[1], 'checked_at': row[2], 'changed_at': row[3],
+            'report_dates': sorted(_date_strings(d[0] for d in dates)),
+        }
+
+    def sync_states(self) -> pd.DataFrame:
+        """全部报表的同步状态（每家公司每张报表最新的报告日期、最近检查和变化时间）"""
+        return self.query("SELECT * FROM statement_sync ORDER BY company, statement, period")
+
+    def write_table(self, name: str, df: pd.DataFrame):
+        """
+        把派生数据（例如财务比率表）整表写入仓库，已存在时替换
+
+        Args:
+            name (str): 表名
+            df (pd.DataFrame): 数据
+        """
+        if not name.isidentifier():
+            raise ValueError(f"无效的表名: {name}")
+        with self._lock, self._connect() as con:
+            con.register('incoming_table', df)
+            con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM incoming_table")
+            con.unregister('incoming_table')
+
+    def ingest_directory(self, save_dir: str) -> int:
+        """
+        把报表目录中（按 statements_manifest.json）已保存的Parquet报表导入仓库
+
+        Args:
+            save_dir (str): 报表目录
+
+        Returns:
+            int: 新增和变化的行数
+        """
+        total = 0
+        for name, info in read_manifest(save_dir)['files'].items():
+            path = os.path.join(save_dir, name)
+            if info.get('format') != 'parquet' or not os.path.isfile(path):
+                continue
+            new_facts, changed_facts = self.apply_changes(statement_to_facts(
+                pd.read_parquet(path), info['company'], info['market'], info['code'],
+                info['statement'], info['period']
+            ))
+            total += len(new_facts) + len(changed_facts)
+        return total
+
+    def query(self, sql: str, params: Optional[List] = None) -> pd.DataFrame:
+        """
+        在仓库上执行SQL查询
+
+        Args:
+            sql (str): SQL语句，表名为 statement_facts
+            params (List): 查询参数
+
+        Returns:
+            pd.DataFrame: 查询结果
+        """
+        with self._lock, self._connect() as con:
+            return con.execute(sql, params or []).df()
+
+    def facts(self, companies: Iterable[str] = None, items: Iterable[str] = None,
+              statement: str = None, period: str = None,
+              start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """
+        按公司、科目、报表类型和报告日期范围查询长表数据
+
+        Args:
+            companies (Iterable[str]): 公司名称列表，None表示全部
+            items (Iterable[str]): 科目名称列表，None表示全部
+            statement (str): 报表类型
+            period (str): 报告期间，例如 "年度"
+            start_date (str): 起始报告日期（含），例如 "2020-01-01"
+            end_date (str): 截止报告日期（含）
+
+        Returns:
+            pd.DataFrame: 列为 company, market, code, statement, period, report_date, item, value
+        """
+        conditions, params = [], []
+        if companies is not None:
+            companies = list(companies)
+            conditions.append(f"company IN ({', '.join(['?'] * len(companies)) or 'NULL'})")
+            params.extend(companies)
+        if items is not None:
+            items = list(items)
+            conditions.append(f"item IN ({', '.join(['?'] * len(items)) or 'NULL'})")
+            params.extend(items)
+        for column, value in (('statement', statement), ('period', period)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if start_date is not None:
+            conditions.append("report_date >= CAST(? AS DATE)")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("report_date <= CAST(? AS DATE)")
+            params.append(end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.query(
+            f"SELECT {', '.join(_FACT_COLUMNS)} FROM statement_facts {where} "
+            f"ORDER BY company, statement, report_date, item",
+            params,
+        )
+
+    def metric_table(self, metric_items: Dict[str, List[str]], companies: Iterable[str] = None,
+                     period: str = None) -> pd.DataFrame:
+        """
+        按指标候选科目提取各公司各报告期的指标宽表
+
+        港股和A股同一指标的科目名称不同，每个指标按候选科目的顺序取第一个有值的科目。
+
+        Args:
+            metric_items (Dict[str, List[str]]): {指标名: [候选科目, ...]}，按优先级排列
+            companies (Iterable[str]): 公司名称列表，None表示全部
+            period (str): 报告期间，None表示全部
+
+        Returns:
+            pd.DataFrame: 列为 company, market, code, period, report_date 以及各指标
+        """
+        candidates = pd.DataFrame(
+            [(metric, item, priority) for metric, items in metric_items.items() for priority, item in enumerate(items)],
+            columns=['metric', 'item', 'priority'],
+        )
+        conditions, params = ["f.value IS NOT NULL"], []
+        if companies is not None:
+            companies = list(companies)
+            conditions.append(f"f.company IN ({', '.join(['?'] * len(companies)) or 'NULL'})")
+            params.extend(companies)
+        if period is not None:
+            conditions.append("f.period = ?")
+            params.append(period)
+        with self._lock, self._connect() as con:
+            con.register('metric_candidates', candidates)
+            long_df = con.execute(f"""
+                SELECT f.company, f.market, f.code, f.period, f.report_date, c.metric, f.value
+                FROM statement_facts f
+                JOIN metric_candidates c ON f.item = c.item
+                WHERE {' AND '.join(conditions)}
+                QUALIFY row_number() OVER (
+                    PARTITION BY f.company, f.period, f.report_date, c.metric ORDER BY c.priority
+                ) = 1
+            """, params).df()
+
+        index = ['company', 'market', 'code', 'period', 'report_date']
+        if long_df.empty:
+            return pd.DataFrame(columns=index + list(metric_items))
+        table = long_df.pivot_table(index=index, columns='metric', values='value', aggfunc='first').reset_index()
+        table.columns.name = None
+        for metric in metric_items:
+            if metric not in table.columns:
+                table[metric] = float('nan')
+        return table[index + list(metric_items)].sort_values(['company', 'report_date']).reset_index(drop=True)
+
+    def peer_comparison(self, items: Iterable[str], companies: Iterable[str] = None,
+                        report_date: str = None, period: str = "年度") -> pd.DataFrame:
+        """
+        同业对比：各公司在同一报告日期（默认各自最新一期）的科目数值
+
+        Args:
+            items (Iterable[str]): 科目名称列表
+            companies (Iterable[str]): 公司名称列表，None表示全部
+            report_date (str): 报告日期，None表示各公司最新一期
+            period (str): 报告期间
+
+        Returns:
+            pd.DataFrame: 行为公司，列为 report_date 和各科目
+        """
+        facts = self.facts(companies=companies, items=items, period=period, start_date=report_date, end_date=report_date)
+        if facts.empty:
+            return pd.DataFrame(columns=['company', 'report_date'] + list(items))
+        latest = facts.groupby('company')['report_date'].transform('max')
+        facts = facts[facts['report_date'] == latest]
+        table = facts.pivot_table(index=['company', 'report_date'], columns='item', values='value', aggfunc='first')
+        table = table.reindex(columns=list(items)).reset_index()
+        table.columns.name = None
+        return table
+
+    def companies(self) -> pd.DataFrame:
+        """仓库中的公司及其报告期范围"""
+        return self.query("""
+            SELECT company, market, code, count(DISTINCT statement) AS statements,
+                   min(report_date) AS first_report_date, max(report_date) AS last_report_date,
+                   count(*) AS facts
+            FROM statement_facts GROUP BY company, market, code ORDER BY company
+        """)
+
+
+_warehouses: Dict[str, StatementWarehouse] = {}
+_warehouses_lock = threading.Lock()
+
+
+def get_statement_warehouse(path: str = None) -> StatementWarehouse:
+    """
+    获取进程级报表仓库（同一路径共享一个实例）
+
+    Args:
+        path (str): 数据库文件路径，默认读取环境变量 STATEMENT_WAREHOUSE_PATH
+    """
+    path = os.path.abspath(path or DEFAULT_WAREHOUSE_PATH)
+    with _warehouses_lock:
+        warehouse = _warehouses.get(path)
+        if warehouse is None:
+            warehouse = StatementWarehouse(path)
+            _warehouses[path] = warehouse
+        return warehouse